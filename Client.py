@@ -0,0 +1,132 @@
+from sources.general import BOT_PREFIX, MENTION_ME
+from typing import Awaitable, Callable, Optional
+from utils import handlePaginationReaction, toListen
+from CogTask import TaskException
+import discord
+from discord.ext import commands
+import time
+
+from Help import Help
+import Log
+import Metrics
+import sources.text as T
+
+L = T.LOG
+M = T.TASK.METRIC
+
+def determinePrefix(bot: commands.Bot, message: discord.Message):
+    if isinstance(message.channel, discord.DMChannel):
+        if message.content.startswith("bel."):
+            return "bel."
+        return ""
+    else:
+        return "bel."
+
+def makeClient(
+    botClass: type[commands.Bot]=commands.Bot,
+    route: Optional[Callable[[discord.Message], Awaitable]]=None,
+    routeReaction: Optional[Callable[[discord.RawReactionActionEvent], Awaitable]]=None,
+    metricsPort: Optional[int]=None,
+    **options
+) -> commands.Bot:
+    """ Builds the bot and registers its events.
+    
+    `route` and `routeReaction` take over from processing messages and pagination reactions
+    directly, so a cluster worker can hand them to whichever worker owns the user.
+    
+    Given `metricsPort`, every metric is served there locally for Prometheus to scrape.
+    """
+    
+    client = botClass(
+        command_prefix=determinePrefix,
+        case_insensitive=True,
+        help_command=Help(verify_checks=False),
+        **options
+    )
+    client.loop.create_task(toListen.sweepForever())
+    client.loop.create_task(Metrics.watchLag(Metrics.histogram(M.LOOP_LAG, M.LOOP_LAG_DESC), M.LAG_INTERVAL))
+    if metricsPort is not None:
+        client.loop.create_task(Metrics.serve(M.HOST, metricsPort))
+    commandLatency = Metrics.histogram(M.COMMAND_LATENCY, M.COMMAND_LATENCY_DESC)
+    commandCount = Metrics.counter(M.COMMANDS, M.COMMANDS_DESC)
+    commandFailures = Metrics.counter(M.COMMAND_FAILURES, M.COMMAND_FAILURES_DESC)
+
+    @client.event
+    async def on_ready():
+        Log.event(L.loggedIn, user=str(client.user))
+
+    @client.event
+    async def on_message(message: discord.Message):
+        if message.author == client.user:
+            return
+        
+        if route:
+            await route(message)
+        else:
+            await client.process_commands(message)
+
+    async def onReaction(payload: discord.RawReactionActionEvent):
+        if routeReaction:
+            await routeReaction(payload)
+        else:
+            await handlePaginationReaction(payload.message_id, payload.user_id, str(payload.emoji))
+
+    @client.event
+    async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+        # the member is only given in guilds; in DMs, the only other reactions are the bot's own
+        if payload.user_id == client.user.id or (payload.member and payload.member.bot): return
+        await onReaction(payload)
+
+    @client.event
+    async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+        # the bot can't take reactions back in DMs, so clicking one a second time removes it; that's a click too
+        if payload.guild_id is not None or payload.user_id == client.user.id: return
+        await onReaction(payload)
+
+    @client.event
+    async def on_command_error(ctx: commands.Context, error: commands.CommandError):
+        toRaise = None
+        toSend = ""
+        if isinstance(error, commands.MissingRequiredArgument):
+            toSend += f"You missed a required argument `{error.param.name}`."
+        elif isinstance(error, commands.BadUnionArgument):
+            toSend += f"There was an error converting the argument `{error.param.name}`."
+        elif isinstance(error, commands.CommandNotFound):
+            toSend += f"This command does not exist!"
+        elif isinstance(error, commands.CommandInvokeError):
+            error: Exception = error.original
+            if isinstance(error, TaskException):
+                toSend += error.message
+            else:
+                toSend += f"An unexpected error occurred. Please let {MENTION_ME} know."
+                toRaise = error
+        else:
+            toSend += f"An unexpected error occurred. Please let {MENTION_ME} know."
+            toRaise = error
+        toSend += f"\nIf you need help with this command, please use `{BOT_PREFIX}help {ctx.command.name}`."
+        await ctx.send(toSend)
+        if toRaise:
+            raise toRaise
+
+    @client.check
+    async def globalCheck(ctx: commands.Context):
+        ctx.startedAt = time.perf_counter()
+        return True
+
+    @client.after_invoke
+    async def logCommand(ctx: commands.Context):
+        latency = time.perf_counter() - ctx.startedAt
+        commandLatency.observe(latency)
+        commandCount.inc()
+        if ctx.command_failed:
+            commandFailures.inc()
+        Log.event(
+            L.command,
+            user=ctx.author.id,
+            command=ctx.command.qualified_name,
+            channel="dm" if isinstance(ctx.channel, discord.DMChannel) else "guild",
+            latency=round(latency, 6),
+            failed=ctx.command_failed
+        )
+    
+    return client
@@ -0,0 +1,465 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import multiprocessing as mp
+import os
+import queue
+import threading
+from typing import Callable, Optional
+import discord
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+
+from Client import determinePrefix, makeClient
+from CogTask import CogTask
+import Log
+import sources.text as T
+from utils import handlePaginationReaction
+
+S = T.TASK
+L = T.LOG
+
+def owner(userID: int, members: list[int]) -> int:
+    """ Picks the worker that owns a user by rendezvous hashing, so a new worker only takes users from the others and none move between old workers. """
+
+    return max(members, key=lambda workerID: hashlib.blake2b(f"{workerID}:{userID}".encode(), digest_size=8).digest())
+
+def shardRange(index: int, workers: int, shards: int) -> list[int]:
+    """ Splits the gateway shards into contiguous ranges, one per worker. """
+
+    size, extra = divmod(shards, workers)
+    start = index * size + min(index, extra)
+    return list(range(start, start + size + (index < extra)))
+
+# Messages between the supervisor and its workers are tuples starting with their kind.
+# Workers put everything on the supervisor's queue, which routes it on to the target worker's inbox:
+#   ("command" | "reaction", target, envelope)  a gateway event for a user the target owns
+#   ("import", target, source, users)           users handed off to the target, as {userID: (tasks, tz, lastID)}
+#   ("ack", target, userIDs)                    the target can forget these users now
+#   ("reply", replyID, text), ("dm", userID, text)  output bound for the local gateway
+# and these, which the supervisor handles itself:
+#   ("handedOff", workerID)                     the worker has handed off every user it was asked to
+# Workers get ("members", workerIDs), ("route", workerIDs), ("gateway", envelope), ("stop",),
+# and the above without the target.
+#
+# Adding a worker moves users in two steps. On ("members", ...), each worker suspends the users it
+# no longer owns, holding their events, and exports them. Once the new owner acks them, it forgets
+# them and passes their held events on. Once every worker has, ("route", ...) has every worker route
+# by the new members; until then, events for moved users still go to their old owner, which passes them on.
+
+class LocalUser:
+    def __init__(self, userID: int, name: str):
+        self.id = userID
+        self.name = name
+        self.bot = False
+        self.mention = f"<@{userID}>"
+
+    def __eq__(self, other):
+        return isinstance(other, LocalUser) and other.id == self.id
+
+class LocalDMChannel(discord.DMChannel):
+    """ A DM channel whose messages go back to the local gateway instead of Discord. """
+
+    def __init__(self, recipient: LocalUser, outbox: mp.Queue):
+        self.id = recipient.id
+        self.recipient = recipient
+        self.outbox = outbox
+
+    async def send(self, content=None, **kwargs):
+        self.outbox.put(("dm", self.recipient.id, content))
+
+class LocalTextChannel:
+    def __init__(self, channelID: int):
+        self.id = channelID
+        self.name = str(channelID)
+
+class LocalMessage:
+    def __init__(self, envelope: dict, outbox: mp.Queue):
+        self.id = envelope["message"]
+        self.content = envelope["content"]
+        self.author = LocalUser(envelope["user"], envelope["name"])
+        self.guild = None
+        self._state = None
+        self.attachments = []
+        if envelope["dm"]:
+            self.channel = LocalDMChannel(self.author, outbox)
+        else:
+            self.channel = LocalTextChannel(envelope["channel"])
+
+class LocalSentMessage:
+    """ A message sent to the local gateway, which can be reacted to and edited as far as pagination cares. """
+
+    def __init__(self, messageID: int, channel):
+        self.id = messageID
+        self.channel = channel
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def clear_reactions(self):
+        pass
+
+    async def remove_reaction(self, emoji, member):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+class LocalContext(commands.Context):
+    """ A command context that sends its replies back to the local gateway. """
+
+    async def send(self, content=None, *, embed: Optional[discord.Embed]=None, **kwargs):
+        if content is None and embed:
+            content = embed.description
+        self.outbox.put(("reply", self.message.id, content))
+        return LocalSentMessage(self.message.id, self.channel)
+
+class LocalResolver:
+    """ Stands in for the DM channel resolver, delivering reminders to the local gateway. """
+
+    def __init__(self, outbox: mp.Queue):
+        self.outbox = outbox
+
+    async def resolve(self, userID: int):
+        return LocalDMChannel(LocalUser(userID, S.CLUSTER.LOCAL_NAME(userID)), self.outbox)
+
+    async def prefetch(self, userIDs):
+        pass
+
+class Worker:
+    """ One process of a cluster: a bot for a range of gateway shards, and the tasks of the users it owns.
+
+    Gateway events from users it doesn't own are forwarded to their owner through the supervisor,
+    which fetches the message again and handles it. Without a token, the worker doesn't connect to
+    Discord at all and takes its events from a LocalGateway instead.
+    """
+
+    def __init__(self, workerID: int, members: list[int], inbox: mp.Queue, outbox: mp.Queue, shardIDs: list[int], shardCount: int, token: Optional[str]=None):
+        self.workerID = workerID
+        # the workers events are routed between
+        self.members = members
+        # the workers after a rebalance that's still going, which users this worker owned move to
+        self.nextMembers: Optional[list[int]] = None
+        # (kind, envelope) events for users being handed off, passed on once the new owner has them
+        self.held: dict[int, list[tuple[str, dict]]] = {}
+        self.inbox = inbox
+        self.outbox = outbox
+        self.shardIDs = shardIDs
+        self.shardCount = shardCount
+        self.token = token
+
+    @property
+    def local(self):
+        return self.token is None
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        Log.start(T.LOG.workerName(self.workerID))
+        metricsPort = os.getenv("BRONZOS_METRICS_PORT")
+        metricsPort = int(metricsPort) + self.workerID if metricsPort else None
+        if self.local:
+            self.client = makeClient(metricsPort=metricsPort)
+        else:
+            self.client = makeClient(
+                commands.AutoShardedBot, route=self.route, routeReaction=self.routeReaction, metricsPort=metricsPort,
+                shard_ids=self.shardIDs, shard_count=self.shardCount
+            )
+        self.cog = CogTask(self.client, shard=self.workerID)
+        self.client.add_cog(self.cog)
+        self.stopped = asyncio.Event()
+        Log.event(L.workerStarted, worker=self.workerID, shards=self.shardIDs)
+
+        listener = loop.create_task(self.listen())
+        try:
+            if self.local:
+                self.cog.delivery.resolver = LocalResolver(self.outbox)
+                self.client.dispatch("ready")
+                loop.run_until_complete(self.stopped.wait())
+            else:
+                self.client.run(self.token)
+        finally:
+            listener.cancel()
+            self.cog.close()
+            Log.stop()
+
+    async def listen(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.inbox.get)
+            kind = message[0]
+            if kind == "stop":
+                self.stopped.set()
+                if not self.local:
+                    await self.client.close()
+                return
+            try:
+                if kind == "members":
+                    await self.rebalance(message[1])
+                elif kind == "route":
+                    self.switchRouting(message[1])
+                elif kind in ["gateway", "command"]:
+                    await self.execute(message[1])
+                elif kind == "reaction":
+                    await self.react(message[1])
+                elif kind == "import":
+                    await self.takeOver(message[1], message[2])
+                elif kind == "ack":
+                    await self.forget(message[1])
+            except Exception as e:
+                Log.exception(L.workerError, e, worker=self.workerID, kind=kind)
+
+    def ownerOf(self, userID: int) -> int:
+        target = owner(userID, self.members)
+        if target == self.workerID and self.nextMembers is not None:
+            # until everyone routes by the new members, this worker passes on the users it handed off
+            target = owner(userID, self.nextMembers)
+        return target
+
+    def owns(self, userID: int):
+        return userID in self.held or self.ownerOf(userID) == self.workerID
+
+    def forward(self, kind: str, userID: int, envelope: dict):
+        if userID in self.held:
+            self.held[userID].append((kind, envelope))
+        else:
+            self.outbox.put((kind, self.ownerOf(userID), envelope))
+
+    def handles(self, userID: int):
+        """ Whether this worker runs a user's commands itself, rather than holding or forwarding them. """
+
+        return userID not in self.held and self.owns(userID)
+
+    async def route(self, message: discord.Message):
+        if self.handles(message.author.id):
+            await self.client.process_commands(message)
+            return
+        # only commands are worth forwarding, and working that out needs no requests
+        ctx = await self.client.get_context(message)
+        if ctx.valid:
+            self.forward("command", message.author.id, {"channel": message.channel.id, "message": message.id, "user": message.author.id})
+
+    async def routeReaction(self, payload: discord.RawReactionActionEvent):
+        # the paginator is on the worker that owns whoever asked for it; a held user's are still here
+        if self.owns(payload.user_id):
+            await handlePaginationReaction(payload.message_id, payload.user_id, str(payload.emoji))
+        else:
+            self.forward("reaction", payload.user_id, {"message": payload.message_id, "user": payload.user_id, "emoji": str(payload.emoji)})
+
+    async def fetchMessage(self, envelope: dict) -> discord.Message:
+        channel = self.client.get_channel(envelope["channel"]) or await self.client.fetch_channel(envelope["channel"])
+        return await channel.fetch_message(envelope["message"])
+
+    async def execute(self, envelope: dict):
+        """ Runs a command from the gateway or forwarded by another worker, passing it on if this worker doesn't handle the user. """
+
+        if not self.handles(envelope["user"]):
+            self.forward("command", envelope["user"], envelope)
+        elif self.local:
+            await self.executeLocal(envelope)
+        else:
+            await self.client.process_commands(await self.fetchMessage(envelope))
+
+    async def react(self, envelope: dict):
+        await handlePaginationReaction(envelope["message"], envelope["user"], envelope["emoji"])
+
+    async def executeLocal(self, envelope: dict):
+        """ Runs a command from the local gateway the way `process_commands` would. """
+
+        message = LocalMessage(envelope, self.outbox)
+        prefix = determinePrefix(self.client, message)
+        view = StringView(message.content)
+        ctx = LocalContext(prefix=prefix, view=view, bot=self.client, message=message)
+        ctx.outbox = self.outbox
+        if not view.skip_string(prefix):
+            return
+        ctx.invoked_with = view.get_word()
+        ctx.command = self.client.all_commands.get(ctx.invoked_with)
+        await self.client.invoke(ctx)
+
+    async def rebalance(self, members: list[int]):
+        """ Hands every user now owned by another worker over to it.
+
+        They're suspended and their events held from the start, so nothing changes them after
+        they're exported, and they're kept until the new owner acknowledges them.
+        """
+
+        userIDs = await self.cog.userIDs()
+        self.nextMembers = members
+        moving = {userID: owner(userID, members) for userID in userIDs if owner(userID, members) != self.workerID}
+        for userID in moving:
+            self.held[userID] = []
+        handoffs: dict[int, dict[int, tuple]] = {}
+        for userID, target in moving.items():
+            handoffs.setdefault(target, {})[userID] = await self.cog.exportUser(userID)
+        for target, users in handoffs.items():
+            Log.event(L.handoff, worker=self.workerID, users=len(users), target=target)
+            self.outbox.put(("import", target, self.workerID, users))
+        if not moving:
+            self.outbox.put(("handedOff", self.workerID))
+
+    def switchRouting(self, members: list[int]):
+        self.members = members
+        self.nextMembers = None
+
+    async def takeOver(self, source: int, users: dict[int, tuple]):
+        for userID, (tasks, tz, lastID) in users.items():
+            self.cog.importUser(userID, tasks, tz, lastID)
+        # they have to be on disk here before the old owner lets go of them
+        await self.cog.persister.flush()
+        self.outbox.put(("ack", source, list(users)))
+
+    async def forget(self, userIDs: list[int]):
+        for userID in userIDs:
+            await self.cog.dropUser(userID)
+            # the new owner has them now, so their held events can go to it
+            for kind, envelope in self.held.pop(userID, []):
+                self.forward(kind, userID, envelope)
+        if not self.held:
+            self.outbox.put(("handedOff", self.workerID))
+
+def runWorker(*args):
+    Worker(*args).run()
+
+class Supervisor:
+    """ Starts the worker processes of a cluster and routes messages between them. """
+
+    def __init__(self, workers: int, shards: Optional[int]=None):
+        self.workers = workers
+        self.shards = shards or workers
+        self.context = mp.get_context("spawn")
+        self.queue = self.context.Queue()
+        self.inboxes: dict[int, mp.Queue] = {}
+        self.processes: dict[int, mp.Process] = {}
+        self.members: list[int] = []
+        # workers that haven't finished handing off users since the last one was added
+        self.handingOff: set[int] = set()
+        self.shardOwners: dict[int, int] = {}
+        self.token: Optional[str] = None
+        # gets the local gateway's output
+        self.onOutput: Optional[Callable[[tuple], None]] = None
+
+    def spawn(self, workerID: int, shardIDs: list[int]):
+        inbox = self.context.Queue()
+        process = self.context.Process(
+            target=runWorker, name=f"bronzos-worker-{workerID}",
+            args=(workerID, list(self.members), inbox, self.queue, shardIDs, self.shards, self.token)
+        )
+        self.inboxes[workerID] = inbox
+        self.processes[workerID] = process
+        for shard in shardIDs:
+            self.shardOwners[shard] = workerID
+        process.start()
+
+    def start(self, token: Optional[str]=None):
+        """ Starts every worker, connecting them to Discord if given a token. """
+
+        self.token = token
+        self.members = list(range(self.workers))
+        for index in self.members:
+            self.spawn(index, shardRange(index, self.workers, self.shards))
+        self.router = threading.Thread(target=self.routeMessages, daemon=True)
+        self.router.start()
+
+    def run(self, token: Optional[str]=None):
+        self.start(token)
+        try:
+            for process in list(self.processes.values()):
+                process.join()
+        except KeyboardInterrupt:
+            self.stop()
+
+    def routeMessages(self):
+        while True:
+            message = self.queue.get()
+            kind = message[0]
+            if kind == "stop":
+                return
+            if kind in ["reply", "dm"]:
+                if self.onOutput:
+                    self.onOutput(message)
+            elif kind == "handedOff":
+                self.handingOff.discard(message[1])
+                if not self.handingOff:
+                    for inbox in self.inboxes.values():
+                        inbox.put(("route", list(self.members)))
+            else:
+                # the target is always second; the worker doesn't need to see it
+                self.inboxes[message[1]].put((kind, *message[2:]))
+
+    def addWorker(self) -> int:
+        """ Starts another worker and has the others hand over the users it now owns.
+
+        Gateway shards are fixed when workers start, so the new worker handles no gateway events
+        of its own; its users' commands are forwarded to it by whichever worker gets them.
+        """
+
+        workerID = max(self.members) + 1
+        self.members.append(workerID)
+        self.handingOff = set(self.members[:-1])
+        self.spawn(workerID, [])
+        for existing in self.members[:-1]:
+            self.inboxes[existing].put(("members", list(self.members)))
+        return workerID
+
+    def stop(self):
+        for inbox in self.inboxes.values():
+            inbox.put(("stop",))
+        for process in self.processes.values():
+            process.join()
+        self.queue.put(("stop",))
+        self.router.join()
+
+class LocalGateway:
+    """ Stands in for Discord so a cluster can be run on one machine without connecting.
+
+    Commands are sent to the worker whose gateway shards would get them from Discord, and
+    replies and reminders come back here.
+    """
+
+    def __init__(self, supervisor: Supervisor):
+        self.supervisor = supervisor
+        supervisor.onOutput = self.collect
+        self.lock = threading.Lock()
+        self.nextID = 0
+        self.replies: dict[int, queue.Queue] = {}
+        self.dms: dict[int, queue.Queue] = {}
+
+    def collect(self, message: tuple):
+        kind, key, text = message
+        with self.lock:
+            if kind == "reply":
+                # nobody's waiting on replies after the first
+                target = self.replies.get(key)
+            else:
+                target = self.dms.setdefault(key, queue.Queue())
+        if target:
+            target.put(text)
+
+    def send(self, userID: int, content: str, guildID: Optional[int]=None, timeout: float=S.CLUSTER.REPLY_TIMEOUT) -> str:
+        """ Sends a command as a user, in a DM if there's no guild, and waits for the first reply. """
+
+        with self.lock:
+            self.nextID += 1
+            messageID = self.nextID
+            replies = self.replies.setdefault(messageID, queue.Queue())
+        # Discord puts DMs on shard 0, and guilds on the shard their ID maps to
+        shard = 0 if guildID is None else (guildID >> 22) % self.supervisor.shards
+        self.supervisor.inboxes[self.supervisor.shardOwners[shard]].put(("gateway", {
+            "user": userID,
+            "name": S.CLUSTER.LOCAL_NAME(userID),
+            "channel": guildID or userID,
+            "message": messageID,
+            "content": content,
+            "dm": guildID is None
+        }))
+        try:
+            return replies.get(timeout=timeout)
+        finally:
+            with self.lock:
+                self.replies.pop(messageID, None)
+
+    def waitForDM(self, userID: int, timeout: float=S.CLUSTER.REPLY_TIMEOUT) -> str:
+        with self.lock:
+            dms = self.dms.setdefault(userID, queue.Queue())
+        return dms.get(timeout=timeout)
@@ -1,69 +1,330 @@
 
+import asyncio
+from collections import OrderedDict
+import os
 import discord
-from discord.ext import commands, tasks as dasks
+from discord.ext import commands
 import datetime as dt
-import json
+from datetime import tzinfo
 from pytz import UnknownTimeZoneError, timezone
-from typing import Optional
+import tempfile
+import time
+from typing import IO, Optional
 
+from Delivery import Delivery
+from Exporter import FORMATS, Export, writeExport
+from Importer import readTasks
+import Log
+import Metrics
 from sources.general import _FORMAT
 import sources.text as T
-from Taskmaster import Task, Parser, Taskmaster, TaskException
+from Storage import PersistenceWorker, SQLiteStorage, openStorage
+from utils import LazyPages, paginate
+from Taskmaster import TIME_ERRORS, Task, Parser, TaskException, localTime, taskFromjson
+from TieredTaskmaster import TieredTaskmaster
 
 S = T.TASK
+L = T.LOG
 UTC = timezone("UTC")
 
 class CogTask(commands.Cog, name=S.COG.NAME, description=S.COG.DESC):
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, shard: Optional[int]=None):
         self.bot = bot
-        with open(S.PATH.TASKMASTER, "r") as f:
-            self.taskmaster = Taskmaster.fromjson(json.load(f))
-        with open(S.PATH.TZPREFS, "r") as f:
-            self.tzprefs: dict[str, str] = json.load(f)
+        self.storage = openStorage(shard)
+        self.taskmaster = self.storage.load()
+        self.tzprefs: dict[str, str] = self.storage.loadTZPrefs()
+        # resolved time zones by user ID, or None for users without a valid one, least recently used first
+        self.tzCache: OrderedDict[int, Optional[tzinfo]] = OrderedDict()
+        # users being handed off to another cluster worker, whose reminders it sends from the moment they're exported
+        self.suspended: set[int] = set()
+        # users' rendered `tasks` pages, least recently listed first; dropped whenever their tasks or time zone change
+        self.taskPages: OrderedDict[int, LazyPages] = OrderedDict()
+        self.pageChanges = 0
+        self.persister = PersistenceWorker(self.storage, float(os.getenv("BRONZOS_FLUSH_DELAY", S.STORAGE.MAX_DELAY)))
         
-        self.update.start()
+        self.delivery = Delivery(self.bot)
+        self.updateDuration = Metrics.histogram(S.METRIC.UPDATE_DURATION, S.METRIC.UPDATE_DURATION_DESC)
+        self.tasksScanned = Metrics.histogram(S.METRIC.TASKS_SCANNED, S.METRIC.TASKS_SCANNED_DESC)
+        self.tasksFired = Metrics.histogram(S.METRIC.TASKS_FIRED, S.METRIC.TASKS_FIRED_DESC)
+        self.backgroundTasks: set[asyncio.Task] = set()
+        # Set whenever the earliest deadline changes, so the scheduler can stop sleeping and look again.
+        self.wakeup = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.scheduler = self.bot.loop.create_task(self.schedule())
+        # with tiered storage, only tasks due soon are in the Taskmaster; the rest are read from disk when needed
+        self.tiered = isinstance(self.taskmaster, TieredTaskmaster)
+        self.promoter = self.bot.loop.create_task(self.promote()) if self.tiered else None
+    
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.ready.set()
+    
+    def cog_unload(self):
+        self.close()
+    
+    def close(self):
+        """ Stops the scheduler and writes out anything that hasn't been persisted yet. """
+        
+        self.scheduler.cancel()
+        if self.promoter:
+            self.promoter.cancel()
+        self.persister.close()
 
     def writeTaskmaster(self):
-        with open(S.PATH.TASKMASTER, "w") as f:
-            json.dump(self.taskmaster.asjson(), f)
+        self.persister.markDirty()
+    
+    async def schedule(self):
+        """ Sleeps until the earliest task is due, or until the earliest deadline changes. """
+        
+        await self.ready.wait()
+        lead = dt.timedelta(seconds=S.DELIVERY.PREFETCH)
+        # every task due by this time has had its user's DM channel resolved ahead of time
+        prefetched = dt.datetime.min.replace(tzinfo=UTC)
+        while True:
+            self.wakeup.clear()
+            now = dt.datetime.now(UTC)
+            nextDue = self.taskmaster.nextDue()
+            if nextDue is not None and nextDue > prefetched and nextDue - now <= lead:
+                prefetched = now + lead
+                self.background(self.delivery.resolver.prefetch(self.taskmaster.dueWithin(prefetched)))
+            
+            if nextDue is None:
+                timeout = None
+            elif nextDue > prefetched:
+                # wake up early to prefetch, then go back to sleep until it's due
+                timeout = (nextDue - lead - now).total_seconds()
+            else:
+                timeout = (nextDue - now).total_seconds()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    if nextDue > prefetched:
+                        continue
+            try:
+                await self.update()
+            except Exception as e:
+                Log.exception(L.updateFailed, e)
+    
+    async def promote(self):
+        """ Brings tasks in from disk as the tiered storage's horizon moves forward. """
+        
+        horizon: dt.timedelta = self.storage.horizon
+        while True:
+            await asyncio.sleep(horizon.total_seconds() / S.STORAGE.PROMOTIONS)
+            try:
+                after, until = self.taskmaster.startPromotion(dt.datetime.now(UTC) + horizon)
+                rows = await self.persister.read(self.storage.rowsDueBetween, after, until)
+                previousDue = self.taskmaster.nextDue()
+                self.taskmaster.promote(rows)
+                self.wakeIfChanged(previousDue)
+            except Exception as e:
+                Log.exception(L.promotionFailed, e)
+    
+    def background(self, coro):
+        task = asyncio.get_event_loop().create_task(coro)
+        self.backgroundTasks.add(task)
+        task.add_done_callback(self.backgroundTasks.discard)
+    
+    def wakeIfChanged(self, previousDue: Optional[dt.datetime]):
+        if self.taskmaster.nextDue() != previousDue:
+            self.wakeup.set()
     
-    @dasks.loop(seconds=1)
     async def update(self):
-        time = dt.datetime.now(UTC)
-        messages = await self.taskmaster.update(time)
+        start = time.perf_counter()
+        messages = await self.taskmaster.update(dt.datetime.now(UTC))
+        self.updateDuration.observe(time.perf_counter() - start)
+        self.tasksScanned.observe(self.taskmaster.lastScanned)
+        self.tasksFired.observe(sum(len(userMessages) for userMessages in messages.values()))
         if messages:
-            for userID in messages:
-                user = await self.bot.fetch_user(userID)
-                for message in messages[userID]:
-                    await user.send(S.INFO.ALERT(message))
-                    print(f"[{str(dt.datetime.now().time())[:-7]}] Task for {user.name} triggered: {message}")
             self.writeTaskmaster()
+            for userID in messages:
+                self.invalidatePages(userID)
+            for userID in self.suspended & messages.keys():
+                # the new owner got them as they were before firing, so it sends them itself
+                del messages[userID]
+            # deliver in the background so a large batch doesn't hold up the next due task
+            self.background(self.delivery.deliver(messages))
+    
+    async def getTasks(self, userID: int) -> list[Task]:
+        """ Gets a user's tasks, soonest first, including the ones only on disk with tiered storage. """
+        
+        if self.tiered:
+            return await self.persister.read(self.storage.userTasks, userID)
+        return self.taskmaster.getSortedTasks(userID) or []
+    
+    def removeTasks(self, userID: int, tasks: list[Task]):
+        """ Removes some of a user's tasks. Their changes are written together, in one transaction with SQLite. """
+        
+        previousDue = self.taskmaster.nextDue()
+        self.taskmaster.removeTasks(userID, [task.id for task in tasks])
+        self.wakeIfChanged(previousDue)
+        self.invalidatePages(userID)
+        self.writeTaskmaster()
+    
+    async def userIDs(self) -> set[int]:
+        """ Gets every user with tasks or a time zone here. """
+        
+        if self.tiered:
+            userIDs = await self.persister.read(self.storage.userIDs)
+        else:
+            userIDs = {userID for userID, _ in self.taskmaster.items()}
+        return userIDs | {int(userID) for userID in self.tzprefs}
+    
+    async def exportUser(self, userID: int) -> tuple[list[dict], Optional[str], int]:
+        """ Gets a user's tasks as JSON along with their time zone and last ID, for handing them to another cluster worker.
+        
+        The user's reminders stop being sent here, and changes to them shouldn't be made until they're dropped.
+        """
+        
+        self.suspended.add(userID)
+        # in ID order, so the tasks keep their IDs when they're added back in that order
+        tasks = sorted(await self.getTasks(userID), key=lambda task: task.id)
+        return [task.asjson() for task in tasks], self.tzprefs.get(str(userID)), self.taskmaster.lastIDs.get(userID, 0)
+    
+    def importUser(self, userID: int, tasks: list[dict], tz: Optional[str], lastID: int):
+        """ Takes over a user handed off by another cluster worker. Flush the persister before acknowledging the handoff. """
+        
+        previousDue = self.taskmaster.nextDue()
+        self.taskmaster.addTasks([taskFromjson(taskObj) for taskObj in tasks], userID)
+        # the user's removed tasks took their IDs with them, so the count carries on from the old owner's
+        self.taskmaster.takeLastID(userID, lastID)
+        if tz:
+            self.setTZPref(userID, tz)
+        self.invalidatePages(userID)
+        self.wakeIfChanged(previousDue)
+    
+    async def dropUser(self, userID: int):
+        tasks = list(await self.getTasks(userID))
+        if self.tzprefs.pop(str(userID), None):
+            self.storage.removeTZPref(userID)
+        self.tzCache.pop(userID, None)
+        self.removeTasks(userID, tasks)
+        self.suspended.discard(userID)
     
     @commands.command(**S.CREATE.meta)
     async def create(self, ctx: commands.Context, *, args: str):
         if not args:
             raise TaskException(S.ERR.NO_ENTRY)
         
-        parser = Parser(args.split(" "))
-        userTZ = self.getTZForUser(ctx.author.id)
-        if not userTZ:
-            raise TaskException(S.ERR.NO_TZ)
-        task = parser.getAsTask(dt.datetime.now())
+        try:
+            parser = Parser(args.split(" "))
+            userTZ = self.getTZForUser(ctx.author.id)
+            if not userTZ:
+                raise TaskException(S.ERR.NO_TZ)
+            task = parser.getAsTask(dt.datetime.now())
+        except TIME_ERRORS:
+            raise TaskException(S.ERR.INVALID_TIME)
+        previousDue = self.taskmaster.nextDue()
         self.taskmaster.addTask(task, ctx.author.id)
+        self.wakeIfChanged(previousDue)
+        self.invalidatePages(ctx.author.id)
+        self.writeTaskmaster()
+        await ctx.send(S.INFO.TASK_CREATED(localTime(task.ts, userTZ).strftime(_FORMAT), parser.getMessage()))
+    
+    @commands.command(**S.IMPORT.meta)
+    async def importTasks(self, ctx: commands.Context):
+        userID = ctx.author.id
+        userTZ = self.getTZForUserOrFail(userID)
+        if not ctx.message.attachments:
+            raise TaskException(S.ERR.NO_ATTACHMENT)
+        attachment: discord.Attachment = ctx.message.attachments[0]
+        if attachment.size > S.IMPORTING.MAX_SIZE:
+            raise TaskException(S.ERR.IMPORT_TOO_BIG(S.IMPORTING.MAX_SIZE))
+        raw = await attachment.read()
+        # parsing a big file takes a while, so it's done in a thread to keep the scheduler and other commands going
+        result = await self.bot.loop.run_in_executor(None, readTasks, raw, attachment.filename, userTZ, dt.datetime.now())
+        
+        # every task goes in at once, so they're written in one batch
+        previousDue = self.taskmaster.nextDue()
+        self.taskmaster.addTasks(result.tasks, userID)
+        self.wakeIfChanged(previousDue)
+        self.invalidatePages(userID)
         self.writeTaskmaster()
-        await ctx.send(S.INFO.TASK_CREATED(task.getWhen().astimezone(userTZ).strftime(_FORMAT), parser.getMessage()))
+        
+        reply = S.INFO.IMPORTED(len(result.tasks))
+        if result.failures:
+            reply += S.INFO.IMPORT_FAILURES(len(result.failures))
+            for lineNo, entry, reason in result.failures[:S.IMPORTING.MAX_FAILURES_SHOWN]:
+                reply += S.INFO.IMPORT_FAILURE(lineNo, entry, reason)
+            if len(result.failures) > S.IMPORTING.MAX_FAILURES_SHOWN:
+                reply += S.INFO.IMPORT_MORE_FAILURES(len(result.failures) - S.IMPORTING.MAX_FAILURES_SHOWN)
+        await ctx.send(reply)
+    
+    async def exportTasks(self, fmt: str, file: IO[bytes], userID: Optional[int]=None) -> int:
+        """ Writes every task, or one user's, to `file` a row at a time, reading them straight from disk with SQLite.
+        
+        Otherwise everyone's tasks are copied and written a user at a time, so the export isn't of one
+        moment: a change made while it runs may or may not be in it.
+        """
+        
+        if isinstance(self.storage, SQLiteStorage):
+            # the database is only used from the persistence worker's thread, which also makes sure it has every change
+            return await self.persister.read(writeExport, self.storage.iterTasks(userID), fmt, file)
+        loop = self.bot.loop
+        if userID is not None:
+            return await loop.run_in_executor(None, writeExport, self.taskmaster.itemsSnapshot(userID), fmt, file)
+        # copying everyone's tasks at once would hold up the loop, so they're copied and written a batch at a time
+        export = await loop.run_in_executor(None, Export, fmt, file)
+        for batch in self.taskmaster.snapshotBatches():
+            await loop.run_in_executor(None, export.write, batch)
+        return await loop.run_in_executor(None, export.finish)
     
-    def getTasksOrFail(self, userID: int):
-        tasks = self.taskmaster.getTasks(userID)
+    @commands.command(**S.EXPORT.meta)
+    async def export(self, ctx: commands.Context, fmt: str=S.EXPORTING.JSONL, scope: Optional[str]=None):
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise TaskException(S.ERR.EXPORT_FORMAT(fmt))
+        
+        if scope and scope.lower() == S.EXPORTING.ALL:
+            if not await self.bot.is_owner(ctx.author):
+                raise TaskException(S.ERR.EXPORT_OWNER_ONLY)
+            os.makedirs(S.PATH.EXPORTS, exist_ok=True)
+            path = os.path.join(S.PATH.EXPORTS, S.EXPORTING.FILENAME(dt.datetime.now(UTC).strftime("%Y%m%d-%H%M%S"), fmt))
+            with open(path, "w+b") as f:
+                count = await self.exportTasks(fmt, f)
+                if f.tell() > S.EXPORTING.MAX_UPLOAD:
+                    # it's still saved, just too big to send
+                    await ctx.send(S.INFO.EXPORT_SAVED(count, path))
+                    return
+                f.seek(0)
+                await ctx.send(S.INFO.EXPORT_SAVED(count, path), file=discord.File(f, os.path.basename(path)))
+            return
+        
+        with tempfile.TemporaryFile() as f:
+            count = await self.exportTasks(fmt, f, ctx.author.id)
+            if not count:
+                raise TaskException(S.ERR.NO_TASKS)
+            if f.tell() > S.EXPORTING.MAX_UPLOAD:
+                raise TaskException(S.ERR.EXPORT_TOO_BIG)
+            f.seek(0)
+            await ctx.send(S.INFO.EXPORTED(count), file=discord.File(f, S.EXPORTING.FILENAME(ctx.author.name, fmt)))
+    
+    async def getTasksOrFail(self, userID: int):
+        tasks = await self.getTasks(userID)
         if not tasks:
             raise TaskException(S.ERR.NO_TASKS)
         return tasks
     
-    def getTZForUser(self, userID: int):
+    def getTZForUser(self, userID: int) -> Optional[tzinfo]:
+        if userID in self.tzCache:
+            self.tzCache.move_to_end(userID)
+            return self.tzCache[userID]
         try:
-            return timezone(self.tzprefs.get(str(userID)))
+            tz = timezone(self.tzprefs.get(str(userID)))
         except UnknownTimeZoneError:
-            return None
+            tz = None
+        self.tzCache[userID] = tz
+        if len(self.tzCache) > S.TIMEZONES.CACHE_SIZE:
+            self.tzCache.popitem(last=False)
+        return tz
+    
+    def setTZPref(self, userID: int, tz: str):
+        self.tzprefs[str(userID)] = tz
+        self.tzCache.pop(userID, None)
+        self.invalidatePages(userID)
+        self.storage.setTZPref(userID, tz)
     
     def getTZForUserOrFail(self, userID: int):
         tz = self.getTZForUser(userID)
@@ -71,27 +332,99 @@ class CogTask(commands.Cog, name=S.COG.NAME, description=S.COG.DESC):
             raise TaskException(S.ERR.NO_TZ)
         return tz
 
+    def invalidatePages(self, userID: int):
+        self.taskPages.pop(userID, None)
+        self.pageChanges += 1
+    
+    @staticmethod
+    def renderTaskPages(tasks: list[Task], tz: tzinfo) -> LazyPages:
+        """ Lays tasks out `PAGE_SIZE` to a page, rendering each page the first time it's looked at.
+        
+        Each entry is cut to an even share of a message's length, so a page can be rendered on its
+        own without working out where the pages before it ended.
+        """
+        
+        wrap = lambda body: S.INFO.TASKS_HEADER + "```\n" + body + "```"
+        share = (S.LISTING.MAX_LENGTH - len(wrap(""))) // S.LISTING.PAGE_SIZE
+        # a copy, since the listing can outlive changes to the tasks
+        tasks = list(tasks)
+        rendered: dict[int, str] = {}
+        
+        def render(index: int):
+            if index not in rendered:
+                onPage = tasks[index * S.LISTING.PAGE_SIZE:(index + 1) * S.LISTING.PAGE_SIZE]
+                digits = len(str(max(task.id for task in onPage)))
+                entries = []
+                for task in onPage:
+                    i = str(task.id)
+                    spacing = (digits - len(i)) * " "
+                    entries.append(S.INFO.TASKS(i, spacing, task.formatted(tz), task.getMessage())[:share])
+                rendered[index] = wrap("".join(entries))
+            return {"content": rendered[index]}
+        return LazyPages(render, -(-len(tasks) // S.LISTING.PAGE_SIZE))
+
     @commands.command(**S.TASKS.meta)
     async def tasks(self, ctx: commands.Context):
-        tasks = sorted(self.getTasksOrFail(ctx.author.id), key=lambda event: event.when)
-        tz = self.getTZForUserOrFail(ctx.author.id)
-        toSend = S.INFO.TASKS_HEADER + "```\n"
-        digits = len(str(len(tasks)))
-        for i, task in enumerate(tasks):
-            i = str(i + 1)
-            spacing = (digits - len(i)) * " "
-            toSend += S.INFO.TASKS(i, spacing, task.formatted(tz), task.getMessage())
-        toSend += "```"
-        await ctx.send(toSend)
+        userID = ctx.author.id
+        pages = self.taskPages.get(userID)
+        if pages is None:
+            changes = self.pageChanges
+            tasks = await self.getTasksOrFail(userID)
+            pages = self.renderTaskPages(tasks, self.getTZForUserOrFail(userID))
+            # only cache them if nothing changed while the tasks were being read
+            if changes == self.pageChanges:
+                self.taskPages[userID] = pages
+                if len(self.taskPages) > S.LISTING.CACHE_SIZE:
+                    self.taskPages.popitem(last=False)
+        else:
+            self.taskPages.move_to_end(userID)
+        await paginate(ctx, pages, len(pages) == 1)
+    
+    @staticmethod
+    def selectTasks(tasks: list[Task], args: str) -> list[Task]:
+        """ Picks the tasks named by `remove`'s arguments: IDs, ranges of IDs, `all`, or `matching` some text. """
+        
+        words = args.split()
+        if not words:
+            raise TaskException(S.ERR.NO_SELECTION)
+        if words[0].lower() == "all" and len(words) == 1:
+            return list(tasks)
+        if words[0].lower() == "matching" and len(words) > 1:
+            text = " ".join(words[1:])
+            selected = [task for task in tasks if text.lower() in task.message.lower()]
+            if not selected:
+                raise TaskException(S.ERR.NO_MATCHES(text))
+            return selected
+        
+        byID = {task.id: task for task in tasks}
+        selected: dict[int, Task] = {}
+        missing: list[int] = []
+        for word in words:
+            first, _, last = word.partition("-")
+            if not first.isdigit() or (last and not last.isdigit()):
+                raise TaskException(S.ERR.INVALID_SELECTION(word))
+            if last:
+                # ranges cover whichever IDs in them are still around
+                selected.update((i, byID[i]) for i in sorted(byID) if int(first) <= i <= int(last))
+            elif int(first) in byID:
+                selected[int(first)] = byID[int(first)]
+            else:
+                missing.append(int(first))
+        if missing:
+            raise TaskException(S.ERR.REMOVE_MISSING(missing))
+        if not selected:
+            raise TaskException(S.ERR.REMOVE_MISSING([args]))
+        return list(selected.values())
     
     @commands.command(**S.REMOVE.meta)
-    async def remove(self, ctx: commands.Context, index: int):
-        tasks = self.getTasksOrFail(ctx.author.id)
-        if index > len(tasks):
-            raise TaskException(S.ERR.REMOVE_OOB(index, len(tasks)))
-        task = tasks.pop(index - 1)
-        self.writeTaskmaster()
-        await ctx.send(S.INFO.REMOVE_SUCCESS(str(index), task.getMessage()))
+    async def remove(self, ctx: commands.Context, *, args: str=""):
+        userID = ctx.author.id
+        tasks = self.selectTasks(await self.getTasksOrFail(userID), args)
+        self.removeTasks(userID, tasks)
+        if len(tasks) == 1:
+            await ctx.send(S.INFO.REMOVE_SUCCESS(str(tasks[0].id), tasks[0].getMessage()))
+        else:
+            await ctx.send(S.INFO.REMOVE_MANY(len(tasks)))
 
     @commands.command(**S.TIMEZONE.meta)
     async def timezone(self, ctx: commands.Context, tz: Optional[str]=None):
@@ -107,9 +440,8 @@ class CogTask(commands.Cog, name=S.COG.NAME, description=S.COG.DESC):
         except UnknownTimeZoneError:
             await ctx.send()
             return
-        self.tzprefs[str(ctx.author.id)] = tz
-        with open(S.PATH.TZPREFS, "w") as f:
-            json.dump(self.tzprefs, f)
+        self.setTZPref(ctx.author.id, tz)
+        self.persister.markDirty()
         await ctx.send(S.INFO.TZ_SUCCESS(tzObj.zone))
 
     @commands.command(**S.NOW.meta)
@@ -119,4 +451,17 @@ class CogTask(commands.Cog, name=S.COG.NAME, description=S.COG.DESC):
             raise TaskException(S.ERR.NO_TZ)
         else:
             now = dt.datetime.now(tzObj)
-            await ctx.send(S.INFO.NOW(tzObj.zone, now.strftime(_FORMAT)))
\ No newline at end of file
+            await ctx.send(S.INFO.NOW(tzObj.zone, now.strftime(_FORMAT)))
+
+    @commands.command(**S.STATS.meta, hidden=True)
+    async def stats(self, ctx: commands.Context):
+        if not await self.bot.is_owner(ctx.author):
+            raise TaskException(S.ERR.STATS_OWNER_ONLY)
+        text = S.INFO.STATS_HEADER
+        for name, metric in list(Metrics.REGISTRY.items()):
+            if isinstance(metric, Metrics.Histogram):
+                p50, p99 = metric.quantiles([0.5, 0.99])
+                text += S.INFO.STATS_HISTOGRAM(name, p50, p99, metric.count) if metric.count else S.INFO.STATS_EMPTY(name)
+            else:
+                text += S.INFO.STATS_VALUE(name, metric.value)
+        await ctx.send(text + S.INFO.STATS_FOOTER)
\ No newline at end of file
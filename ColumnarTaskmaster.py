@@ -0,0 +1,355 @@
+from __future__ import annotations
+import datetime as dt
+import numpy as np
+from typing import Callable, Iterable, Iterator, Optional
+
+from Taskmaster import STEPS, Interval, Recur, Task, Taskmaster, UTC, latestOccurrence, nextOccurrence, taskFromjson
+
+# Kind codes for the `kind` column; recurring tasks use their Interval's value.
+PLAIN = -1
+NO_INTERVAL = 0
+
+COLUMNS = {
+    # when the task fires, in epoch seconds; the arrays are kept sorted on this
+    "when": np.int64,
+    "user": np.int64,
+    "kind": np.int8,
+    # the order tasks were added in, which is the order each user's tasks are listed in
+    "seq": np.int64,
+    # the task's ID among its user's tasks
+    "id": np.int64,
+    # index into the message table
+    "msg": np.int32
+}
+
+class ColumnarTaskmaster(Taskmaster):
+    """ A Taskmaster that keeps tasks in parallel NumPy arrays sorted by due time, for very large task counts.
+
+    Due tasks are always a prefix of the arrays, found with one `searchsorted`. Messages live in a
+    side table so each distinct message is stored once. Added tasks wait in plain lists until
+    the next read merges them in, and removed tasks are only marked dead until the next update
+    drops them, so a burst of adds or removals costs one pass over the arrays.
+    """
+
+    def __init__(self):
+        self.onChange: Optional[Callable[[str, int, dict], None]] = None
+        self.cols = {name: np.empty(0, dtype) for name, dtype in COLUMNS.items()}
+        self.pending: dict[str, list[int]] = {name: [] for name in COLUMNS}
+        # rows that have been removed but are still in the arrays
+        self.dead = np.zeros(0, bool)
+        self.deadCount = 0
+        self.sorted = True
+        self.messages: list[str] = []
+        self.messageIDs: dict[str, int] = {}
+        self.nextSeq = 0
+        self.lastIDs: dict[int, int] = {}
+        self.lastScanned = 0
+
+    def messageID(self, message: str):
+        if not message in self.messageIDs:
+            self.messageIDs[message] = len(self.messages)
+            self.messages.append(message)
+        return self.messageIDs[message]
+
+    @staticmethod
+    def kindOf(task: Task):
+        if not isinstance(task, Recur):
+            return PLAIN
+        return int(task.interval or NO_INTERVAL)
+
+    def append(self, userID: int, task: Task, seq: Optional[int]=None):
+        if seq is None:
+            seq = self.nextSeq
+            self.nextSeq += 1
+        self.assignID(task, userID)
+        self.pending["when"].append(task.ts)
+        self.pending["user"].append(userID)
+        self.pending["kind"].append(self.kindOf(task))
+        self.pending["seq"].append(seq)
+        self.pending["id"].append(task.id)
+        self.pending["msg"].append(self.messageID(task.message))
+
+    def merge(self):
+        """ Merges pending tasks into the arrays and restores their order. Dead rows are only dropped if the arrays are being copied anyway. """
+
+        if self.pending["when"]:
+            # inserting copies every column, so dropping dead rows first costs nothing extra
+            self.compact()
+            new = {name: np.array(self.pending[name], dtype) for name, dtype in COLUMNS.items()}
+            self.pending = {name: [] for name in COLUMNS}
+            order = np.argsort(new["when"], kind="stable")
+            positions = np.searchsorted(self.cols["when"], new["when"][order], side="right")
+            for name in COLUMNS:
+                self.cols[name] = np.insert(self.cols[name], positions, new[name][order])
+            self.dead = np.zeros(len(self.cols["when"]), bool)
+        if not self.sorted:
+            order = np.argsort(self.cols["when"], kind="stable")
+            for name in COLUMNS:
+                self.cols[name] = self.cols[name][order]
+            self.dead = self.dead[order]
+            self.sorted = True
+
+    def compact(self):
+        """ Drops the rows of removed tasks. """
+
+        if self.deadCount:
+            live = ~self.dead
+            for name in COLUMNS:
+                self.cols[name] = self.cols[name][live]
+            self.dead = np.zeros(len(self.cols["when"]), bool)
+            self.deadCount = 0
+
+    def flush(self):
+        """ Merges pending tasks in and drops removed ones, leaving only live tasks in the arrays. """
+
+        self.merge()
+        self.compact()
+
+    def assignID(self, task: Task, userID: int):
+        # IDs are only checked against the user's last one, since looking for a collision means a scan
+        lastID = self.lastIDs.get(userID, 0)
+        if task.id is None or task.id <= lastID:
+            task.id = lastID + 1
+        self.lastIDs[userID] = task.id
+
+    def taskAt(self, row: int) -> Task:
+        when = dt.datetime.fromtimestamp(int(self.cols["when"][row]), UTC)
+        message = self.messages[self.cols["msg"][row]]
+        kind = int(self.cols["kind"][row])
+        if kind == PLAIN:
+            task = Task(when, message)
+        else:
+            task = Recur(when, message, Interval(kind) if kind != NO_INTERVAL else None)
+        task.id = int(self.cols["id"][row])
+        return task
+
+    @staticmethod
+    def epoch(time: dt.datetime) -> np.int64:
+        # comparing against a float would convert the whole column; times are whole seconds anyway
+        return np.int64(int(time.timestamp()))
+
+    def liveRows(self, mask: np.ndarray) -> np.ndarray:
+        if self.deadCount:
+            mask &= ~self.dead
+        return np.flatnonzero(mask)
+
+    def userRows(self, userID: int) -> np.ndarray:
+        rows = self.liveRows(self.cols["user"] == userID)
+        return rows[np.argsort(self.cols["seq"][rows])]
+
+    def rowOf(self, userID: int, taskID: int) -> Optional[int]:
+        rows = self.liveRows((self.cols["user"] == userID) & (self.cols["id"] == taskID))
+        return int(rows[0]) if len(rows) else None
+
+    def eventID(self, event: dict) -> int:
+        if "id" in event:
+            return event["id"]
+        return int(self.cols["id"][self.userRows(event["user"])[event["index"]]])
+
+    def asjson(self):
+        obj = {}
+        for userID, task in self.items():
+            obj.setdefault(str(userID), []).append(task.asjson())
+        return obj
+
+    @classmethod
+    def fromitems(cls, items: Iterable[tuple[int, Task]]):
+        tm = cls()
+        for userID, task in items:
+            tm.append(userID, task)
+        tm.reindex()
+        return tm
+
+    def items(self) -> Iterator[tuple[int, Task]]:
+        self.flush()
+        users = self.cols["user"]
+        for row in np.argsort(self.cols["seq"]):
+            yield int(users[row]), self.taskAt(row)
+
+    def snapshot(self):
+        self.flush()
+        cols = {name: col.copy() for name, col in self.cols.items()}
+        # the message table is only ever appended to, so it can be shared with the copy
+        copy = ColumnarTaskmaster()
+        copy.cols, copy.messages = cols, self.messages
+        return copy.asjson
+
+    def itemsSnapshot(self, userID: Optional[int]=None) -> Iterator[tuple[int, Task]]:
+        self.flush()
+        rows = np.flatnonzero(self.cols["user"] == userID) if userID is not None else slice(None)
+        copy = ColumnarTaskmaster()
+        copy.cols, copy.messages = {name: col[rows].copy() for name, col in self.cols.items()}, self.messages
+        # tasks are only made from the copy as they're asked for
+        return copy.items()
+
+    def snapshotBatches(self) -> Iterator[Iterator[tuple[int, Task]]]:
+        # copying the arrays is one copy per column, however many tasks there are
+        yield self.itemsSnapshot()
+
+    def applyEvent(self, event: dict):
+        op, userID = event["op"], event["user"]
+        if op == "create":
+            self.addTask(taskFromjson(event["task"]), userID)
+        elif op in ["remove", "fire"]:
+            self.merge()
+            self.removeTask(userID, self.eventID(event))
+        elif op == "reschedule":
+            self.merge()
+            row = self.rowOf(userID, self.eventID(event))
+            self.cols["when"][row] = int(dt.datetime.fromisoformat(event["when"]).timestamp())
+            self.sorted = False
+        elif op == "lastID":
+            self.restoreLastIDs({userID: event["id"]})
+
+    def reindex(self):
+        self.flush()
+
+    def nextDue(self) -> Optional[dt.datetime]:
+        # read without merging, since this is asked for far more often than anything changes
+        whens = self.pending["when"][:]
+        if self.sorted:
+            # the first live row, which is the first row unless it's been removed
+            first = int(np.argmin(self.dead)) if self.deadCount else 0
+            if first < len(self.cols["when"]) and not self.dead[first]:
+                whens.append(int(self.cols["when"][first]))
+        elif len(self.cols["when"]) > self.deadCount:
+            whens.append(int(self.cols["when"][self.liveRows(np.ones(len(self.dead), bool))].min()))
+        if not whens:
+            return None
+        return dt.datetime.fromtimestamp(min(whens), UTC)
+
+    def dueWithin(self, time: dt.datetime) -> set[int]:
+        now = self.epoch(time)
+        if self.sorted:
+            due = np.zeros(len(self.cols["when"]), bool)
+            due[:np.searchsorted(self.cols["when"], now, side="right")] = True
+        else:
+            due = self.cols["when"] <= now
+        users = set(self.cols["user"][self.liveRows(due)].tolist())
+        users.update(userID for userID, when in zip(self.pending["user"], self.pending["when"]) if when <= now)
+        return users
+
+    async def update(self, time: dt.datetime) -> dict[int, list[tuple[str, dt.datetime, int]]]:
+        self.flush()
+        count = int(np.searchsorted(self.cols["when"], self.epoch(time), side="right"))
+        self.lastScanned = count
+        if not count:
+            return {}
+
+        due = {name: col[:count] for name, col in self.cols.items()}
+        # recurring tasks without an interval only fire once
+        recurring = due["kind"] > NO_INTERVAL
+        whens, missed = self.reschedule(due["when"][recurring], due["kind"][recurring], time)
+        if self.onChange:
+            self.recordUpdate(count, due, recurring, whens)
+
+        allMissed = np.zeros(count, np.int64)
+        allMissed[recurring] = missed
+        occurred = due["when"].copy()
+        occurred[recurring] = self.latest(due["when"][recurring], due["kind"][recurring], missed, time)
+        messages: dict[int, list[tuple[str, dt.datetime, int]]] = {}
+        for userID, when, msg, n in zip(due["user"].tolist(), occurred.tolist(), due["msg"].tolist(), allMissed.tolist()):
+            messages.setdefault(userID, []).append((self.messages[msg], dt.datetime.fromtimestamp(when, UTC), n))
+
+        rescheduled = {name: col[recurring] for name, col in due.items()}
+        rescheduled["when"] = whens
+        for name in COLUMNS:
+            # due tasks are a prefix, so dropping them is just a view
+            self.cols[name] = self.cols[name][count:]
+        self.dead = self.dead[count:]
+        for name in COLUMNS:
+            self.pending[name].extend(rescheduled[name].tolist())
+        self.flush()
+        return messages
+
+    @classmethod
+    def reschedule(cls, whens: np.ndarray, kinds: np.ndarray, time: dt.datetime) -> tuple[np.ndarray, np.ndarray]:
+        """ Gets the next occurrence after `time` of each recurring task, and how many occurrences each missed. """
+
+        whens = whens.copy()
+        missed = np.zeros(len(whens), np.int64)
+        now = cls.epoch(time)
+        for interval, step in STEPS.items():
+            rows = kinds == interval
+            count = (now - whens[rows]) // step + 1
+            whens[rows] += count * step
+            missed[rows] = count - 1
+        # calendar intervals don't have a fixed length, so they're worked out one at a time
+        for i in np.flatnonzero((kinds == Interval.YEARLY) | (kinds == Interval.MONTHLY)):
+            when, missed[i] = nextOccurrence(dt.datetime.fromtimestamp(int(whens[i]), UTC), Interval(int(kinds[i])), time)
+            whens[i] = int(when.timestamp())
+        return whens, missed
+
+    @classmethod
+    def latest(cls, whens: np.ndarray, kinds: np.ndarray, missed: np.ndarray, time: dt.datetime) -> np.ndarray:
+        """ Gets the latest occurrence each recurring task missed by `time`, which is the one its reminder stands for. """
+
+        whens = whens.copy()
+        for interval, step in STEPS.items():
+            rows = kinds == interval
+            whens[rows] += missed[rows] * step
+        for i in np.flatnonzero(((kinds == Interval.YEARLY) | (kinds == Interval.MONTHLY)) & (missed > 0)):
+            when = latestOccurrence(dt.datetime.fromtimestamp(int(whens[i]), UTC), Interval(int(kinds[i])), time)
+            whens[i] = int(when.timestamp())
+        return whens
+
+    def recordUpdate(self, count: int, due: dict[str, np.ndarray], recurring: np.ndarray, whens: np.ndarray):
+        """ Records an update's reschedules and fires as the changes the object Taskmaster would record. """
+
+        for userID, taskID, when in zip(due["user"][recurring].tolist(), due["id"][recurring].tolist(), whens.tolist()):
+            self.record("reschedule", userID, id=taskID, when=dt.datetime.fromtimestamp(when, UTC).isoformat())
+        for userID, taskID in zip(due["user"][~recurring].tolist(), due["id"][~recurring].tolist()):
+            self.record("fire", userID, id=taskID)
+
+    def addTask(self, task: Task, userID: int):
+        self.append(userID, task)
+        self.record("create", userID, task=task.asjson())
+
+    def addTasks(self, tasks: list[Task], userID: int):
+        # added tasks are already merged in one go
+        for task in tasks:
+            self.addTask(task, userID)
+
+    def removeTask(self, userID: int, taskID: int) -> Task:
+        return self.removeTasks(userID, [taskID])[0]
+
+    def removeTasks(self, userID: int, taskIDs: Iterable[int]) -> list[Task]:
+        # one pass over the columns, however many tasks go; the rows are only dropped at the next flush
+        self.merge()
+        taskIDs = list(taskIDs)
+        rows = self.userRows(userID)
+        rows = rows[np.isin(self.cols["id"][rows], taskIDs)]
+        byID = {int(self.cols["id"][row]): row for row in rows}
+        missing = [taskID for taskID in taskIDs if taskID not in byID]
+        if missing:
+            raise KeyError(missing[0])
+        tasks = [self.taskAt(byID[taskID]) for taskID in taskIDs]
+        self.dead[rows] = True
+        self.deadCount += len(rows)
+        for taskID in taskIDs:
+            self.record("remove", userID, id=taskID)
+        return tasks
+
+    def getTask(self, userID: int, taskID: int) -> Optional[Task]:
+        self.merge()
+        row = self.rowOf(userID, taskID)
+        return self.taskAt(row) if row is not None else None
+
+    def getTasks(self, userID: int):
+        self.merge()
+        rows = self.userRows(userID)
+        if not len(rows):
+            return None
+        return [self.taskAt(row) for row in rows]
+
+    def sortedRows(self, userID: int) -> np.ndarray:
+        # the arrays are already sorted by due time
+        self.merge()
+        return self.liveRows(self.cols["user"] == userID)
+
+    def getSortedTasks(self, userID: int):
+        rows = self.sortedRows(userID)
+        if not len(rows):
+            return None
+        return [self.taskAt(row) for row in rows]
+
@@ -0,0 +1,140 @@
+import asyncio
+from collections import OrderedDict
+import datetime as dt
+import logging
+import time
+from pytz import timezone
+from typing import Awaitable, Callable, Iterable
+
+import discord
+from discord.ext import commands
+
+import Log
+import Metrics
+import sources.text as T
+
+S = T.TASK
+L = T.LOG
+UTC = timezone("UTC")
+
+class RateLimiter:
+    """ A token bucket shared by every sender, to stay under Discord's global request limit. """
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Resolver:
+    """ Finds users' DM channels, checking the client's cache and then its own before asking Discord.
+    
+    Channels are kept in an LRU with a time to live, so a user who gets reminders often (an
+    `hourly` task, say) is only looked up over REST once per `ttl`.
+    """
+    
+    def __init__(self, bot: commands.Bot, request: Callable[[Awaitable], Awaitable], size: int=S.DELIVERY.CACHE_SIZE, ttl: float=S.DELIVERY.CACHE_TTL):
+        self.bot = bot
+        self.request = request
+        self.size = size
+        self.ttl = ttl
+        self.cache: OrderedDict[int, tuple[float, discord.DMChannel]] = OrderedDict()
+    
+    async def resolve(self, userID: int) -> discord.DMChannel:
+        entry = self.cache.get(userID)
+        if entry and entry[0] > time.monotonic():
+            self.cache.move_to_end(userID)
+            return entry[1]
+        
+        user = self.bot.get_user(userID) or await self.request(self.bot.fetch_user(userID))
+        channel = user.dm_channel or await self.request(user.create_dm())
+        self.cache[userID] = (time.monotonic() + self.ttl, channel)
+        self.cache.move_to_end(userID)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return channel
+    
+    async def prefetch(self, userIDs: Iterable[int]):
+        """ Resolves users ahead of time. Failures are left for delivery to report. """
+        
+        await asyncio.gather(*[self.resolve(userID) for userID in userIDs], return_exceptions=True)
+
+class Delivery:
+    """ Sends a batch of fired reminders with a bounded number of users served at once.
+    
+    Each user's reminders go out in order through one DM channel, which keeps every sender on its
+    own rate limit route; discord.py waits out any per-route limit it's told about, and the shared
+    token bucket keeps the batch as a whole under the global limit. A send that fails or takes
+    longer than `timeout` is logged and skipped without holding up the rest of the batch.
+    """
+    
+    def __init__(self, bot: commands.Bot, concurrency: int=S.DELIVERY.CONCURRENCY, rate: float=S.DELIVERY.RATE, timeout: float=S.DELIVERY.TIMEOUT):
+        self.bot = bot
+        self.senders = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(rate, concurrency)
+        self.timeout = timeout
+        self.lateness = Metrics.histogram(S.METRIC.FIRE_LATENESS, S.METRIC.FIRE_LATENESS_DESC)
+        self.resolver = Resolver(bot, self.request)
+        # fired reminders not yet sent or given up on
+        self.queued = 0
+        Metrics.gauge(S.METRIC.DELIVERY_QUEUE, S.METRIC.DELIVERY_QUEUE_DESC, lambda: self.queued)
+    
+    async def request(self, coro):
+        await self.limiter.acquire()
+        return await asyncio.wait_for(coro, self.timeout)
+    
+    async def deliverTo(self, userID: int, messages: list[tuple[str, dt.datetime, int]], lateness: list[float]):
+        # whatever isn't sent or given up on one at a time is taken off the queue at the end, however this ends
+        left = len(messages)
+        try:
+            async with self.senders:
+                try:
+                    channel = await self.resolver.resolve(userID)
+                except (discord.HTTPException, asyncio.TimeoutError) as e:
+                    Log.event(L.userNotFound, logging.WARNING, user=userID, tasks=len(messages), error=repr(e))
+                    return
+                except Exception as e:
+                    Log.exception(L.userNotFound, e, user=userID, tasks=len(messages))
+                    return
+                for message, due, missed in messages:
+                    alert = S.INFO.ALERT_MISSED(message, missed) if missed else S.INFO.ALERT(message)
+                    try:
+                        await self.request(channel.send(alert))
+                    except (discord.HTTPException, asyncio.TimeoutError) as e:
+                        Log.event(L.deliveryFailed, logging.WARNING, user=userID, error=repr(e))
+                        continue
+                    except Exception as e:
+                        # one bad send mustn't stop the user's other reminders
+                        Log.exception(L.deliveryFailed, e, user=userID)
+                        continue
+                    finally:
+                        left -= 1
+                        self.queued -= 1
+                    late = (dt.datetime.now(UTC) - due).total_seconds()
+                    lateness.append(late)
+                    self.lateness.observe(late)
+                    Log.event(L.fire, user=userID, latency=late)
+        finally:
+            self.queued -= left
+    
+    async def deliver(self, messages: dict[int, list[tuple[str, dt.datetime, int]]]):
+        lateness: list[float] = []
+        total = sum(len(userMessages) for userMessages in messages.values())
+        self.queued += total
+        # a user whose delivery fails outright doesn't stop the rest of the batch
+        await asyncio.gather(*[self.deliverTo(userID, messages[userID], lateness) for userID in messages], return_exceptions=True)
+        
+        sent = len(lateness)
+        Log.event(L.delivered, sent=sent, total=total, latencyP50=Metrics.quantile(lateness, 0.5), latencyP99=Metrics.quantile(lateness, 0.99))
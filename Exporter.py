@@ -0,0 +1,84 @@
+from __future__ import annotations
+import datetime as dt
+import json
+from typing import IO, Iterable
+
+from Taskmaster import Recur, Task, UTC
+import sources.text as T
+
+S = T.TASK
+
+ICS_TIME = "%Y%m%dT%H%M%SZ"
+
+def escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def fold(line: str) -> str:
+    """ Splits an iCalendar line into 75-octet pieces, each continued on the next line by a leading space. """
+
+    raw = line.encode()
+    if len(raw) <= 75:
+        return line + "\r\n"
+    pieces = []
+    while raw:
+        # don't split a character's bytes across lines
+        cut = min(len(raw), 75 if not pieces else 74)
+        while cut < len(raw) and (raw[cut] & 0xC0) == 0x80:
+            cut -= 1
+        pieces.append(raw[:cut].decode())
+        raw = raw[cut:]
+    return "\r\n ".join(pieces) + "\r\n"
+
+def jsonRow(userID: int, task: Task, stamp: str) -> str:
+    return json.dumps({"user": userID, **task.asjson()}) + "\n"
+
+def icsRow(userID: int, task: Task, stamp: str) -> str:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{userID}-{task.id}@{S.EXPORTING.UID_DOMAIN}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART:{task.when.strftime(ICS_TIME)}"
+    ]
+    if isinstance(task, Recur) and task.interval:
+        lines.append(f"RRULE:FREQ={task.interval.name}")
+    lines += [f"SUMMARY:{escape(task.message)}", "END:VEVENT"]
+    return "".join(fold(line) for line in lines)
+
+# (header, row, footer) for each format
+FORMATS = {
+    S.EXPORTING.JSONL: ("", jsonRow, ""),
+    S.EXPORTING.ICS: (f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:{S.EXPORTING.PRODID}\r\n", icsRow, "END:VCALENDAR\r\n")
+}
+
+class Export:
+    """ Writes (user ID, task) rows to a file in batches, for rows that can't all be had in one go.
+
+    Only one row is held at a time, so give `write` lazy iterables to keep memory flat. Blocks on the
+    file, so run it off the event loop.
+    """
+
+    def __init__(self, fmt: str, file: IO[bytes]):
+        header, self.row, self.footer = FORMATS[fmt]
+        self.file = file
+        self.stamp = dt.datetime.now(UTC).strftime(ICS_TIME)
+        self.count = 0
+        file.write(header.encode())
+
+    def write(self, rows: Iterable[tuple[int, Task]]):
+        for userID, task in rows:
+            self.file.write(self.row(userID, task, self.stamp).encode())
+            self.count += 1
+
+    def finish(self) -> int:
+        """ Ends the file, returning how many rows were written. """
+
+        self.file.write(self.footer.encode())
+        self.file.flush()
+        return self.count
+
+def writeExport(rows: Iterable[tuple[int, Task]], fmt: str, file: IO[bytes]) -> int:
+    """ Writes (user ID, task) rows to `file` as they come, returning how many there were. Blocks on the file, like `Export`. """
+
+    export = Export(fmt, file)
+    export.write(rows)
+    return export.finish()
@@ -1,6 +1,5 @@
-
 from typing import Callable, Mapping, Optional, Union
-from utils import getBronzOSEmbed, paginate
+from utils import PageContents, getBronzOSEmbed, paginate
 import discord
 from discord.ext import commands
 
@@ -9,35 +8,95 @@ import sources.text as T
 def getNonhiddenCommands(commands: list[commands.Command], getter: Callable[[commands.Command], Union[commands.Command, str]]=lambda x: x) -> list[Union[commands.Command, str]]:
     return [getter(command) for command in commands if not command.hidden]
 
+def copyPage(page: PageContents) -> PageContents:
+    # paginators may set footers on the embeds they're given, so each request gets its own
+    return {"content": page["content"], "embed": page["embed"].copy()}
+
+class HelpPages:
+    """ Help pages kept between requests, since they only change when cogs or commands do.
+
+    Each set of pages is rendered a page at a time the first time it's looked at, then reused.
+    Everything is dropped when a cog is added or removed, or the bot's commands change. A single
+    command's help is one embed that's as quick to build as to look up, so it isn't kept.
+    """
+
+    def __init__(self):
+        self.fingerprint: Optional[tuple] = None
+        # (page count, cached render) for the bot, and each cog and group
+        self.books: dict[str, tuple[int, Callable[[int], PageContents]]] = {}
+        self.mapping: Optional[Mapping[Optional[commands.Cog], list[commands.Command]]] = None
+
+    def check(self, bot: commands.Bot):
+        # the cogs themselves rather than their names, so reloading a cog counts as a change
+        fingerprint = (tuple(bot.cogs.values()), len(bot.all_commands))
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.books.clear()
+            self.mapping = None
+
+    def book(self, key: str, build: Callable[[], tuple[int, Callable[[int], PageContents]]]) -> tuple[int, Callable[[int], PageContents]]:
+        """ Gets the page count and a render function for `key`'s pages, building them with `build` if they aren't cached. """
+
+        if not key in self.books:
+            length, render = build()
+            pages: list[Optional[PageContents]] = [None] * length
+
+            def cached(i: int):
+                if pages[i] is None:
+                    pages[i] = render(i)
+                return pages[i]
+            self.books[key] = (length, cached)
+        length, cached = self.books[key]
+        return length, lambda i: copyPage(cached(i))
+
+# the help command is copied for every invocation, so the cache can't live on it
+helpPages = HelpPages()
+
 class Help(commands.DefaultHelpCommand):
+    def get_bot_mapping(self):
+        # only asked for before `send_bot_help`, so the cache is checked here for both
+        helpPages.check(self.context.bot)
+        if helpPages.mapping is None:
+            helpPages.mapping = super().get_bot_mapping()
+        return helpPages.mapping
+
     async def send_bot_help(self, mapping: Mapping[Optional[commands.Cog], list[commands.Command]]):
-        pages = []
-        cogNames = [cog.qualified_name for cog in mapping if isinstance(cog, commands.Cog) and getNonhiddenCommands(mapping[cog])]
-        for i, cog in enumerate(mapping):
-            if not cog: continue
-            cmds = mapping[cog]
-            if not cmds: continue
-            pages.append({
-                "content": T.HELP.cogPaginationContent(cogNames, i),
-                "embed": getBronzOSEmbed(**T.HELP.cogEmbed(cog.qualified_name, cog.description, getNonhiddenCommands(cmds, lambda cmd: cmd.qualified_name)))
-            })
-        await paginate(self.context, pages, True)
+        def build():
+            cogs = [cog for cog in mapping if isinstance(cog, commands.Cog) and getNonhiddenCommands(mapping[cog])]
+            cogNames = [cog.qualified_name for cog in cogs]
+            
+            # embeds are only built for the pages that get looked at
+            def render(i: int):
+                cog = cogs[i]
+                return {
+                    "content": T.HELP.cogPaginationContent(cogNames, i),
+                    "embed": getBronzOSEmbed(**T.HELP.cogEmbed(cog.qualified_name, cog.description, getNonhiddenCommands(mapping[cog], lambda cmd: cmd.qualified_name)))
+                }
+            return len(cogs), render
+        length, render = helpPages.book("", build)
+        await paginate(self.context, render, True, length)
     
-    async def sendPaginatedHelp(self, parentName: str, cmds: list[commands.Command], aliases: Optional[list[str]]=None):
-        pages = []
-        commandNames = [cmd.qualified_name for cmd in cmds]
-        for i, command in enumerate(cmds):
-            pages.append({
-                "content": T.HELP.commandPaginationContent(parentName, commandNames, i, aliases),
-                "embed": getBronzOSEmbed(**T.HELP.commandEmbed(command.qualified_name, command.aliases, command.help))
-            })
-        await paginate(self.context, pages, True)
+    async def sendPaginatedHelp(self, key: str, parentName: str, cmds: Callable[[], list[commands.Command]], aliases: Optional[list[str]]=None):
+        def build():
+            commandList = cmds()
+            commandNames = [cmd.qualified_name for cmd in commandList]
+            
+            def render(i: int):
+                command = commandList[i]
+                return {
+                    "content": T.HELP.commandPaginationContent(parentName, commandNames, i, aliases),
+                    "embed": getBronzOSEmbed(**T.HELP.commandEmbed(command.qualified_name, command.aliases, command.help))
+                }
+            return len(commandList), render
+        helpPages.check(self.context.bot)
+        length, render = helpPages.book(key, build)
+        await paginate(self.context, render, True, length)
     
     async def send_cog_help(self, cog: commands.Cog):
-        await self.sendPaginatedHelp(cog.qualified_name, getNonhiddenCommands(cog.get_commands()))
+        await self.sendPaginatedHelp(f"cog {cog.qualified_name}", cog.qualified_name, lambda: getNonhiddenCommands(cog.get_commands()))
     
     async def send_group_help(self, group: commands.Group):
-        await self.sendPaginatedHelp(group.qualified_name, getNonhiddenCommands(group.commands), group.aliases)
+        await self.sendPaginatedHelp(f"group {group.qualified_name}", group.qualified_name, lambda: getNonhiddenCommands(group.commands), group.aliases)
     
     async def send_command_help(self, command: commands.Command):
         embed = getBronzOSEmbed(
@@ -0,0 +1,150 @@
+from __future__ import annotations
+import csv
+import datetime as dt
+from datetime import tzinfo
+import io
+import re
+from pytz import UnknownTimeZoneError, timezone
+from typing import IO, Iterator, Union
+
+from Taskmaster import TIME_ERRORS, Interval, Parser, Recur, Task, TaskException, UTC, nextOccurrence
+import sources.text as T
+
+S = T.TASK
+
+# DTSTART values: a date, optionally followed by a time, optionally in UTC
+icsTimePat = re.compile(r"(\d{4})(\d{2})(\d{2})(?:T(\d{2})(\d{2})(\d{2})(Z?))?")
+# the parts of an RRULE that can't be carried over to a Recur, which only has a frequency
+icsUnsupportedPat = re.compile(r"COUNT|UNTIL|BYSETPOS|BYWEEKNO|BYYEARDAY|BYHOUR|BYMINUTE|BYSECOND")
+
+class ImportResult:
+    def __init__(self):
+        self.tasks: list[Task] = []
+        # (line number, entry, reason) for each row that couldn't be made into a task
+        self.failures: list[tuple[int, str, str]] = []
+
+def isCalendar(filename: str, head: bytes) -> bool:
+    return filename.lower().endswith(".ics") or head.lstrip().upper().startswith(b"BEGIN:VCALENDAR")
+
+def readTasks(raw: bytes, filename: str, tz: tzinfo, now: dt.datetime) -> ImportResult:
+    """ Parses an uploaded CSV of `create` entries or an iCalendar file into tasks, a row at a time.
+
+    Rows that don't parse are collected rather than stopping the import. Doesn't touch any shared
+    state, so it can run off the event loop.
+    """
+
+    lines = io.TextIOWrapper(io.BytesIO(raw), encoding="utf-8-sig", errors="replace", newline="")
+    rows = readICS(lines, tz, now) if isCalendar(filename, raw[:64]) else readCSV(lines, now)
+    result = ImportResult()
+    for lineNo, entry, task in rows:
+        if isinstance(task, Task):
+            result.tasks.append(task)
+            if len(result.tasks) > S.IMPORTING.MAX_TASKS:
+                raise TaskException(S.ERR.IMPORT_TOO_MANY(S.IMPORTING.MAX_TASKS))
+        else:
+            result.failures.append((lineNo, entry, task))
+    return result
+
+def readCSV(lines: IO[str], now: dt.datetime) -> Iterator[tuple[int, str, Union[Task, str]]]:
+    """ Reads one `create` entry per row. A row's cells are joined with spaces, so the message can be in its own column. """
+
+    reader = csv.reader(lines)
+    for row in reader:
+        words = " ".join(cell.strip() for cell in row).split()
+        if not words or words[0].startswith("#"):
+            continue
+        if words[0].lower() in [S.CREATE.name, *S.CREATE.aliases]:
+            words = words[1:]
+        entry = " ".join(words)
+        try:
+            task = Parser(words).getAsTask(now) if words else None
+        except TaskException as e:
+            task = str(e)
+        except TIME_ERRORS:
+            task = S.ERR.INVALID_TIME
+        yield reader.line_num, entry, task or S.ERR.NO_ENTRY
+
+def unfold(lines: IO[str]) -> Iterator[tuple[int, str]]:
+    """ Joins iCalendar's folded lines back together, along with the number of each one's first line. """
+
+    current, start = None, 0
+    for lineNo, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if line[:1] in [" ", "\t"] and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, lineNo
+    if current is not None:
+        yield start, current
+
+def unescape(text: str) -> str:
+    return re.sub(r"\\([\\;,nN])", lambda m: "\n" if m.group(1) in "nN" else m.group(1), text)
+
+def readICS(lines: IO[str], tz: tzinfo, now: dt.datetime) -> Iterator[tuple[int, str, Union[Task, str]]]:
+    """ Reads each VEVENT as a task at its start time. Times without a zone are taken to be in `tz`. """
+
+    # `now` is local like `create`'s, but event times are absolute
+    now = now.astimezone(UTC)
+    event, start = None, 0
+    for lineNo, line in unfold(lines):
+        name, _, value = line.partition(":")
+        name, *params = name.split(";")
+        name = name.upper()
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            event, start = {}, lineNo
+        elif name == "END" and value.upper() == "VEVENT" and event is not None:
+            message = unescape(event.get("SUMMARY", ("", []))[0]).strip() or S.IMPORTING.UNTITLED
+            try:
+                task = eventToTask(event, message, tz, now)
+            except TaskException as e:
+                task = str(e)
+            except TIME_ERRORS:
+                task = S.ERR.INVALID_TIME
+            yield start, message, task
+            event = None
+        elif event is not None:
+            # alarms nested in the event come after its own properties, so the first of each is the event's
+            event.setdefault(name, (value, params))
+
+def eventToTask(event: dict[str, tuple[str, list[str]]], message: str, tz: tzinfo, now: dt.datetime) -> Task:
+    value, params = event.get("DTSTART", ("", []))
+    match = icsTimePat.fullmatch(value.strip())
+    if not match:
+        raise TaskException(S.ERR.IMPORT_BAD_START(value))
+    yr, mo, d, h, m, s, utc = match.groups()
+    params = dict(param.split("=", 1) for param in params if "=" in param)
+    if utc:
+        zone = UTC
+    else:
+        try:
+            zone = timezone(params["TZID"].strip('"')) if "TZID" in params else tz
+        except UnknownTimeZoneError:
+            # calendars from Windows name zones their own way; the user's zone is the best guess
+            zone = tz
+    try:
+        # all-day events are due at the start of their day
+        local = dt.datetime(int(yr), int(mo), int(d), int(h or 0), int(m or 0), int(s or 0))
+    except ValueError:
+        raise TaskException(S.ERR.IMPORT_BAD_START(value))
+    when = zone.localize(local).astimezone(UTC)
+
+    rule = event.get("RRULE")
+    if not rule:
+        if when <= now:
+            raise TaskException(S.ERR.IMPORT_PAST)
+        return Task(when, message)
+    parts = dict(part.split("=", 1) for part in rule[0].upper().split(";") if "=" in part)
+    if (
+        parts.get("FREQ") not in Interval.__members__
+        or parts.get("INTERVAL", "1") != "1"
+        or any(icsUnsupportedPat.fullmatch(key) for key in parts)
+        # several days, or a day like `2TU`, can't be a single weekly or monthly time
+        or any("," in val for key, val in parts.items() if key.startswith("BY"))
+        or re.search(r"\d", parts.get("BYDAY", ""))
+    ):
+        raise TaskException(S.ERR.IMPORT_BAD_RULE(rule[0]))
+    interval = Interval[parts["FREQ"]]
+    when, _ = nextOccurrence(when, interval, now)
+    return Recur(when, message, interval)
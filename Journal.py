@@ -0,0 +1,147 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+from typing import Callable, Optional
+
+from Taskmaster import Taskmaster
+
+# a function that serializes the tasks, and the highest ID each user had been given at the time
+Snapshot = tuple[Callable[[], dict], dict[int, int]]
+
+def digest(raw: bytes):
+    return hashlib.sha1(raw).hexdigest()
+
+def writeAtomically(path: str, raw: bytes):
+    """ Writes to a temporary file and swaps it in, so a crash leaves either the old file or the new one. """
+    
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpPath, path)
+
+class Journal:
+    """ Persists a Taskmaster as a snapshot plus an append-only log of the changes made since.
+    
+    Changes are recorded on the event loop and written in batches by `writeBatch`, which may run
+    in a worker thread. Every journal file starts with a header giving the digest of the snapshot
+    it applies on top of, and the highest ID each user had been given by then, which removed
+    tasks would otherwise take with them. When the journal is compacted, it's moved aside and a new one is started on top of
+    the snapshot that is about to be written, so a crash at any point leaves a snapshot and a
+    chain of journals that can be replayed from it.
+    """
+    
+    def __init__(self, snapshotPath: str, journalPath: str, engine: type[Taskmaster]=Taskmaster, threshold: int=1000):
+        self.snapshotPath = snapshotPath
+        self.journalPath = journalPath
+        self.oldPath = journalPath + ".old"
+        self.engine = engine
+        self.threshold = threshold
+        
+        self.taskmaster: Optional[Taskmaster] = None
+        self.file = None
+        self.pending: list[str] = []
+        self.entries = 0
+    
+    @staticmethod
+    def read(path: str) -> tuple[Optional[dict], list[dict]]:
+        with open(path, "r") as f:
+            lines = f.readlines()
+        if not lines:
+            return None, []
+        header = None
+        events = []
+        try:
+            header = json.loads(lines[0])
+            for line in lines[1:]:
+                events.append(json.loads(line))
+        except json.JSONDecodeError:
+            # a crash mid-append leaves a partial last line; everything before it is still good
+            pass
+        return header, events
+    
+    def replay(self) -> Taskmaster:
+        """ Rebuilds the Taskmaster from the snapshot and the journals on top of it, without writing anything. """
+        
+        with open(self.snapshotPath, "rb") as f:
+            raw = f.read()
+        base = digest(raw)
+        tm = self.engine.fromjson(json.loads(raw))
+        
+        replaying = False
+        for path in [self.oldPath, self.journalPath]:
+            if not os.path.exists(path): continue
+            header, events = self.read(path)
+            if header and header["base"] == base:
+                replaying = True
+            if replaying:
+                # journals from before headers had these only have the IDs of the tasks
+                tm.restoreLastIDs({int(userID): lastID for userID, lastID in header.get("lastIDs", {}).items()})
+                for event in events:
+                    tm.applyEvent(event)
+        tm.reindex()
+        return tm
+    
+    def load(self) -> Taskmaster:
+        tm = self.replay()
+        
+        # fold whatever was replayed into a fresh snapshot before recording anything new
+        raw = json.dumps(tm.asjson()).encode()
+        writeAtomically(self.snapshotPath, raw)
+        self.file = self.start(digest(raw), tm.lastIDs)
+        if os.path.exists(self.oldPath):
+            os.remove(self.oldPath)
+        
+        self.taskmaster = tm
+        tm.onChange = self.record
+        return tm
+    
+    def start(self, base: str, lastIDs: dict[int, int]):
+        header = {"base": base, "lastIDs": {str(userID): lastID for userID, lastID in lastIDs.items()}}
+        writeAtomically(self.journalPath, (json.dumps(header) + "\n").encode())
+        return open(self.journalPath, "a")
+    
+    def record(self, op: str, userID: int, fields: dict):
+        self.pending.append({"op": op, "user": userID, **fields})
+    
+    def takeBatch(self) -> tuple[list[dict], Optional[Snapshot]]:
+        """ Hands over the changes recorded so far, along with a snapshot of the Taskmaster if it's time to compact. """
+        
+        events, self.pending = self.pending, []
+        self.entries += len(events)
+        snapshot = None
+        if self.entries >= self.threshold:
+            snapshot = self.taskmaster.snapshot(), dict(self.taskmaster.lastIDs)
+            self.entries = 0
+        return events, snapshot
+    
+    def writeBatch(self, batch: tuple[list[dict], Optional[Snapshot]]):
+        """ Appends a batch with a single write, compacting afterwards if the batch asks for it. Safe to call off the event loop. """
+        
+        events, snapshot = batch
+        if events:
+            self.file.write("".join(json.dumps(event) + "\n" for event in events))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        if snapshot is not None:
+            self.compact(snapshot)
+    
+    def compact(self, snapshot: Snapshot):
+        serialize, lastIDs = snapshot
+        raw = json.dumps(serialize()).encode()
+        self.file.close()
+        os.replace(self.journalPath, self.oldPath)
+        self.file = self.start(digest(raw), lastIDs)
+        writeAtomically(self.snapshotPath, raw)
+        os.remove(self.oldPath)
+    
+    def commit(self):
+        self.writeBatch(self.takeBatch())
+    
+    def close(self):
+        self.commit()
+        # a journal that was only replayed has nothing open
+        if self.file:
+            self.file.close()
@@ -0,0 +1,167 @@
+import datetime as dt
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+from typing import Any, Optional
+
+import Metrics
+import sources.text as T
+
+L = T.LOG
+
+logger = logging.getLogger(L.loggerName)
+logger.setLevel(logging.INFO)
+# nothing is logged before `start`, rather than falling back to writing on the caller's thread
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+def event(name: str, level: int=logging.INFO, **fields: Any):
+    """ Logs an event with structured fields. Only queues it; the writer thread formats and writes it. """
+
+    if logger.isEnabledFor(level):
+        # made directly rather than through `logger.log`, which walks the stack to find the caller
+        logger.handle(logger.makeRecord(logger.name, level, "", 0, name, None, None, extra={"fields": fields}))
+
+def exception(name: str, error: BaseException, **fields: Any):
+    """ Logs an unexpected error as an event, along with its traceback. """
+
+    trace = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+    event(name, logging.ERROR, error=repr(error), traceback=trace, **fields)
+
+class Sampler(logging.Filter):
+    """ Keeps a random share of each event's records, recording the share kept so counts can be scaled back up. """
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.sampledOut = Metrics.counter(L.metricSampled, L.metricSampledDesc)
+
+    def filter(self, record: logging.LogRecord):
+        rate = self.rates.get(record.msg, 1.0)
+        if rate >= 1:
+            return True
+        if random.random() >= rate:
+            self.sampledOut.inc()
+            return False
+        record.fields = {**record.fields, "sampleRate": rate}
+        return True
+
+class RateLimit(logging.Filter):
+    """ A token bucket for each event, so a burst of one event can't crowd out the rest.
+
+    The first record let through after some were suppressed says how many were.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # event: (tokens, last refill, records suppressed since the last one let through)
+        self.buckets: dict[str, tuple[float, float, int]] = {}
+        self.suppressed = Metrics.counter(L.metricSuppressed, L.metricSuppressedDesc)
+
+    def filter(self, record: logging.LogRecord):
+        now = time.monotonic()
+        tokens, last, suppressed = self.buckets.get(record.msg, (self.burst, now, 0))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[record.msg] = (tokens, now, suppressed + 1)
+            self.suppressed.inc()
+            return False
+        self.buckets[record.msg] = (tokens - 1, now, 0)
+        if suppressed:
+            record.fields = {**record.fields, "suppressed": suppressed}
+        return True
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """ Hands records to the writer thread without blocking, dropping them if it's fallen behind. """
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = Metrics.counter(L.metricDropped, L.metricDroppedDesc)
+
+    def prepare(self, record: logging.LogRecord):
+        # the default formats the record here, on the caller's thread; its fields are plain values, so it can go as it is
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped.inc()
+
+def fieldsOf(record: logging.LogRecord) -> dict[str, Any]:
+    return getattr(record, "fields", {})
+
+class JSONFormatter(logging.Formatter):
+    """ Formats records as one JSON object per line. """
+
+    def format(self, record: logging.LogRecord):
+        return json.dumps({
+            "time": dt.datetime.fromtimestamp(record.created, dt.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "event": record.getMessage(),
+            **fieldsOf(record)
+        }, default=str)
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord):
+        fields = " ".join(f"{key}={value}" for key, value in fieldsOf(record).items())
+        return f"[{time.strftime(L.consoleTime, time.localtime(record.created))}] {record.getMessage()} {fields}"
+
+class Writer(logging.handlers.QueueListener):
+    """ The thread that writes queued records to the console and a log file rotated by size. """
+
+    def __init__(self, records: queue.Queue, path: str):
+        file = logging.handlers.RotatingFileHandler(path, maxBytes=L.maxBytes, backupCount=L.backups, encoding="utf-8")
+        file.setFormatter(JSONFormatter())
+        console = logging.StreamHandler()
+        console.setFormatter(ConsoleFormatter())
+        super().__init__(records, file, console)
+
+    def enqueue_sentinel(self):
+        # waits for room, since the queue can be full when it's stopped
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        super().stop()
+        for handler in self.handlers:
+            handler.close()
+
+writer: Optional[Writer] = None
+lock = threading.Lock()
+
+def start(name: str=L.defaultName) -> Writer:
+    """ Starts the writer thread for this process, logging to a file named after `name`. Records logged before this are dropped. """
+
+    global writer
+    with lock:
+        if writer:
+            return writer
+        os.makedirs(L.directory, exist_ok=True)
+        records: queue.Queue = queue.Queue(L.queueSize)
+        handler = QueueHandler(records)
+        # filters run before records are queued, so a burst that's thrown away costs as little as possible
+        handler.addFilter(Sampler(L.sampleRates))
+        handler.addFilter(RateLimit(L.rate, L.burst))
+        writer = Writer(records, os.path.join(L.directory, f"{name}.log"))
+        writer.start()
+        logger.handlers = [handler]
+        return writer
+
+def stop():
+    """ Writes out everything still queued and stops the writer thread. """
+
+    global writer
+    with lock:
+        if not writer:
+            return
+        logger.handlers = [logging.NullHandler()]
+        writer.stop()
+        writer = None
@@ -0,0 +1,127 @@
+import asyncio
+from collections import deque
+import time
+from typing import Callable, Optional, Union
+
+def quantile(values: list[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+class Histogram:
+    """ Keeps a sliding window of recent observations for quantile lookups. """
+    
+    def __init__(self, name: str, description: str, window: int=1000):
+        self.name = name
+        self.description = description
+        self.samples: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+    
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+    
+    def quantile(self, q: float) -> Optional[float]:
+        return quantile(self.samples, q)
+    
+    def quantiles(self, qs: list[float]) -> list[Optional[float]]:
+        # sorts the window once for all of them
+        ordered = sorted(self.samples)
+        return [quantile(ordered, q) for q in qs]
+
+class Counter:
+    """ Counts events since the process started. """
+    
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+    
+    def inc(self, amount: int=1):
+        self.value += amount
+
+class Gauge:
+    """ Reads a current value, such as a size, whenever it's asked for. """
+    
+    def __init__(self, name: str, description: str, read: Callable[[], float]):
+        self.name = name
+        self.description = description
+        self.read = read
+    
+    @property
+    def value(self) -> float:
+        return self.read()
+
+REGISTRY: dict[str, Union[Histogram, Counter, Gauge]] = {}
+
+def histogram(name: str, description: str, window: int=1000) -> Histogram:
+    """ Gets the histogram registered under `name`, creating it if it doesn't exist yet. """
+    
+    if not name in REGISTRY:
+        REGISTRY[name] = Histogram(name, description, window)
+    return REGISTRY[name]
+
+def counter(name: str, description: str) -> Counter:
+    if not name in REGISTRY:
+        REGISTRY[name] = Counter(name, description)
+    return REGISTRY[name]
+
+def gauge(name: str, description: str, read: Callable[[], float]) -> Gauge:
+    """ Registers a gauge under `name`, replacing any read function it had before. """
+    
+    REGISTRY[name] = Gauge(name, description, read)
+    return REGISTRY[name]
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+def render() -> str:
+    """ Renders every registered metric in Prometheus' text format. Histograms are windowed, so they're shown as summaries. """
+    
+    lines = []
+    for name, metric in list(REGISTRY.items()):
+        description = metric.description.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {name} {description}")
+        if isinstance(metric, Histogram):
+            lines.append(f"# TYPE {name} summary")
+            for q, value in zip(QUANTILES, metric.quantiles(QUANTILES)):
+                lines.append(f'{name}{{quantile="{q}"}} {value if value is not None else "NaN"}')
+            lines.append(f"{name}_sum {metric.total}")
+            lines.append(f"{name}_count {metric.count}")
+        else:
+            lines.append(f"# TYPE {name} {'counter' if isinstance(metric, Counter) else 'gauge'}")
+            lines.append(f"{name} {metric.value}")
+    return "\n".join(lines) + "\n"
+
+async def serve(host: str, port: int):
+    """ Serves `render` over HTTP for Prometheus to scrape, whatever the path. """
+    
+    async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # the request itself doesn't matter, but it has to be read before answering
+            while (await reader.readline()).strip():
+                pass
+            body = render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_server(respond, host, port)
+    async with server:
+        await server.serve_forever()
+
+async def watchLag(lag: Histogram, interval: float):
+    """ Measures how much later than asked for the event loop wakes up, which is how long something held it up. """
+    
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lag.observe(max(time.monotonic() - start - interval, 0))
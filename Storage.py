@@ -0,0 +1,395 @@
+from __future__ import annotations
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import datetime as dt
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Callable, Iterator, Optional
+
+from Journal import Journal, writeAtomically
+import Metrics
+from Taskmaster import Interval, Recur, Task, Taskmaster, UTC
+from TieredTaskmaster import TieredTaskmaster
+import sources.text as T
+
+S = T.TASK
+
+class Storage:
+    """ Somewhere to keep tasks and time zone preferences between runs.
+    
+    `load` hands back a Taskmaster whose changes are recorded by the storage from then on.
+    Recording is cheap and happens on the event loop; `takeBatch` hands over everything recorded
+    so far, and `writeBatch` makes it durable and is safe to run in a worker thread.
+    """
+    
+    def load(self) -> Taskmaster:
+        raise NotImplementedError
+    
+    def read(self) -> Taskmaster:
+        """ Loads every stored task without changing anything on disk, or recording changes, for copying them elsewhere. """
+        
+        raise NotImplementedError
+    
+    def loadTZPrefs(self) -> dict[str, str]:
+        raise NotImplementedError
+    
+    def setTZPref(self, userID: int, tz: str):
+        raise NotImplementedError
+    
+    def removeTZPref(self, userID: int):
+        raise NotImplementedError
+    
+    def takeBatch(self):
+        raise NotImplementedError
+    
+    def writeBatch(self, batch):
+        raise NotImplementedError
+    
+    def commit(self):
+        self.writeBatch(self.takeBatch())
+    
+    def close(self):
+        self.commit()
+
+class JSONStorage(Storage):
+    """ Keeps tasks in taskmaster.json and its journal, and time zone preferences in tzprefs.json. """
+    
+    def __init__(self, taskmasterPath: str, journalPath: str, tzprefsPath: str, engine: type[Taskmaster]=Taskmaster):
+        self.journal = Journal(taskmasterPath, journalPath, engine)
+        self.tzprefsPath = tzprefsPath
+        self.tzprefs: dict[str, str] = {}
+        self.tzprefsDirty = False
+    
+    def load(self):
+        return self.journal.load()
+    
+    def read(self):
+        return self.journal.replay()
+    
+    def loadTZPrefs(self):
+        with open(self.tzprefsPath, "r") as f:
+            self.tzprefs = json.load(f)
+        return self.tzprefs
+    
+    def setTZPref(self, userID: int, tz: str):
+        self.tzprefs[str(userID)] = tz
+        self.tzprefsDirty = True
+    
+    def removeTZPref(self, userID: int):
+        self.tzprefs.pop(str(userID), None)
+        self.tzprefsDirty = True
+    
+    def takeBatch(self):
+        tzprefs = dict(self.tzprefs) if self.tzprefsDirty else None
+        self.tzprefsDirty = False
+        return self.journal.takeBatch(), tzprefs
+    
+    def writeBatch(self, batch):
+        journalBatch, tzprefs = batch
+        self.journal.writeBatch(journalBatch)
+        if tzprefs is not None:
+            writeAtomically(self.tzprefsPath, json.dumps(tzprefs).encode())
+    
+    def close(self):
+        self.commit()
+        self.journal.close()
+
+class SQLiteStorage(Storage):
+    """ Keeps tasks and time zone preferences in a SQLite database, indexed by due time and by user.
+    
+    Rows are keyed by user and task ID, which is how recorded changes refer to tasks. The highest
+    ID each user has been given is kept apart from the tasks, so removing tasks doesn't free theirs.
+    
+    Given a `horizon`, only tasks due within it are loaded, into a TieredTaskmaster.
+    The rest are read in as the horizon moves.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            task_id INTEGER,
+            due REAL NOT NULL,
+            message TEXT NOT NULL,
+            interval TEXT
+        );
+        CREATE INDEX IF NOT EXISTS tasks_due ON tasks (due);
+        CREATE TABLE IF NOT EXISTS last_ids (
+            user_id INTEGER PRIMARY KEY,
+            task_id INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tzprefs (
+            user_id INTEGER PRIMARY KEY,
+            zone TEXT NOT NULL
+        );
+    """
+    # created after `addTaskIDs`, since databases from before task IDs don't have the column yet
+    INDEXES = """
+        CREATE UNIQUE INDEX IF NOT EXISTS tasks_user ON tasks (user_id, task_id);
+    """
+    
+    TASK_COLUMNS = "task_id, due, message, interval"
+    RAISE_LAST_ID = """
+        INSERT INTO last_ids (user_id, task_id) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET task_id = MAX(task_id, excluded.task_id)
+    """
+    
+    def __init__(self, path: str, engine: type[Taskmaster]=Taskmaster, horizon: Optional[dt.timedelta]=None):
+        self.engine = engine
+        self.horizon = horizon
+        # batches are written from the persistence worker's thread
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(self.SCHEMA)
+        self.addTaskIDs()
+        self.db.executescript(self.INDEXES)
+        self.pending: list[tuple[str, tuple]] = []
+    
+    def addTaskIDs(self):
+        """ Gives the tasks in a database from before task IDs the IDs they'd get from a Taskmaster: 1 up, in insertion order. """
+        
+        columns = [name for _, name, *_ in self.db.execute("PRAGMA table_info(tasks)")]
+        if "task_id" in columns: return
+        with self.db:
+            self.db.execute("DROP INDEX IF EXISTS tasks_user")
+            self.db.execute("ALTER TABLE tasks ADD COLUMN task_id INTEGER")
+            self.db.execute("""
+                UPDATE tasks SET task_id = (
+                    SELECT COUNT(*) FROM tasks AS earlier WHERE earlier.user_id = tasks.user_id AND earlier.id <= tasks.id
+                )
+            """)
+    
+    @staticmethod
+    def rowToTask(taskID: int, due: float, message: str, interval: Optional[str]) -> Task:
+        # plain tasks have no interval at all, while recurring tasks without one are stored as ""
+        when = dt.datetime.fromtimestamp(due, UTC)
+        if interval is None:
+            task = Task(when, message)
+        else:
+            task = Recur(when, message, Interval.fromLabel(interval))
+        task.id = taskID
+        return task
+    
+    @staticmethod
+    def taskToRow(task: dict) -> tuple[float, str, Optional[str]]:
+        interval = (task["interval"] or "") if "interval" in task else None
+        return dt.datetime.fromisoformat(task["when"]).timestamp(), task["message"], interval
+    
+    def load(self):
+        if self.horizon:
+            tm = TieredTaskmaster(self.lastIDs(), dt.datetime.now(UTC) + self.horizon)
+            tm.promote(self.rowsDueBetween(None, tm.until))
+        else:
+            rows = self.db.execute(f"SELECT user_id, {self.TASK_COLUMNS} FROM tasks ORDER BY id")
+            tm = self.engine.fromitems((userID, self.rowToTask(*row)) for userID, *row in rows)
+            tm.restoreLastIDs(self.lastIDs())
+        tm.onChange = self.record
+        return tm
+    
+    def lastIDs(self) -> dict[int, int]:
+        # databases from before last_ids was kept only have the IDs of the tasks that are left
+        return dict(self.db.execute("""
+            SELECT user_id, MAX(task_id) FROM (
+                SELECT user_id, task_id FROM tasks UNION ALL SELECT user_id, task_id FROM last_ids
+            ) GROUP BY user_id
+        """))
+    
+    def loadTZPrefs(self):
+        return {str(userID): zone for userID, zone in self.db.execute("SELECT user_id, zone FROM tzprefs")}
+    
+    def setTZPref(self, userID: int, tz: str):
+        self.pending.append(("INSERT OR REPLACE INTO tzprefs (user_id, zone) VALUES (?, ?)", (userID, tz)))
+    
+    def removeTZPref(self, userID: int):
+        self.pending.append(("DELETE FROM tzprefs WHERE user_id = ?", (userID,)))
+    
+    def rowsDueBetween(self, after: Optional[int], until: int) -> list[tuple[int, Task]]:
+        """ Gets (user ID, task) for every task due after `after` and by `until`, in epoch seconds. """
+        
+        rows = self.db.execute(
+            f"SELECT user_id, {self.TASK_COLUMNS} FROM tasks WHERE due > ? AND due <= ? ORDER BY id",
+            (after if after is not None else float("-inf"), until)
+        )
+        return [(userID, self.rowToTask(*row)) for userID, *row in rows]
+    
+    def userTasks(self, userID: int) -> list[Task]:
+        """ Gets each of a user's tasks, soonest first. """
+        
+        rows = self.db.execute(f"SELECT {self.TASK_COLUMNS} FROM tasks WHERE user_id = ? ORDER BY due, task_id", (userID,))
+        return [self.rowToTask(*row) for row in rows]
+    
+    def iterTasks(self, userID: Optional[int]=None) -> Iterator[tuple[int, Task]]:
+        """ Goes through (user ID, task) for every task, or just one user's, reading rows from disk as they're needed.
+        
+        Call it and go through it in the persistence worker's thread.
+        """
+        
+        if userID is None:
+            rows = self.db.execute(f"SELECT user_id, {self.TASK_COLUMNS} FROM tasks ORDER BY user_id, task_id")
+        else:
+            rows = self.db.execute(f"SELECT user_id, {self.TASK_COLUMNS} FROM tasks WHERE user_id = ? ORDER BY task_id", (userID,))
+        for userID, *row in rows:
+            yield userID, self.rowToTask(*row)
+    
+    def userIDs(self) -> set[int]:
+        return {userID for userID, in self.db.execute("SELECT DISTINCT user_id FROM tasks")}
+    
+    def record(self, op: str, userID: int, fields: dict):
+        if op == "create":
+            self.pending.append((
+                "INSERT INTO tasks (user_id, task_id, due, message, interval) VALUES (?, ?, ?, ?, ?)",
+                (userID, fields["task"]["id"], *self.taskToRow(fields["task"]))
+            ))
+            self.pending.append((self.RAISE_LAST_ID, (userID, fields["task"]["id"])))
+        elif op in ["remove", "fire"]:
+            self.pending.append(("DELETE FROM tasks WHERE user_id = ? AND task_id = ?", (userID, fields["id"])))
+        elif op == "reschedule":
+            self.pending.append((
+                "UPDATE tasks SET due = ? WHERE user_id = ? AND task_id = ?",
+                (dt.datetime.fromisoformat(fields["when"]).timestamp(), userID, fields["id"])
+            ))
+        elif op == "lastID":
+            self.pending.append((self.RAISE_LAST_ID, (userID, fields["id"])))
+    
+    def takeBatch(self):
+        batch, self.pending = self.pending, []
+        return batch
+    
+    def writeBatch(self, batch: list[tuple[str, tuple]]):
+        if not batch: return
+        with self.db:
+            for statement, params in batch:
+                self.db.execute(statement, params)
+    
+    def close(self):
+        self.commit()
+        self.db.close()
+    
+    def migrate(self, source: Storage):
+        """ Copies every task and time zone preference from `source` in one transaction, leaving it as it was and closing it. """
+        
+        try:
+            tm = source.read()
+            tzprefs = source.loadTZPrefs()
+        finally:
+            source.close()
+        with self.db:
+            self.db.execute("DELETE FROM tasks")
+            self.db.execute("DELETE FROM last_ids")
+            self.db.executemany(
+                "INSERT INTO tasks (user_id, task_id, due, message, interval) VALUES (?, ?, ?, ?, ?)",
+                ((userID, task.id, *self.taskToRow(task.asjson())) for userID, task in tm.items())
+            )
+            self.db.executemany(self.RAISE_LAST_ID, tm.lastIDs.items())
+            self.db.executemany(
+                "INSERT OR REPLACE INTO tzprefs (user_id, zone) VALUES (?, ?)",
+                ((int(userID), zone) for userID, zone in tzprefs.items())
+            )
+
+class PersistenceWorker:
+    """ Groups the changes recorded by a Storage into batched writes made off the event loop.
+    
+    The first change after a write schedules the next one `maxDelay` seconds later, so a burst of
+    commands and fires turns into a single write. Writes run one at a time, in order, in a
+    dedicated thread.
+    """
+    
+    def __init__(self, storage: Storage, maxDelay: float=S.STORAGE.MAX_DELAY):
+        self.storage = storage
+        self.maxDelay = maxDelay
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.flushing: Optional[asyncio.Task] = None
+        self.closed = False
+        self.writeDuration = Metrics.histogram(S.METRIC.WRITE_DURATION, S.METRIC.WRITE_DURATION_DESC)
+    
+    def write(self, batch):
+        # only ever called in the writer thread, so the histogram has one writer
+        start = time.perf_counter()
+        self.storage.writeBatch(batch)
+        self.writeDuration.observe(time.perf_counter() - start)
+    
+    def markDirty(self):
+        if not self.flushing and not self.closed:
+            self.flushing = asyncio.get_event_loop().create_task(self.flushLater())
+    
+    async def flushLater(self):
+        await asyncio.sleep(self.maxDelay)
+        # anything recorded from here on schedules another write
+        self.flushing = None
+        batch = self.storage.takeBatch()
+        await asyncio.get_event_loop().run_in_executor(self.executor, self.write, batch)
+    
+    async def flush(self):
+        """ Writes everything recorded so far right away, returning once it's durable. """
+        
+        await self.read(lambda: None)
+    
+    async def read(self, fn: Callable, *args):
+        """ Calls `fn` in the writer thread once everything recorded so far is written, so it sees every change. """
+        
+        if self.flushing:
+            self.flushing.cancel()
+            self.flushing = None
+        batch = self.storage.takeBatch()
+        
+        def writeThenRead():
+            # usually has little or nothing to write, so it's left out of the write times
+            self.storage.writeBatch(batch)
+            return fn(*args)
+        return await asyncio.get_event_loop().run_in_executor(self.executor, writeThenRead)
+    
+    def close(self):
+        """ Waits for in-flight writes, then writes whatever is still pending. Blocks, so only use it at shutdown. """
+        
+        if self.closed: return
+        self.closed = True
+        if self.flushing:
+            self.flushing.cancel()
+        self.executor.shutdown(wait=True)
+        self.storage.close()
+
+def getEngine() -> type[Taskmaster]:
+    """ Gets the Taskmaster engine named by the BRONZOS_ENGINE environment variable, defaulting to one object per task. """
+    
+    if os.getenv("BRONZOS_ENGINE", S.STORAGE.OBJECTS) == S.STORAGE.COLUMNAR:
+        # needs NumPy, so it's only imported when asked for
+        from ColumnarTaskmaster import ColumnarTaskmaster
+        return ColumnarTaskmaster
+    return Taskmaster
+
+def shardPath(path: str, shard: Optional[int]) -> str:
+    if shard is None:
+        return path
+    return os.path.join(S.PATH.SHARDS, str(shard), os.path.basename(path))
+
+def openStorage(shard: Optional[int]=None) -> Storage:
+    """ Opens the storage backend named by the BRONZOS_STORAGE environment variable, defaulting to JSON.
+    
+    With SQLite, setting BRONZOS_HORIZON to a number of hours only keeps tasks due within that
+    many hours in memory.
+    
+    A cluster worker passes its ID as `shard` to get its own storage, which starts out empty.
+    """
+    
+    if shard is not None:
+        os.makedirs(os.path.dirname(shardPath(S.PATH.TASKMASTER, shard)), exist_ok=True)
+        for path in [S.PATH.TASKMASTER, S.PATH.TZPREFS]:
+            if not os.path.exists(shardPath(path, shard)):
+                writeAtomically(shardPath(path, shard), b"{}")
+    
+    backend = os.getenv("BRONZOS_STORAGE", S.STORAGE.JSON)
+    if backend == S.STORAGE.SQLITE:
+        horizon = os.getenv("BRONZOS_HORIZON")
+        return SQLiteStorage(shardPath(S.PATH.DATABASE, shard), getEngine(), dt.timedelta(hours=float(horizon)) if horizon else None)
+    return JSONStorage(shardPath(S.PATH.TASKMASTER, shard), shardPath(S.PATH.JOURNAL, shard), shardPath(S.PATH.TZPREFS, shard), getEngine())
+
+if __name__ == "__main__":
+    # python Storage.py migrate: copies taskmaster.json and tzprefs.json into the SQLite database
+    if sys.argv[1:] == ["migrate"]:
+        target = SQLiteStorage(S.PATH.DATABASE)
+        target.migrate(JSONStorage(S.PATH.TASKMASTER, S.PATH.JOURNAL, S.PATH.TZPREFS))
+        target.close()
+    else:
+        print(S.STORAGE.USAGE)
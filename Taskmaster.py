@@ -1,10 +1,15 @@
 
 from __future__ import annotations
+import bisect
 import calendar
 import datetime as dt
+from enum import IntEnum
+import functools
+import heapq
 from pytz import timezone
 import re
-from typing import Optional, Union
+import sys
+from typing import Callable, Iterable, Iterator, Optional, Union
 
 from sources.general import _FORMAT
 
@@ -65,13 +70,65 @@ RECURRING = 1
 SPECIFIC = 2
 RELATIVE = 3
 
-YEARLY = "yearly"
-MONTHLY = "monthly"
-WEEKLY = "weekly"
-DAILY = "daily"
-HOURLY = "hourly"
+class Interval(IntEnum):
+    """ How often a Recur reschedules itself. Starts at 1 so every interval is truthy. """
+    
+    YEARLY = 1
+    MONTHLY = 2
+    WEEKLY = 3
+    DAILY = 4
+    HOURLY = 5
+    
+    @property
+    def label(self):
+        return self.name.lower()
+    
+    @staticmethod
+    def fromLabel(label: Optional[str]) -> Optional[Interval]:
+        return Interval[label.upper()] if label else None
+
+YEARLY = Interval.YEARLY
+MONTHLY = Interval.MONTHLY
+WEEKLY = Interval.WEEKLY
+DAILY = Interval.DAILY
+HOURLY = Interval.HOURLY
 
 UTC = timezone("UTC")
+EPOCH = dt.datetime(1970, 1, 1)
+# Intervals that are always the same number of seconds long.
+STEPS = {
+    WEEKLY: 7 * 24 * 60 * 60,
+    DAILY: 24 * 60 * 60,
+    HOURLY: 60 * 60
+}
+
+class ZoneOffsets:
+    """ A time zone's UTC offsets, looked up by bisecting its transitions rather than converting a whole datetime. """
+    
+    def __init__(self, tz: dt.tzinfo):
+        transitions = getattr(tz, "_utc_transition_times", None)
+        if transitions:
+            # pytz zones with daylight savings list when each offset starts, in UTC
+            self.starts = [calendar.timegm(start.timetuple()) for start in transitions]
+            self.offsets = [int(info[0].total_seconds()) for info in tz._transition_info]
+        else:
+            self.starts = [0]
+            self.offsets = [int(tz.utcoffset(None).total_seconds())]
+    
+    def offset(self, ts: int) -> int:
+        return self.offsets[max(bisect.bisect_right(self.starts, ts) - 1, 0)]
+    
+    def local(self, ts: int) -> dt.datetime:
+        """ Gets the naive local time at epoch seconds `ts`, as `astimezone` would give. """
+        
+        return EPOCH + dt.timedelta(seconds=ts + self.offset(ts))
+
+@functools.lru_cache(maxsize=1024)
+def zoneOffsets(tz: dt.tzinfo) -> ZoneOffsets:
+    return ZoneOffsets(tz)
+
+def localTime(ts: int, tz: dt.tzinfo) -> dt.datetime:
+    return zoneOffsets(tz).local(ts)
 
 class TaskTime:
     def __init__(self, original: Optional[TaskTime]=None):
@@ -152,110 +209,138 @@ class TaskTime:
             datetime = dt.datetime(yr, mo, d, h, m, s, tzinfo=now.tzinfo)
         return datetime
 
+def applyTimePart(time: TaskTime, num: Union[str, int], unit: Optional[str]):
+    if unit == "yr":
+        time.year = int(num)
+    elif unit == "mo":
+        time.month = int(num)
+    elif unit == "wkd":
+        time.weekday = int(num)
+    elif unit == "d":
+        time.day = int(num)
+    elif unit == "h":
+        time.hour = int(num)
+    elif unit in ["am", "pm"] or (isinstance(num, str) and ":" in num):
+        if ":" in num:
+            h, m = num.split(":", 1)
+            if not m:
+                raise TaskException(f"Couldn't get a minute value from the time part `{num}`.")
+            if h:
+                time.hour = int(h) + (12 if unit == "pm" else 0)
+            time.minute = int(m)
+        else:
+            time.hour = int(num) + (12 if unit == "pm" else 0)
+    elif unit == "m":
+        time.minute = int(num)
+    elif unit == "s":
+        time.second = int(num)
+    else:
+        raise TaskException(f"The time part `{str(num) + unit}` had an invalid unit. Must be one of `yr`, `mo`, `w`, `d`, `h`, `m`, or `s`.")
+
+# The unit of a token that sets the interval rather than part of the time.
+INTERVAL = "interval"
+# Reference words, as (reference point, interval).
+REFS = {
+    "each": (RECURRING, None),
+    "every": (RECURRING, None),
+    "per": (RECURRING, None),
+    "yearly": (RECURRING, YEARLY),
+    "monthly": (RECURRING, MONTHLY),
+    "weekly": (RECURRING, WEEKLY),
+    "daily": (RECURRING, DAILY),
+    "hourly": (RECURRING, HOURLY),
+    "on": (SPECIFIC, None),
+    "at": (SPECIFIC, None),
+    "in": (RELATIVE, None)
+}
+# Whole words that are time parts, as (value, unit). Words with an ordinal suffix are days,
+# even "august", so only the interval words can have one.
+KEYWORDS: dict[str, tuple[Union[int, Interval], str]] = {
+    **{name: (i, "mo") for names in [MONTHS, MONTHS_FULL] for i, name in enumerate(names) if not name.endswith(("st", "nd", "th"))},
+    **{name: (i, "wkd") for names in [WEEKDAYS, WEEKDAYS_FULL] for i, name in enumerate(names)},
+    "year": (YEARLY, INTERVAL),
+    "month": (MONTHLY, INTERVAL),
+    "week": (WEEKLY, INTERVAL),
+    "day": (DAILY, INTERVAL),
+    "hour": (HOURLY, INTERVAL)
+}
+yearPat = re.compile(r"[0-9]{4}")
+# Distinct entries worth remembering the parsed time of.
+TEMPLATE_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE * 4)
+def tokenize(arg: str) -> Optional[tuple[Union[str, int, Interval], Optional[str]]]:
+    """ Gets the (value, unit) time part a word stands for, or None if it starts the message. """
+    
+    lArg = arg.lower()
+    if lArg in KEYWORDS:
+        return KEYWORDS[lArg]
+    if lArg.endswith(("st", "nd", "th")):
+        return lArg[:-2], "d"
+    if yearPat.fullmatch(lArg):
+        return lArg, "yr"
+    timePartMatch = timePartPat.search(arg)
+    if timePartMatch:
+        return timePartMatch.group(1), timePartMatch.group(2)
+    if ":" in lArg:
+        return lArg, None
+    return None
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def parseTime(ref: str, parts: tuple[str, ...]) -> tuple[Optional[Interval], TaskTime]:
+    """ Parses the time an entry starts with, from its lowercased reference word and its time tokens.
+    
+    Cached, since the same few entries like `daily 9:00am` make up most of what's created.
+    Don't change the TaskTime it returns; copy it.
+    """
+    
+    interval = REFS[ref][1]
+    time = TaskTime()
+    for arg in parts:
+        num, unit = tokenize(arg)
+        if unit == INTERVAL:
+            interval = num
+        else:
+            applyTimePart(time, num, unit)
+    return interval, time
+
+# What parsing an entry or working out its time can raise, besides a TaskException, for a time that
+# doesn't exist or is out of datetime's range.
+TIME_ERRORS = (ValueError, OverflowError, OSError)
+
 class Parser:
     def __init__(self, args: list[str]):
         self.ref: Optional[Union[RECURRING, SPECIFIC, RELATIVE]] = None
         self.message: Optional[str] = None
         self.recur: bool = False
-        self.interval: Optional[str] = None
+        self.interval: Optional[Interval] = None
         self.time = TaskTime()
 
         self.i: int = 0
 
         self.parse(args)
     
-    def processTimePart(self, num: Union[str, int], unit: str):
-
-        if unit == "yr":
-            self.time.year = int(num)
-        elif unit == "mo":
-            self.time.month = int(num)
-        elif unit == "wkd":
-            self.time.weekday = int(num)
-        elif unit == "d":
-            self.time.day = int(num)
-        elif unit == "h":
-            self.time.hour = int(num)
-        elif unit in ["am", "pm"] or (isinstance(num, str) and ":" in num):
-            if ":" in num:
-                h, m = num.split(":", 1)
-                if not m:
-                    raise TaskException(f"Couldn't get a minute value from the time part `{num}`.")
-                if h:
-                    self.time.hour = int(h) + (12 if unit == "pm" else 0)
-                self.time.minute = int(m)
-            else:
-                self.time.hour = int(num) + (12 if unit == "pm" else 0)
-        elif unit == "m":
-            self.time.minute = int(num)
-        elif unit == "s":
-            self.time.second = int(num)
-        else:
-            raise TaskException(f"The time part `{str(num) + unit}` had an invalid unit. Must be one of `yr`, `mo`, `w`, `d`, `h`, `m`, or `s`.")
+    def processTimePart(self, num: Union[str, int], unit: Optional[str]):
+        applyTimePart(self.time, num, unit)
 
     def parse(self, args: list[str]):
         entry = ' '.join(args)
         ref, *args = args
         ref = ref.lower()
         
-        if ref in ["each", "every", "per"]:
-            self.ref = RECURRING
-        elif ref == "yearly":
-            self.ref = RECURRING
-            self.interval = YEARLY
-        elif ref == "monthly":
-            self.ref = RECURRING
-            self.interval = MONTHLY
-        elif ref == "weekly":
-            self.ref = RECURRING
-            self.interval = WEEKLY
-        elif ref == "daily":
-            self.ref = RECURRING
-            self.interval = DAILY
-        elif ref == "hourly":
-            self.ref = RECURRING
-            self.interval = HOURLY
-        elif ref in ["on", "at"]:
-            self.ref = SPECIFIC
-        elif ref in ["in"]:
-            self.ref = RELATIVE
-        else:
+        if not ref in REFS:
             raise TaskException(f"The entry `{entry}` had an invalid reference point `{self.ref}`. Must be one of `in`, `on`, or `at`.")
+        self.ref = REFS[ref][0]
 
-        for i, arg in enumerate(args):
-            timePartMatch = timePartPat.search(arg)
-            lArg = arg.lower()
-            if lArg == "year":
-                self.interval = YEARLY
-            elif lArg == "month":
-                self.interval = MONTHLY
-            elif lArg == "week":
-                self.interval = WEEKLY
-            elif lArg == "day":
-                self.interval = DAILY
-            elif lArg == "hour":
-                self.interval = HOURLY
-            elif any([lArg.endswith(x) for x in ["st", "nd", "th"]]):
-                self.processTimePart(lArg[:-2], "d")
-            elif lArg in MONTHS:
-                self.processTimePart(MONTHS.index(lArg), "mo")
-            elif lArg in MONTHS_FULL:
-                self.processTimePart(MONTHS_FULL.index(lArg), "mo")
-            elif lArg in WEEKDAYS:
-                self.processTimePart(WEEKDAYS.index(lArg), "wkd")
-            elif lArg in WEEKDAYS_FULL:
-                self.processTimePart(WEEKDAYS_FULL.index(lArg), "wkd")
-            elif all([n in "1234567890" for n in lArg]) and len(lArg) == 4:
-                self.processTimePart(lArg, "yr")
-            elif timePartMatch:
-                self.processTimePart(timePartMatch.group(1), timePartMatch.group(2))
-            elif ":" in lArg:
-                self.processTimePart(lArg, None)
-            else:
-                break
+        i = 0
+        while i < len(args) and tokenize(args[i]):
+            i += 1
+        self.interval, time = parseTime(ref, tuple(args[:i]))
+        self.time = TaskTime(time)
         if not self.time.hasData():
             raise TaskException(f"The entry `{entry}` did not specify a time.")
-        self.message = " ".join(args[i:])
+        # an entry that's all time parts keeps its last one as the message
+        self.message = " ".join(args[min(i, len(args) - 1):])
     
     def getMessage(self):
         return self.message
@@ -271,19 +356,38 @@ class Parser:
 
 
 class Task:
+    # Tasks are kept by the million, so they're slotted and keep their time as an int.
+    __slots__ = ("ts", "message", "kill", "id")
+    
     def __init__(self, when: dt.datetime, message: str):
-        # When the Task will fire.
-        self.when = when
-        # The message the Task will return when it fires.
-        self.message = message
+        # When the Task will fire, in epoch seconds.
+        self.ts = int(when.timestamp())
+        # The message the Task will return when it fires. Interned, since the same reminders get set over and over.
+        self.message = sys.intern(message)
         # A flag to set when the Task is done.
         self.kill = False
+        # The Task's ID among its user's tasks, given out by the Taskmaster.
+        self.id: Optional[int] = None
+    
+    @property
+    def when(self) -> dt.datetime:
+        return dt.datetime.fromtimestamp(self.ts, UTC)
+    
+    @when.setter
+    def when(self, when: dt.datetime):
+        self.ts = int(when.timestamp())
+    
+    def __lt__(self, other: Task):
+        # only reached to break ties between a user's tasks in the due heap, where any consistent order will do
+        return id(self) < id(other)
     
     def asjson(self):
         obj = dict(
             when = self.when.isoformat(),
             message = self.message
         )
+        if self.id is not None:
+            obj["id"] = self.id
         return obj
     
     @staticmethod
@@ -293,7 +397,7 @@ class Task:
         return Task(when, message)
     
     def formatted(self, tz: timezone):
-        return f"On {self.getWhen().astimezone(tz).strftime(_FORMAT)}:"
+        return f"On {localTime(self.ts, tz).strftime(_FORMAT)}:"
     
     def getWhen(self):
         return self.when
@@ -301,11 +405,13 @@ class Task:
     def getMessage(self):
         return self.message
     
-    async def tick(self, now: dt.datetime):
+    async def tick(self, now: dt.datetime) -> Optional[tuple[str, int]]:
+        """ Fires the Task if it's due by `now`, returning its message and how many earlier occurrences were missed. """
+        
         if now >= self.when:
             self.kill = True
-            return self.fire()
-        return False
+            return self.fire(), 0
+        return None
     
     def fire(self):
         return self.message
@@ -314,103 +420,414 @@ class Task:
         self.kill = True
 
 class Recur(Task):
-    def __init__(self, when: dt.datetime, message: str, interval: str):
+    __slots__ = ("interval",)
+    
+    def __init__(self, when: dt.datetime, message: str, interval: Optional[Interval]):
         super().__init__(when, message)
         self.interval = interval
     
+    def getIntervalLabel(self):
+        return self.interval.label if self.interval else None
+    
     def asjson(self):
         obj = super().asjson()
-        obj["interval"] = self.interval
+        obj["interval"] = self.getIntervalLabel()
         return obj
     
     @staticmethod
     def fromjson(obj: dict[str, Union[str, int]]):
         when = dt.datetime.fromisoformat(obj["when"])
         message = obj["message"]
-        interval = obj["interval"]
+        interval = Interval.fromLabel(obj["interval"])
         return Recur(when, message, interval)
     
     def formatted(self, tz: timezone):
-        return f"On {self.getWhen().astimezone(tz).strftime(_FORMAT)}; reschedule {self.interval}:"
+        return f"On {localTime(self.ts, tz).strftime(_FORMAT)}; reschedule {self.getIntervalLabel()}:"
     
-    async def tick(self, now: dt.datetime):
+    async def tick(self, now: dt.datetime) -> Optional[tuple[str, int]]:
         if now >= self.when:
-            if self.interval == YEARLY:
-                self.when = self.when.replace(year=now.year + 1)
-            elif self.interval == MONTHLY:
-                if now.month == 12:
-                    self.when = self.when.replace(year=now.year + 1, month=1)
-                else:
-                    self.when = self.when.replace(month=now.month + 1)
-            elif self.interval == WEEKLY:
-                self.when += dt.timedelta(days=7)
-            elif self.interval == DAILY:
-                self.when += dt.timedelta(days=1)
-            elif self.interval == HOURLY:
-                self.when += dt.timedelta(hours=1)
-            return self.fire()
+            when, missed = nextOccurrence(self.when, self.interval, now)
+            if when is None:
+                # nothing to repeat on, so it only fires once
+                self.kill = True
+            else:
+                self.when = when
+            return self.fire(), missed
+        return None
+
+def shiftedBy(when: dt.datetime, months: int) -> Optional[dt.datetime]:
+    """ Moves `when` by a number of months, keeping its day. Gets None if that month doesn't have the day. """
+    
+    year, month = divmod(when.month - 1 + months, 12)
+    try:
+        return when.replace(year=when.year + year, month=month + 1)
+    except ValueError:
+        return None
+
+def nextOccurrence(when: dt.datetime, interval: Optional[Interval], now: dt.datetime) -> tuple[Optional[dt.datetime], int]:
+    """ Gets the first occurrence of a recurring task due at `when` that's after `now`, along with how many occurrences were missed in between.
+    
+    It's worked out directly rather than one interval at a time, so a task that was due long ago costs
+    no more than one that's just due. Like iCalendar, monthly and yearly tasks skip months and years
+    that don't have their day, such as the 31st or February 29th. A task without an interval has no next occurrence.
+    """
+    
+    if now < when:
+        return when, 0
+    if interval in STEPS:
+        step = STEPS[interval]
+        # occurrences from `when` through `now`, the first of which is the one firing
+        count = (int(now.timestamp()) - int(when.timestamp())) // step + 1
+        return when + dt.timedelta(seconds=count * step), count - 1
+    if interval in [YEARLY, MONTHLY]:
+        months = 12 if interval == YEARLY else 1
+        i = max(((now.year - when.year) * 12 + now.month - when.month) // months, 1)
+        # at most a few steps: past `now` within this interval, or past a month or year without the day
+        while (shiftedBy(when, i * months) or now) <= now:
+            i += 1
+        if when.day <= 28:
+            missed = i - 1
+        else:
+            missed = sum(1 for j in range(1, i) if shiftedBy(when, j * months))
+        return shiftedBy(when, i * months), missed
+    return None, 0
+
+def latestOccurrence(when: dt.datetime, interval: Optional[Interval], now: dt.datetime) -> dt.datetime:
+    """ Gets the last occurrence of a recurring task due at `when` that isn't after `now`, which is the one a catch-up reminder stands for. """
+    
+    if now < when:
+        return when
+    if interval in STEPS:
+        step = STEPS[interval]
+        return when + dt.timedelta(seconds=(int(now.timestamp()) - int(when.timestamp())) // step * step)
+    if interval in [YEARLY, MONTHLY]:
+        months = 12 if interval == YEARLY else 1
+        i = max(((now.year - when.year) * 12 + now.month - when.month) // months, 0)
+        # back past a month or year without the day, or one that's still after `now`
+        while i and (shiftedBy(when, i * months) or now + dt.timedelta(seconds=1)) > now:
+            i -= 1
+        return shiftedBy(when, i * months) if i else when
+    return when
+
+def insortByTime(tasks: list[Task], task: Task):
+    """ Inserts a task into a list sorted by due time, after any due at the same time. """
+    
+    lo, hi = 0, len(tasks)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if task.ts < tasks[mid].ts:
+            hi = mid
+        else:
+            lo = mid + 1
+    tasks.insert(lo, task)
+
+def indexByTime(tasks: list[Task], task: Task, ts: int) -> int:
+    """ Finds a task in a list sorted by due time, where it was put when it was due at `ts`. """
+    
+    lo, hi = 0, len(tasks)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if tasks[mid].ts < ts:
+            lo = mid + 1
+        else:
+            hi = mid
+    # tasks due at the same time could be equal in every field, so only the same object will do
+    while tasks[lo] is not task:
+        lo += 1
+    return lo
+
+def taskFromjson(obj: dict[str, Union[str, int]]) -> Task:
+    typ = Recur if "interval" in obj else Task
+    task = typ.fromjson(obj)
+    task.id = obj.get("id")
+    return task
 
 class Taskmaster:
     def __init__(self):
-        self.taskLists: dict[int, list[Task]] = {}
+        # Each user's tasks by ID, in the order they were made.
+        self.userTasks: dict[int, dict[int, Task]] = {}
+        # Each user's tasks again, soonest first, for listing. Kept sorted as tasks are added and rescheduled.
+        self.sortedLists: dict[int, list[Task]] = {}
+        # The highest ID each user has been given, so IDs aren't reused. Kept by storage, since removed tasks take theirs with them.
+        self.lastIDs: dict[int, int] = {}
+        # Called with (op, userID, fields) for every change, so storage can record changes instead of whole states.
+        self.onChange: Optional[Callable[[str, int, dict], None]] = None
+        # Min-heap of (epoch seconds, userID, task) entries, so update only has to look at due tasks.
+        # Removed tasks are cancelled and left in the heap until they're popped or the heap is rebuilt.
+        self.dueHeap: list[tuple[int, int, Task]] = []
+        self.stale = 0
+        # How many tasks the last update looked at, for metrics.
+        self.lastScanned = 0
     
     def asjson(self):
         obj = {}
-        for userID in self.taskLists:
-            tasks = self.taskLists[userID]
-            obj[str(userID)] = [task.asjson() for task in tasks]
+        for userID in self.userTasks:
+            tasks = self.userTasks[userID]
+            obj[str(userID)] = [task.asjson() for task in tasks.values()]
         return obj
     
-    @staticmethod
-    def fromjson(obj: dict[str, list[dict[str, Union[int, str]]]]):
-        tm = Taskmaster()
-        for userID in obj:
-            tasks = []
-            typ: Optional[type[Task]] = None
-            for taskObj in obj[userID]:
-                if "interval" in taskObj:
-                    typ = Recur
-                else:
-                    typ = Task
-                tasks.append(typ.fromjson(taskObj))
-            tm.taskLists[int(userID)] = tasks
+    @classmethod
+    def fromjson(cls, obj: dict[str, list[dict[str, Union[int, str]]]]):
+        return cls.fromitems((int(userID), taskFromjson(taskObj)) for userID in obj for taskObj in obj[userID])
+    
+    @classmethod
+    def fromitems(cls, items: Iterable[tuple[int, Task]]):
+        """ Builds a Taskmaster from (user ID, task) pairs, without recording them as changes. Tasks without IDs are given one. """
+        
+        tm = cls()
+        for userID, task in items:
+            tm.assignID(task, userID)
+            tm.keep(userID, task)
+        tm.reindex()
         return tm
     
-    async def update(self, time: dt.datetime) -> dict[int, list[str]]:
-        messages: dict[int, list[str]] = {}
-        outerIndex = 0
-        userIDs = list(self.taskLists.keys())
-
-        while outerIndex < len(userIDs):
-            userID = userIDs[outerIndex]
-            index = 0
-            tasks = self.taskLists[userID]
-
-            while index < len(tasks):
-                task = tasks[index]
-                fired = await task.tick(time)
-                if fired:
-                    if not messages.get(userID):
-                        messages[userID] = []
-                    messages[userID].append(fired)
-                if task.kill:
-                    index -= 1
-                    tasks.remove(task)
-                index += 1
+    def items(self) -> Iterator[tuple[int, Task]]:
+        for userID, tasks in self.userTasks.items():
+            for task in tasks.values():
+                yield userID, task
+    
+    def snapshot(self) -> Callable[[], dict[str, list[dict[str, Union[int, str]]]]]:
+        """ Takes a cheap copy of the current state, returning a function that serializes it as `asjson` would.
+        
+        Only the lists are copied, not the tasks; the only change made to a task in place is a
+        reschedule, which sets an absolute time, so replaying it on a snapshot that already has it is harmless.
+        The returned function is safe to call off the event loop.
+        """
+        
+        userTasks = {userID: list(tasks.values()) for userID, tasks in self.userTasks.items()}
+        return lambda: {str(userID): [task.asjson() for task in tasks] for userID, tasks in userTasks.items()}
+    
+    def itemsSnapshot(self, userID: Optional[int]=None) -> Iterator[tuple[int, Task]]:
+        """ Like `items`, for every user or just one, but over a cheap copy like `snapshot`'s, so it's safe to go through off the event loop. """
+        
+        if userID is not None:
+            userTasks = {userID: list(self.userTasks.get(userID, {}).values())}
+        else:
+            userTasks = {userID: list(tasks.values()) for userID, tasks in self.userTasks.items()}
+        return ((userID, task) for userID, tasks in userTasks.items() for task in tasks)
+    
+    def snapshotBatches(self) -> Iterator[Iterator[tuple[int, Task]]]:
+        """ Like `itemsSnapshot` for every user, split into batches that are each cheap to copy, so other work can run on the event loop between them. """
+        
+        for userID in list(self.userTasks):
+            yield self.itemsSnapshot(userID)
+    
+    def record(self, op: str, userID: int, **fields):
+        if self.onChange:
+            self.onChange(op, userID, fields)
+    
+    def eventID(self, event: dict) -> int:
+        if "id" in event:
+            return event["id"]
+        # journals written before tasks had IDs refer to them by their index in the user's list
+        return list(self.userTasks[event["user"]])[event["index"]]
+    
+    def applyEvent(self, event: dict):
+        """ Replays a change passed to `onChange`. Call `reindex` once all events are applied. """
+        
+        op, userID = event["op"], event["user"]
+        if op == "create":
+            self.addTask(taskFromjson(event["task"]), userID)
+        elif op in ["remove", "fire"]:
+            self.removeTask(userID, self.eventID(event))
+        elif op == "reschedule":
+            # moved like a live reschedule, since a later removal finds the task by its place in the sorted list
+            task = self.userTasks[userID][self.eventID(event)]
+            due = task.ts
+            task.when = dt.datetime.fromisoformat(event["when"])
+            self.unsort(task, userID, due)
+            insortByTime(self.sortedLists.setdefault(userID, []), task)
+        elif op == "lastID":
+            self.restoreLastIDs({userID: event["id"]})
+    
+    def reindex(self):
+        self.sortedLists = {userID: sorted(tasks.values(), key=lambda task: task.ts) for userID, tasks in self.userTasks.items()}
+        self.dueHeap = [
+            (task.ts, userID, task)
+            for userID, tasks in self.userTasks.items()
+            for task in tasks.values()
+        ]
+        heapq.heapify(self.dueHeap)
+        self.stale = 0
+    
+    def schedule(self, task: Task, userID: int):
+        heapq.heappush(self.dueHeap, (task.ts, userID, task))
+    
+    def nextDue(self) -> Optional[dt.datetime]:
+        while self.dueHeap and self.dueHeap[0][2].kill:
+            heapq.heappop(self.dueHeap)
+            self.stale -= 1
+        return dt.datetime.fromtimestamp(self.dueHeap[0][0], UTC) if self.dueHeap else None
+    
+    def dueWithin(self, time: dt.datetime) -> set[int]:
+        """ Gets the IDs of users with a task due by `time`, only visiting heap entries that are due. """
+        
+        until = time.timestamp()
+        userIDs = set()
+        toVisit = [0]
+        while toVisit:
+            i = toVisit.pop()
+            if i < len(self.dueHeap) and self.dueHeap[i][0] <= until:
+                _, userID, task = self.dueHeap[i]
+                if not task.kill:
+                    userIDs.add(userID)
+                toVisit += [2 * i + 1, 2 * i + 2]
+        return userIDs
+    
+    async def update(self, time: dt.datetime) -> dict[int, list[tuple[str, dt.datetime, int]]]:
+        """ Fires every task due by `time`, returning each user's (message, due time, missed occurrences) tuples.
+        
+        A recurring task that was due long ago fires once and moves straight past `time`. Its due time
+        is that of the latest occurrence it missed, which is the one the reminder stands for.
+        """
+        
+        messages: dict[int, list[tuple[str, dt.datetime, int]]] = {}
+        # Recurring tasks are pushed back after the loop, so one that doesn't move past `time` can't fire twice in one update.
+        toReschedule: list[tuple[Task, int]] = []
+
+        now = time.timestamp()
+        scanned = 0
+        while self.dueHeap and self.dueHeap[0][0] <= now:
+            due, userID, task = heapq.heappop(self.dueHeap)
+            scanned += 1
+            if task.kill:
+                self.stale -= 1
+                continue
             
-            if not tasks:
-                outerIndex -= 1
-                self.taskLists.pop(userID)
-                userIDs.remove(userID)
-            outerIndex += 1
+            fired = await task.tick(time)
+            if fired:
+                message, missed = fired
+                occurred = dt.datetime.fromtimestamp(due, UTC)
+                if missed:
+                    occurred = latestOccurrence(occurred, task.interval, time)
+                if not messages.get(userID):
+                    messages[userID] = []
+                messages[userID].append((message, occurred, missed))
+            if task.kill:
+                self.discard(task, userID)
+            elif self.rescheduled(task, userID, due):
+                toReschedule.append((task, userID))
         
+        for task, userID in toReschedule:
+            self.schedule(task, userID)
+        
+        self.lastScanned = scanned
         return messages
     
+    def rescheduled(self, task: Task, userID: int, due: int) -> bool:
+        """ Records that a recurring task moved from `due`, returning whether it should go back in the due heap. """
+        
+        self.record("reschedule", userID, id=task.id, when=task.when.isoformat())
+        self.unsort(task, userID, due)
+        insortByTime(self.sortedLists.setdefault(userID, []), task)
+        return True
+    
+    def assignID(self, task: Task, userID: int):
+        """ Gives a task the user's next ID if it doesn't have one or its ID is taken. """
+        
+        lastID = self.lastIDs.get(userID, 0)
+        if task.id is None or task.id in self.userTasks.get(userID, {}):
+            task.id = lastID + 1
+        self.lastIDs[userID] = max(lastID, task.id)
+    
+    def restoreLastIDs(self, lastIDs: dict[int, int]):
+        """ Takes on the highest IDs users were given before a restart, where they're past the IDs of the tasks that were loaded. """
+        
+        for userID, lastID in lastIDs.items():
+            self.lastIDs[userID] = max(self.lastIDs.get(userID, 0), lastID)
+    
+    def takeLastID(self, userID: int, lastID: int):
+        """ Takes on the highest ID a user was given somewhere else, such as on another cluster worker. Call it after adding their tasks. """
+        
+        self.restoreLastIDs({userID: lastID})
+        self.record("lastID", userID, id=lastID)
+    
+    def keep(self, userID: int, task: Task):
+        # the task has to have its ID already, since some engines can't tell a taken ID from its own
+        self.userTasks.setdefault(userID, {})[task.id] = task
+    
+    def forget(self, task: Task, userID: int, due: Optional[int]=None):
+        tasks = self.userTasks[userID]
+        del tasks[task.id]
+        if not tasks:
+            self.userTasks.pop(userID)
+        self.unsort(task, userID, due)
+    
+    def unsort(self, task: Task, userID: int, due: Optional[int]=None):
+        # a rescheduled task is still where its old due time put it
+        tasks = self.sortedLists[userID]
+        del tasks[indexByTime(tasks, task, task.ts if due is None else due)]
+        if not tasks:
+            self.sortedLists.pop(userID)
+    
+    def discard(self, task: Task, userID: int):
+        self.forget(task, userID)
+        self.record("fire", userID, id=task.id)
+    
     def addTask(self, task: Task, userID: int):
-        if not self.taskLists.get(userID):
-            self.taskLists[userID] = []
-        self.taskLists[userID].append(task)
+        self.assignID(task, userID)
+        self.keep(userID, task)
+        insortByTime(self.sortedLists.setdefault(userID, []), task)
+        self.schedule(task, userID)
+        self.record("create", userID, task=task.asjson())
     
-    def getTasks(self, userID: int):
-        return self.taskLists.get(userID)
-        
\ No newline at end of file
+    def addTasks(self, tasks: list[Task], userID: int):
+        """ Adds many tasks for a user at once, sorting their list once rather than for every task. """
+        
+        for task in tasks:
+            self.assignID(task, userID)
+            self.keep(userID, task)
+            self.schedule(task, userID)
+            self.record("create", userID, task=task.asjson())
+        if tasks:
+            sortedTasks = self.sortedLists.setdefault(userID, [])
+            sortedTasks.extend(tasks)
+            sortedTasks.sort(key=lambda task: task.ts)
+    
+    def removeTask(self, userID: int, taskID: int) -> Task:
+        task = self.userTasks[userID][taskID]
+        self.forget(task, userID)
+        self.record("remove", userID, id=taskID)
+        self.unschedule([task])
+        return task
+    
+    def removeTasks(self, userID: int, taskIDs: Iterable[int]) -> list[Task]:
+        """ Removes several of a user's tasks. Their changes are recorded together, so they're written in one batch.
+        
+        The user's sorted list is filtered once, rather than searched for every task.
+        """
+        
+        tasks = self.userTasks.get(userID, {})
+        removed = [tasks[taskID] for taskID in taskIDs]
+        if not removed:
+            return []
+        for task in removed:
+            del tasks[task.id]
+            self.record("remove", userID, id=task.id)
+        self.unschedule(removed)
+        if tasks:
+            self.sortedLists[userID] = [task for task in self.sortedLists[userID] if not task.kill]
+        else:
+            self.userTasks.pop(userID)
+            self.sortedLists.pop(userID)
+        return removed
+    
+    def unschedule(self, tasks: list[Task]):
+        # the heap entries are dropped lazily; rebuild once most of the heap is dead weight
+        for task in tasks:
+            task.cancel()
+        self.stale += len(tasks)
+        if self.stale > len(self.dueHeap) // 2:
+            self.reindex()
+    
+    def getTask(self, userID: int, taskID: int) -> Optional[Task]:
+        return self.userTasks.get(userID, {}).get(taskID)
+    
+    def getTasks(self, userID: int) -> Optional[list[Task]]:
+        tasks = self.userTasks.get(userID)
+        return list(tasks.values()) if tasks else None
+    
+    def getSortedTasks(self, userID: int) -> Optional[list[Task]]:
+        """ Gets a user's tasks, soonest first. Don't change the list. """
+        
+        return self.sortedLists.get(userID)
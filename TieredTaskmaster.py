@@ -0,0 +1,92 @@
+from __future__ import annotations
+import datetime as dt
+from typing import Iterable, Optional
+
+from Taskmaster import Task, Taskmaster, insortByTime
+
+class TieredTaskmaster(Taskmaster):
+    """ A Taskmaster that only keeps tasks due before `until` in memory, leaving the rest in the SQLite database.
+
+    `until` is moved forward by promoting the rows that come due before the new horizon.
+    Every task, in memory or not, is a database row keyed by its user and task ID, so `lastIDs`
+    has to start from the database's rather than from the tasks in memory.
+    """
+
+    def __init__(self, lastIDs: dict[int, int], until: dt.datetime):
+        super().__init__()
+        self.lastIDs = lastIDs
+        # every task due by this time is in memory
+        self.until = int(until.timestamp())
+        # (user ID, task ID) pairs removed from disk that an in-flight promotion may have read before they were deleted
+        self.removedFar: set[tuple[int, int]] = set()
+
+    def startPromotion(self, until: dt.datetime) -> tuple[int, int]:
+        """ Moves the horizon forward, getting the range of due times whose rows need promoting.
+
+        Tasks created or rescheduled from here on go straight into memory if they're due before
+        the new horizon. Read the range's rows from the database, then pass them to `promote`.
+        """
+
+        after, self.until = self.until, int(until.timestamp())
+        self.removedFar.clear()
+        return after, self.until
+
+    def promote(self, rows: list[tuple[int, Task]]):
+        """ Brings (user ID, task) rows read from disk into memory, skipping any that changed since they were read. """
+
+        for userID, task in rows:
+            if self.getTask(userID, task.id) or (userID, task.id) in self.removedFar:
+                continue
+            # rows already have their IDs
+            self.keep(userID, task)
+            insortByTime(self.sortedLists.setdefault(userID, []), task)
+            self.schedule(task, userID)
+
+    def assignID(self, task: Task, userID: int):
+        # tasks on disk aren't in memory to collide with, so only IDs past the user's last one are safe
+        lastID = self.lastIDs.get(userID, 0)
+        if task.id is None or task.id <= lastID:
+            task.id = lastID + 1
+        self.lastIDs[userID] = task.id
+
+    def rescheduled(self, task: Task, userID: int, due: int):
+        if task.ts > self.until:
+            self.record("reschedule", userID, id=task.id, when=task.when.isoformat())
+            # it'll be promoted again when the horizon reaches it
+            self.forget(task, userID, due)
+            return False
+        return super().rescheduled(task, userID, due)
+
+    def addTask(self, task: Task, userID: int):
+        # the ID is given out even if the task stays on disk, so the user can refer to it
+        self.assignID(task, userID)
+        self.record("create", userID, task=task.asjson())
+        if task.ts <= self.until:
+            self.keep(userID, task)
+            insortByTime(self.sortedLists.setdefault(userID, []), task)
+            self.schedule(task, userID)
+
+    def addTasks(self, tasks: list[Task], userID: int):
+        for task in tasks:
+            self.addTask(task, userID)
+
+    def removeTask(self, userID: int, taskID: int) -> Optional[Task]:
+        """ Removes a task whether or not it's in memory, getting it back if it was. """
+
+        if self.getTask(userID, taskID):
+            return super().removeTask(userID, taskID)
+        self.removeFar(userID, taskID)
+        return None
+
+    def removeTasks(self, userID: int, taskIDs: Iterable[int]) -> list[Optional[Task]]:
+        taskIDs = list(taskIDs)
+        near = [taskID for taskID in taskIDs if self.getTask(userID, taskID)]
+        removed = dict(zip(near, super().removeTasks(userID, near)))
+        for taskID in taskIDs:
+            if taskID not in removed:
+                self.removeFar(userID, taskID)
+        return [removed.get(taskID) for taskID in taskIDs]
+
+    def removeFar(self, userID: int, taskID: int):
+        self.record("remove", userID, id=taskID)
+        self.removedFar.add((userID, taskID))
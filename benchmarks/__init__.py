@@ -0,0 +1,46 @@
+""" Benchmarks for bronzOS that run without connecting to Discord. Run them from the repository root, e.g. `python -m benchmarks.memory`. """
+
+import datetime as dt
+import json
+
+MESSAGES = [
+    "take meds",
+    "stand up and stretch",
+    "water the plants",
+    "standup meeting",
+    "pay rent",
+    "change laundry",
+    "writing sprint",
+    "call mom"
+]
+INTERVALS = [None, "hourly", "daily", "weekly", "monthly", "yearly"]
+START = dt.datetime(2030, 1, 1, tzinfo=dt.timezone.utc)
+
+def engines() -> list[type]:
+    """ Gets the Taskmaster engines that can run here. """
+    
+    from Taskmaster import Taskmaster
+    try:
+        from ColumnarTaskmaster import ColumnarTaskmaster
+    except ImportError:
+        # NumPy is optional, like it is for the bot
+        return [Taskmaster]
+    return [Taskmaster, ColumnarTaskmaster]
+
+def makeTaskmasterJSON(count: int, users: int=1000, recurEvery: int=4) -> dict[str, list[dict[str, str]]]:
+    """ Builds a taskmaster.json object with `count` tasks spread across `users` users.
+    
+    Every `recurEvery`th task recurs. The object is round-tripped through `json` so its strings
+    are separate objects, like they would be when loaded from disk.
+    """
+    
+    obj: dict[str, list[dict[str, str]]] = {}
+    for i in range(count):
+        task = {
+            "when": (START + dt.timedelta(minutes=i)).isoformat(),
+            "message": MESSAGES[i % len(MESSAGES)]
+        }
+        if i % recurEvery == 0:
+            task["interval"] = INTERVALS[1 + i // recurEvery % (len(INTERVALS) - 1)]
+        obj.setdefault(str(i % users), []).append(task)
+    return json.loads(json.dumps(obj))
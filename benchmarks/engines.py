@@ -0,0 +1,82 @@
+""" Compares the object and columnar Taskmaster engines, checking that they behave the same along the way.
+
+Usage: python -m benchmarks.engines [task count ...]
+"""
+
+import asyncio
+import datetime as dt
+import gc
+import sys
+import time
+import tracemalloc
+
+from benchmarks import START, makeTaskmasterJSON
+from ColumnarTaskmaster import ColumnarTaskmaster
+from Taskmaster import Task, Taskmaster
+
+ENGINES = [Taskmaster, ColumnarTaskmaster]
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def load(engine: type[Taskmaster], obj: dict):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tm, loadTime = timed(engine.fromjson, obj)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return tm, loadTime, size
+
+def normalized(messages: dict[int, list[tuple[str, dt.datetime, int]]]):
+    return {userID: sorted(userMessages) for userID, userMessages in messages.items()}
+
+def run(count: int):
+    obj = makeTaskmasterJSON(count)
+    # a tenth of a percent of the tasks are due per update
+    step = dt.timedelta(minutes=max(count // 1000, 1))
+    results = {}
+    for engine in ENGINES:
+        changes = []
+        tm, loadTime, size = load(engine, obj)
+        tm.onChange = lambda op, userID, fields: changes.append((op, userID, fields))
+        
+        updateTimes = []
+        fired = []
+        for i in range(1, 11):
+            messages, updateTime = timed(asyncio.run, tm.update(START + step * i))
+            updateTimes.append(updateTime)
+            fired.append(normalized(messages))
+        idle, idleTime = timed(asyncio.run, tm.update(START))
+        # a burst where another 2% of tasks come due at once
+        burst, burstTime = timed(asyncio.run, tm.update(START + step * 30))
+        fired.append(normalized(burst))
+        
+        _, addTime = timed(tm.addTask, Task(START + step * 100, "added"), 1)
+        _, nextDueTime = timed(tm.nextDue)
+        dump, dumpTime = timed(tm.asjson)
+        
+        results[engine.__name__] = (fired, changes, dump)
+        print(
+            f"{engine.__name__:>20} | {count:>8} tasks | {size / count:6.1f} B/task | load {loadTime:7.3f}s | update {sum(updateTimes) / len(updateTimes) * 1000:8.3f}ms"
+            f" | burst {burstTime * 1000:8.3f}ms | idle {idleTime * 1000:6.3f}ms | add+nextDue {(addTime + nextDueTime) * 1000:6.3f}ms | asjson {dumpTime:6.3f}s"
+        )
+    
+    (firedA, changesA, dumpA), (firedB, changesB, dumpB) = results.values()
+    assert firedA == firedB, "engines fired different tasks"
+    assert dumpA == dumpB, "engines ended up with different tasks"
+    assert replay(obj, changesA) == replay(obj, changesB) == dumpA, "engines recorded changes that replay differently"
+
+def replay(obj, changes):
+    tm = Taskmaster.fromjson(obj)
+    for op, userID, fields in changes:
+        tm.applyEvent({"op": op, "user": userID, **fields})
+    return tm.asjson()
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for count in counts:
+        run(count)
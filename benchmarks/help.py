@@ -0,0 +1,70 @@
+""" Measures how long `help` takes to reply with its pages rendered from scratch and with them cached.
+
+Usage: python -m benchmarks.help [command count per cog]
+"""
+
+import asyncio
+import queue
+import sys
+import time
+
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+
+from Client import makeClient
+from Cluster import LocalContext, LocalMessage
+from Help import helpPages
+
+COGS = 6
+REQUESTS = 200
+
+def makeCog(index: int, count: int) -> commands.Cog:
+    """ Builds a cog with `count` documented commands, named so they don't clash with other cogs'. """
+
+    def makeCommand(name: str):
+        async def command(self, ctx: commands.Context):
+            pass
+        return commands.command(name=name, aliases=[f"{name}-alias"], help=f"Does the {name} thing.\n\n" + "More about it. " * 20)(command)
+
+    attrs = {f"cmd{i}": makeCommand(f"c{index}x{i}") for i in range(count)}
+    cls = commands.CogMeta(f"Cog{index}", (commands.Cog,), attrs, description=f"Commands of cog {index}.")
+    return cls()
+
+async def invoke(client: commands.Bot, outbox: queue.Queue, content: str):
+    message = LocalMessage({"message": 1, "content": content, "user": 1, "name": "bench", "dm": True}, outbox)
+    ctx = LocalContext(prefix="", view=StringView(content), bot=client, message=message)
+    ctx.outbox = outbox
+    ctx.invoked_with = ctx.view.get_word()
+    ctx.command = client.all_commands.get(ctx.invoked_with)
+    await client.invoke(ctx)
+    outbox.get_nowait()
+
+async def timeRequests(client: commands.Bot, outbox: queue.Queue, content: str, cold: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        if cold:
+            helpPages.fingerprint = None
+        await invoke(client, outbox, content)
+    return (time.perf_counter() - start) / REQUESTS
+
+async def run(count: int):
+    client = makeClient()
+    for i in range(COGS):
+        client.add_cog(makeCog(i, count))
+    outbox = queue.Queue()
+    
+    print(f"{COGS} cogs of {count} commands")
+    for content in ["help", "help Cog0", "help c0x0"]:
+        cold = await timeRequests(client, outbox, content, True)
+        cached = await timeRequests(client, outbox, content, False)
+        print(f"{content:>12} | cold {cold * 1e6:8.1f}us | cached {cached * 1e6:8.1f}us | {cold / cached:5.1f}x")
+    
+    # adding a cog has to show up in the next reply
+    client.add_cog(makeCog(COGS, count))
+    await invoke(client, outbox, "help")
+    assert helpPages.books[""][0] == COGS + 1, "help wasn't rebuilt after adding a cog"
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [5, 50]
+    for count in counts:
+        asyncio.run(run(count))
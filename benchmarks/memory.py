@@ -0,0 +1,64 @@
+""" Measures how much memory a Taskmaster loaded with `Taskmaster.fromjson` holds on to per task,
+next to the layout tasks had before they were slotted, for comparison.
+
+Usage: python -m benchmarks.memory [task count]
+"""
+
+import datetime as dt
+import gc
+import heapq
+import itertools
+import sys
+import tracemalloc
+from typing import Callable
+
+from benchmarks import makeTaskmasterJSON
+from Taskmaster import Taskmaster
+
+class DictTask:
+    """ A task as it used to be: attributes in a `__dict__`, with an aware datetime and its own copy of the message. """
+
+    def __init__(self, when: dt.datetime, message: str):
+        self.when = when
+        self.message = message
+        self.kill = False
+
+class DictRecur(DictTask):
+    def __init__(self, when: dt.datetime, message: str, interval: str):
+        super().__init__(when, message)
+        self.interval = interval
+
+def loadDictLayout(obj: dict[str, list[dict[str, str]]]) -> tuple[dict[int, list[DictTask]], list]:
+    """ Loads tasks into the old layout: per-user lists, plus a heap of (when, tiebreaker, user ID, task) entries. """
+
+    taskLists: dict[int, list[DictTask]] = {}
+    for userID, taskObjs in obj.items():
+        taskLists[int(userID)] = [
+            DictRecur(dt.datetime.fromisoformat(taskObj["when"]), taskObj["message"], taskObj["interval"])
+            if "interval" in taskObj else
+            DictTask(dt.datetime.fromisoformat(taskObj["when"]), taskObj["message"])
+            for taskObj in taskObjs
+        ]
+    counter = itertools.count()
+    dueHeap = [(task.when, next(counter), userID, task) for userID, tasks in taskLists.items() for task in tasks]
+    heapq.heapify(dueHeap)
+    return taskLists, dueHeap
+
+def measure(count: int, load: Callable[[dict], object]=Taskmaster.fromjson) -> float:
+    obj = makeTaskmasterJSON(count)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    loaded = load(obj)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tasks = loaded.userTasks.values() if isinstance(loaded, Taskmaster) else loaded[0].values()
+    assert sum(len(userTasks) for userTasks in tasks) == count
+    return (after - before) / count
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{count} tasks: {measure(count):.1f} bytes per task")
+    print(f"{count} tasks, dict layout: {measure(count, loadDictLayout):.1f} bytes per task")
@@ -0,0 +1,141 @@
+""" Measures how many `create` entries the Parser gets through per second, against the original `elif` chain.
+
+tests/test_parser.py checks that the two parse every entry the same way.
+
+Usage: python -m benchmarks.parser [entry count]
+"""
+
+import random
+import sys
+import time
+
+from benchmarks import MESSAGES
+import Taskmaster
+from Taskmaster import (
+    DAILY, HOURLY, MONTHLY, MONTHS, MONTHS_FULL, RECURRING, RELATIVE, SPECIFIC, WEEKDAYS, WEEKDAYS_FULL,
+    WEEKLY, YEARLY, Parser, TaskException, timePartPat
+)
+
+class ChainParser(Parser):
+    """ The Parser as it was before it was table-driven, to compare the new one with. """
+
+    def parse(self, args: list[str]):
+        entry = ' '.join(args)
+        ref, *args = args
+        ref = ref.lower()
+
+        if ref in ["each", "every", "per"]:
+            self.ref = RECURRING
+        elif ref == "yearly":
+            self.ref = RECURRING
+            self.interval = YEARLY
+        elif ref == "monthly":
+            self.ref = RECURRING
+            self.interval = MONTHLY
+        elif ref == "weekly":
+            self.ref = RECURRING
+            self.interval = WEEKLY
+        elif ref == "daily":
+            self.ref = RECURRING
+            self.interval = DAILY
+        elif ref == "hourly":
+            self.ref = RECURRING
+            self.interval = HOURLY
+        elif ref in ["on", "at"]:
+            self.ref = SPECIFIC
+        elif ref in ["in"]:
+            self.ref = RELATIVE
+        else:
+            raise TaskException(f"The entry `{entry}` had an invalid reference point `{self.ref}`. Must be one of `in`, `on`, or `at`.")
+
+        for i, arg in enumerate(args):
+            timePartMatch = timePartPat.search(arg)
+            lArg = arg.lower()
+            if lArg == "year":
+                self.interval = YEARLY
+            elif lArg == "month":
+                self.interval = MONTHLY
+            elif lArg == "week":
+                self.interval = WEEKLY
+            elif lArg == "day":
+                self.interval = DAILY
+            elif lArg == "hour":
+                self.interval = HOURLY
+            elif any([lArg.endswith(x) for x in ["st", "nd", "th"]]):
+                self.processTimePart(lArg[:-2], "d")
+            elif lArg in MONTHS:
+                self.processTimePart(MONTHS.index(lArg), "mo")
+            elif lArg in MONTHS_FULL:
+                self.processTimePart(MONTHS_FULL.index(lArg), "mo")
+            elif lArg in WEEKDAYS:
+                self.processTimePart(WEEKDAYS.index(lArg), "wkd")
+            elif lArg in WEEKDAYS_FULL:
+                self.processTimePart(WEEKDAYS_FULL.index(lArg), "wkd")
+            elif all([n in "1234567890" for n in lArg]) and len(lArg) == 4:
+                self.processTimePart(lArg, "yr")
+            elif timePartMatch:
+                self.processTimePart(timePartMatch.group(1), timePartMatch.group(2))
+            elif ":" in lArg:
+                self.processTimePart(lArg, None)
+            else:
+                break
+        if not self.time.hasData():
+            raise TaskException(f"The entry `{entry}` did not specify a time.")
+        self.message = " ".join(args[i:])
+
+def makeEntries(count: int, seed: int=0) -> list[str]:
+    """ Builds `create` entries shaped like the ones people make, a few of which don't parse.
+
+    Like real usage, most are one of a handful of habits repeated over and over.
+    """
+
+    rand = random.Random(seed)
+    times = ["9:00am", "8:30am", "12:00pm", "6pm", "10:15pm", "13:20", ":00", "7am"]
+    days = ["mon", "tuesday", "wed", "fri", "sunday"]
+    shapes = [
+        lambda: f"in {rand.choice([5, 10, 15, 30, 45])}m {rand.choice(MESSAGES)}",
+        lambda: f"in {rand.randint(1, 12)}h {rand.randint(0, 59)}m {rand.choice(MESSAGES)}",
+        lambda: f"in 2d 3h {rand.choice(MESSAGES)}",
+        lambda: f"at {rand.choice(times)} {rand.choice(MESSAGES)}",
+        lambda: f"on {rand.randint(1, 28)}th {rand.choice(MONTHS)} {rand.choice(times)} {rand.choice(MESSAGES)}",
+        lambda: f"on {rand.choice(MONTHS_FULL)} 3rd 2031 {rand.choice(MESSAGES)}",
+        lambda: f"daily {rand.choice(times)} {rand.choice(MESSAGES)}",
+        lambda: f"every week {rand.choice(days)} {rand.choice(times)} {rand.choice(MESSAGES)}",
+        lambda: f"weekly {rand.choice(days)} 8:00am {rand.choice(MESSAGES)}",
+        lambda: f"every day 9:00am {rand.choice(MESSAGES)}",
+        lambda: f"monthly 1st 10am {rand.choice(MESSAGES)}",
+        lambda: "yearly Dec 25th Christmas",
+        lambda: f"hourly :30 {rand.choice(MESSAGES)}",
+        # ones that don't parse
+        lambda: f"in a bit {rand.choice(MESSAGES)}",
+        lambda: f"tomorrow {rand.choice(MESSAGES)}",
+        lambda: f"at 9:am {rand.choice(MESSAGES)}",
+        lambda: f"in 5x {rand.choice(MESSAGES)}",
+        lambda: f"on august 3 {rand.choice(MESSAGES)}"
+    ]
+    weights = [8, 3, 1, 10, 2, 1, 10, 4, 3, 4, 2, 1, 2, 1, 1, 1, 1, 1]
+    return [rand.choices(shapes, weights)[0]() for _ in range(count)]
+
+def parseAll(parser: type[Parser], entries: list[str]) -> float:
+    start = time.perf_counter()
+    for entry in entries:
+        try:
+            parser(entry.split(" "))
+        except (TaskException, ValueError):
+            pass
+    return time.perf_counter() - start
+
+def run(count: int):
+    entries = makeEntries(count)
+    chain = parseAll(ChainParser, entries)
+    Taskmaster.tokenize.cache_clear()
+    Taskmaster.parseTime.cache_clear()
+    cold = parseAll(Parser, entries)
+    warm = parseAll(Parser, entries)
+    distinct = len(set(entries))
+    print(f"{count} entries ({distinct} distinct)")
+    for name, elapsed in [("elif chain", chain), ("table, cold cache", cold), ("table, warm cache", warm)]:
+        print(f"{name:>20} | {count / elapsed:10.0f} parses/s | {elapsed / count * 1e6:6.2f}us/parse")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if sys.argv[1:] else 100_000)
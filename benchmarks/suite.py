@@ -0,0 +1,223 @@
+""" Runs the scheduler, parser, serializer and paginator microbenchmarks, saving the results as a JSON baseline or checking them against one.
+
+Usage:
+    python -m benchmarks.suite [--quick] [--save BASELINE]
+    python -m benchmarks.suite [--quick] --compare BASELINE [--threshold FRACTION]
+
+Each case is sampled `REPEATS` times over the run, keeping the fastest sample, which is the least
+disturbed by whatever else the machine was doing. A sample times runs from fresh setups until they
+add up to `MIN_TIME`, so cases that finish in well under a millisecond aren't swamped by timer
+noise. Comparing exits with status 1 if any case got slower by more than the threshold, so it can
+gate a change. Times are scaled by a calibration case to allow for the machine being slower all
+round, but baselines are still only comparable with ones made on the same machine and with the
+same `--quick`.
+"""
+
+import argparse
+import asyncio
+import datetime as dt
+import gc
+import io
+import json
+import pickle
+import platform
+import sys
+import time
+from typing import Any, Callable, Iterator, NamedTuple
+
+from benchmarks import START, engines, makeTaskmasterJSON
+from benchmarks.parser import makeEntries
+from CogTask import CogTask
+from Taskmaster import Parser, TaskException, Taskmaster, UTC
+from utils import Paginator
+
+REPEATS = 5
+# seconds of timed runs in a sample
+MIN_TIME = 0.05
+THRESHOLD = 0.1
+# updates are awaited on one loop, since making a loop for each would cost more than a small update
+loop = asyncio.new_event_loop()
+
+class Case(NamedTuple):
+    name: str
+    # how many operations one run does, so results are per operation
+    ops: int
+    # makes a fresh state for a run; isn't timed
+    setup: Callable[[], Any]
+    run: Callable[[Any], Any]
+
+def updateCases(quick: bool) -> Iterator[Case]:
+    """ `Taskmaster.update` over N users with M tasks each, with different shares of the tasks due. """
+
+    shapes = [(100, 100)] if quick else [(1000, 10), (100, 1000), (10_000, 10)]
+    for users, perUser in shapes:
+        count = users * perUser
+        obj = makeTaskmasterJSON(count, users)
+        # short updates are run many times a sample, and unpickling makes a fresh state much quicker than loading
+        loaded = {engine: pickle.dumps(engine.fromjson(obj)) for engine in engines()}
+        for ratio in [0.001, 0.01, 0.1]:
+            # tasks are due a minute apart, so this many minutes in has this share of them due
+            when = START + dt.timedelta(minutes=count * ratio)
+            for engine in engines():
+                yield Case(
+                    f"update/{engine.__name__}/{users}x{perUser}/{ratio:g}",
+                    max(int(count * ratio), 1),
+                    lambda state=loaded[engine]: pickle.loads(state),
+                    lambda tm, when=when: loop.run_until_complete(tm.update(when))
+                )
+
+def parse(entries: list[str], now: dt.datetime):
+    for entry in entries:
+        try:
+            Parser(entry.split(" ")).getAsTask(now)
+        except (TaskException, ValueError):
+            pass
+
+def parsed(entries: list[str]) -> list[Parser]:
+    parsers = []
+    for entry in entries:
+        try:
+            parsers.append(Parser(entry.split(" ")))
+        except (TaskException, ValueError):
+            pass
+    return parsers
+
+def getDatetimes(parsers: list[Parser], now: dt.datetime):
+    for p in parsers:
+        try:
+            p.time.getDatetime(now, p.ref)
+        except ValueError:
+            pass
+
+def parserCases(quick: bool) -> Iterator[Case]:
+    count = 2000 if quick else 20_000
+    entries = makeEntries(count)
+    now = START.astimezone(UTC)
+    yield Case(f"parser/getAsTask/{count}", count, lambda: entries, lambda entries: parse(entries, now))
+    parsers = parsed(entries)
+    yield Case(f"tasktime/getDatetime/{len(parsers)}", len(parsers), lambda: parsers, lambda parsers: getDatetimes(parsers, now))
+
+def serializerCases(quick: bool) -> Iterator[Case]:
+    for count in [10_000] if quick else [10_000, 100_000, 1_000_000]:
+        obj = makeTaskmasterJSON(count)
+        tm = Taskmaster.fromjson(obj)
+        yield Case(f"serializer/fromjson/{count}", count, lambda obj=obj: obj, Taskmaster.fromjson)
+        yield Case(f"serializer/asjson/{count}", count, lambda tm=tm: tm, Taskmaster.asjson)
+        yield Case(f"serializer/json.dump/{count}", count, lambda obj=obj: (obj, io.StringIO()), lambda args: json.dump(*args))
+
+def paginatorCases(quick: bool) -> Iterator[Case]:
+    """ What `tasks` does for a user: lay their tasks out and render the first page. """
+
+    for count in [50] if quick else [50, 500, 5000]:
+        tasks = Taskmaster.fromjson(makeTaskmasterJSON(count, 1)).getSortedTasks(0)
+        listings = 100
+
+        def listTasks(tasks=tasks):
+            for _ in range(listings):
+                Paginator(CogTask.renderTaskPages(tasks, UTC), 0, False).getFocused()
+        yield Case(f"paginator/tasks/{count}", listings, lambda: None, lambda _, listTasks=listTasks: listTasks())
+
+def cases(quick: bool) -> Iterator[Case]:
+    yield from updateCases(quick)
+    yield from parserCases(quick)
+    yield from serializerCases(quick)
+    yield from paginatorCases(quick)
+
+def sample(case: Case) -> float:
+    """ Times runs of `case` from fresh setups until they add up to `MIN_TIME`, like `timeit`'s autorange, getting the mean in seconds per run. """
+
+    elapsed = 0.0
+    runs = 0
+    while elapsed < MIN_TIME:
+        state = case.setup()
+        # collections triggered by earlier runs' garbage would land on whichever run is unlucky
+        gc.disable()
+        start = time.perf_counter()
+        case.run(state)
+        elapsed += time.perf_counter() - start
+        gc.enable()
+        runs += 1
+    return elapsed / runs
+
+def measure(allCases: list[Case]) -> dict[str, float]:
+    """ Gets the fastest of `REPEATS` samples of each case, in seconds per operation.
+
+    Every case is sampled once a round, so each one's samples are spread over the whole run rather
+    than all landing in the same few seconds, when the machine may happen to be slow.
+    """
+
+    best = {case.name: float("inf") for case in allCases}
+    for _ in range(REPEATS):
+        for case in allCases:
+            best[case.name] = min(best[case.name], sample(case) / case.ops)
+    return best
+
+def spin(count: int):
+    total = 0
+    for i in range(count):
+        total += i
+    return total
+
+# plain interpreter work that no change to the bot can speed up or slow down, to tell how fast the machine was
+CALIBRATION = Case("calibration", 100_000, lambda: 100_000, spin)
+
+def runAll(quick: bool) -> dict[str, Any]:
+    results = measure([CALIBRATION, *cases(quick)])
+    calibration = results.pop(CALIBRATION.name)
+    for name, seconds in results.items():
+        print(f"{name:>48} | {seconds * 1e6:12.3f}us/op")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "quick": quick,
+            "time": dt.datetime.now(UTC).isoformat(),
+            "calibration": calibration
+        },
+        # seconds per operation by case
+        "results": results
+    }
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float) -> list[str]:
+    """ Prints how each case changed from the baseline, getting the ones that got slower by more than `threshold`. """
+
+    if baseline["meta"].get("quick") != current["meta"]["quick"]:
+        print("warning: the baseline was run with a different --quick, so few cases will match")
+    # a machine that's slower all round, from other load or a lower clock, shouldn't look like a regression
+    speed = 1
+    if "calibration" in baseline["meta"]:
+        speed = current["meta"]["calibration"] / baseline["meta"]["calibration"]
+        print(f"the machine ran {speed - 1:+.1%} slower than for the baseline; times are scaled to match")
+    regressions = []
+    for name, seconds in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:>48} | new")
+            continue
+        change = seconds / speed / before - 1
+        flag = ""
+        if change > threshold:
+            flag = " REGRESSION"
+            regressions.append(name)
+        print(f"{name:>48} | {before * 1e6:12.3f}us -> {seconds * 1e6:12.3f}us | {change:+7.1%}{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--quick", action="store_true", help="run smaller cases, for a quick check")
+    args.add_argument("--save", metavar="BASELINE", help="save the results as a baseline to this file")
+    args.add_argument("--compare", metavar="BASELINE", help="check the results against the baseline in this file")
+    args.add_argument("--threshold", type=float, default=THRESHOLD, help="how much slower a case can get before it's flagged, as a fraction (default %(default)s)")
+    args = args.parse_args()
+
+    current = runAll(args.quick)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case{'s' if len(regressions) != 1 else ''} got more than {args.threshold:.0%} slower")
+            sys.exit(1)
@@ -1,77 +1,22 @@
-
-from sources.general import BOT_PREFIX, MENTION_ME
-from typing import Union
-from utils import handlePaginationReaction
-from CogTask import CogTask, TaskException
-import datetime as dt
-import discord
-from discord.ext import commands
+from CogTask import CogTask
 import os
 
-from Help import Help
-from Taskmaster import Taskmaster
+from Client import makeClient
+from Cluster import Supervisor
+import Log
 
-def determinePrefix(bot: commands.Bot, message: discord.Message):
-    if isinstance(message.channel, discord.DMChannel):
-        if message.content.startswith("bel."):
-            return "bel."
-        return ""
+if __name__ == "__main__":
+    token = os.getenv("DISCORD_SECRET_BRONZOS")
+    workers = int(os.getenv("BRONZOS_WORKERS", "0"))
+    if workers:
+        # cluster mode: each worker process owns a partition of users and a range of gateway shards
+        Supervisor(workers, int(os.getenv("BRONZOS_SHARDS", workers))).run(token)
     else:
-        return "bel."
-
-client = commands.Bot(
-    command_prefix=determinePrefix,
-    case_insensitive=True,
-    help_command=Help(verify_checks=False)
-)
-cogTask = CogTask(client)
-client.add_cog(cogTask)
-
-@client.event
-async def on_ready():
-    print(f"Logged in as {client.user}.")
-
-@client.event
-async def on_message(message: discord.Message):
-    if message.author == client.user:
-        return
-    
-    await client.process_commands(message)
-
-@client.event
-async def on_reaction_add(reaction: discord.Reaction, user: Union[discord.User, discord.Member]):
-    if user.bot: return
-    await handlePaginationReaction(reaction, user)
-
-@client.event
-async def on_command_error(ctx: commands.Context, error: commands.CommandError):
-    toRaise = None
-    toSend = ""
-    if isinstance(error, commands.MissingRequiredArgument):
-        toSend += f"You missed a required argument `{error.param.name}`."
-    elif isinstance(error, commands.BadUnionArgument):
-        toSend += f"There was an error converting the argument `{error.param.name}`."
-    elif isinstance(error, commands.CommandNotFound):
-        toSend += f"This command does not exist!"
-    elif isinstance(error, commands.CommandInvokeError):
-        error: Exception = error.original
-        if isinstance(error, TaskException):
-            toSend += error.message
-        else:
-            toSend += f"An unexpected error occurred. Please let {MENTION_ME} know."
-            toRaise = error
-    else:
-        toSend += f"An unexpected error occurred. Please let {MENTION_ME} know."
-        toRaise = error
-    toSend += f"\nIf you need help with this command, please use `{BOT_PREFIX}help {ctx.command.name}`."
-    await ctx.send(toSend)
-    if toRaise:
-        raise toRaise
-
-@client.check
-async def globalCheck(ctx: commands.Context):
-    channelName = ctx.channel.name if not isinstance(ctx.channel, discord.DMChannel) else "DM"
-    print(f"[{str(dt.datetime.now().time())[:-7]}, #{channelName}] {ctx.message.author.name}: {ctx.message.content}")
-    return True
-
-client.run(os.getenv("DISCORD_SECRET_BRONZOS"))
\ No newline at end of file
+        Log.start()
+        metricsPort = os.getenv("BRONZOS_METRICS_PORT")
+        client = makeClient(metricsPort=int(metricsPort) if metricsPort else None)
+        cogTask = CogTask(client)
+        client.add_cog(cogTask)
+        client.run(token)
+        cogTask.close()
+        Log.stop()
@@ -1,4 +1,5 @@
 
 import sources.text.cogtask as TASK
 import sources.text.discordutils as UTIL
-import sources.text.help as HELP
\ No newline at end of file
+import sources.text.help as HELP
+import sources.text.log as LOG
\ No newline at end of file
@@ -45,17 +45,48 @@ CREATE = Cmd(
 TASKS = Cmd(
     "tasks", "list", "ls",
     f"""
-        Get a numbered list of your currently scheduled tasks.
+        Get a list of your currently scheduled tasks, soonest first, along with their IDs.
+        A task keeps its ID until it's removed or done.
     """
 )
 REMOVE = Cmd(
-    "remove", "delete", "rm", "del"
+    "remove", "delete", "rm", "del",
     f"""
-        Remove a task from your list of scheduled tasks.
+        Remove tasks from your list of scheduled tasks by the IDs shown by {TASKS.refF}.
+
+        Give one ID, several separated by spaces, or a range like `10-40`, which removes every task with an ID in it.
+        `all` removes every task, and `matching` followed by some text removes every task whose message contains it.
+        If any ID given isn't one of your tasks, nothing is removed.
     """,
     usage=[
         "1",
-        "2"
+        "3 7 9",
+        "10-40",
+        "all",
+        "matching laundry"
+    ]
+)
+IMPORT = Cmd(
+    "import", "upload",
+    f"""
+        Creates tasks in bulk from a file attached to the command, such as one exported from another calendar.
+
+        The file can be a CSV with one {CREATE.refF} entry per row, like `in 1h,change laundry`. A row's columns are joined with spaces. Rows starting with `#` are skipped.
+        It can also be an iCalendar (`.ics`) file, in which case each event becomes a task at its start time. Repeating events become repeated tasks if they repeat every year, month, week, day, or hour.
+
+        Rows that can't be made into tasks are listed afterwards. Everything else is still created.
+    """
+)
+EXPORT = Cmd(
+    "export", "download", "backup",
+    f"""
+        Sends you a file with all of your tasks in it, either as JSON Lines (`jsonl`, the default) or as an iCalendar file (`ics`) that other calendars can import.
+        The bot's owner can add `all` to export every user's tasks, which are also saved on the bot's machine.
+    """,
+    usage=[
+        "",
+        "ics",
+        "jsonl all"
     ]
 )
 TIMEZONE = Cmd(
@@ -76,6 +107,12 @@ NOW = Cmd(
         Gets the current time based on your time zone.
     """
 )
+STATS = Cmd(
+    "stats", "metrics",
+    f"""
+        Shows how the scheduler, storage, and commands are performing. Only the bot's owner can use this.
+    """
+)
 
 class COG:
     NAME = "Task Cog"
@@ -84,9 +121,104 @@ class COG:
 class PATH:
     TZPREFS = "./sources/tzprefs.json"
     TASKMASTER = "./sources/taskmaster.json"
+    JOURNAL = "./sources/taskmaster.journal"
+    DATABASE = "./sources/bronzos.db"
+    # full exports are saved in here
+    EXPORTS = "./sources/exports"
+    # each cluster worker keeps its storage in a numbered folder in here
+    SHARDS = "./sources/shards"
+
+class STORAGE:
+    JSON = "json"
+    SQLITE = "sqlite"
+    OBJECTS = "objects"
+    COLUMNAR = "columnar"
+    # the longest a recorded change waits before it's written
+    MAX_DELAY = 1.0
+    # how many times tiered storage moves its horizon forward per horizon's length
+    PROMOTIONS = 4
+    USAGE = "Usage: python Storage.py migrate"
+
+class DELIVERY:
+    # how many users can be sent reminders at once
+    CONCURRENCY = 10
+    # requests per second across every sender; Discord's global limit is 50
+    RATE = 40
+    # seconds before a single request is given up on
+    TIMEOUT = 10
+    # seconds ahead of a task's due time to look up its user's DM channel
+    PREFETCH = 5
+    # how many DM channels to keep, and for how many seconds
+    CACHE_SIZE = 10000
+    CACHE_TTL = 24 * 60 * 60
+
+class TIMEZONES:
+    # how many users' resolved time zones to keep
+    CACHE_SIZE = 10000
+
+class IMPORTING:
+    # the most tasks one file can create
+    MAX_TASKS = 10000
+    # attachments bigger than this many bytes aren't read
+    MAX_SIZE = 4 * 1024 * 1024
+    # how many failed rows the summary lists
+    MAX_FAILURES_SHOWN = 8
+    UNTITLED = "Untitled event"
+
+class EXPORTING:
+    JSONL = "jsonl"
+    ICS = "ics"
+    # the argument that exports every user's tasks
+    ALL = "all"
+    # Discord's limit on the size of an attachment, in bytes
+    MAX_UPLOAD = 8 * 1024 * 1024
+    UID_DOMAIN = "bronzos"
+    PRODID = "-//bronzOS//Tasks//EN"
+    FILENAME = lambda name, fmt: f"{name}-tasks.{fmt}"
+
+class LISTING:
+    # tasks per page of the `tasks` listing
+    PAGE_SIZE = 10
+    # Discord's limit on the length of a message
+    MAX_LENGTH = 2000
+    # how many users' rendered pages to keep
+    CACHE_SIZE = 256
+
+class CLUSTER:
+    # seconds the local gateway waits for a worker to answer a command
+    REPLY_TIMEOUT = 10
+    # local gateway users are named like this
+    LOCAL_NAME = lambda userID: f"user{userID}"
+
+class METRIC:
+    FIRE_LATENESS = "bronzos_fire_lateness_seconds"
+    FIRE_LATENESS_DESC = "How long after its due time each reminder was sent."
+    UPDATE_DURATION = "bronzos_update_seconds"
+    UPDATE_DURATION_DESC = "How long each scheduler update took to fire its due tasks."
+    TASKS_SCANNED = "bronzos_update_tasks_scanned"
+    TASKS_SCANNED_DESC = "How many tasks each scheduler update looked at, including removed ones still waiting to be cleared out."
+    TASKS_FIRED = "bronzos_update_tasks_fired"
+    TASKS_FIRED_DESC = "How many reminders each scheduler update fired."
+    WRITE_DURATION = "bronzos_persistence_write_seconds"
+    WRITE_DURATION_DESC = "How long each batch of changes took to write to storage."
+    DELIVERY_QUEUE = "bronzos_delivery_queue_depth"
+    DELIVERY_QUEUE_DESC = "Fired reminders that haven't been sent yet."
+    COMMAND_LATENCY = "bronzos_command_seconds"
+    COMMAND_LATENCY_DESC = "How long each command took to run, from passing its checks to finishing."
+    COMMANDS = "bronzos_commands_total"
+    COMMANDS_DESC = "Commands run."
+    COMMAND_FAILURES = "bronzos_command_failures_total"
+    COMMAND_FAILURES_DESC = "Commands that ended in an error."
+    LOOP_LAG = "bronzos_event_loop_lag_seconds"
+    LOOP_LAG_DESC = "How much later than asked for the event loop woke up."
+    # seconds between event loop lag measurements
+    LAG_INTERVAL = 0.5
+    # the endpoint only listens locally; cluster workers use the port after the previous worker's
+    HOST = "127.0.0.1"
 
 class INFO:
     ALERT = lambda msg: f"Task time reached:\n{msg}"
+    ALERT_MISSED = lambda msg, missed: f"Task time reached:\n{msg}\n(This task also came up {missed} more time{'s' if missed != 1 else ''} while I was offline.)"
     TASK_CREATED = lambda eventTime, message: f"Task successfully added. ```Date: {eventTime}\nMessage: {message}```"
     TZ_USE_THIS = "Use this command to set your time zone. " + _TZ_GUIDE
     TZ_USING = lambda zone: f"You are currently using `{zone}` time."
@@ -95,10 +227,36 @@ class INFO:
     TASKS_HEADER = f"Your currently-scheduled tasks:"
     TASKS = lambda num, spacing, eventText, message: f"\n\n{spacing}{num} | {eventText}\n{spacing}{' '*len(num)} | {message}"
     REMOVE_SUCCESS = lambda i, message: f"Successfully removed task `{i}` (`{message}`)"
+    REMOVE_MANY = lambda count: f"Successfully removed {count} tasks."
+    EXPORTED = lambda count: f"Exported {count} task{'s' if count != 1 else ''}."
+    EXPORT_SAVED = lambda count, path: f"Exported {count} task{'s' if count != 1 else ''} to `{path}`."
+    IMPORTED = lambda count: f"Successfully imported {count} task{'s' if count != 1 else ''}."
+    IMPORT_FAILURES = lambda count: f"\n{count} row{'s' if count != 1 else ''} couldn't be imported:"
+    IMPORT_FAILURE = lambda lineNo, entry, reason: f"\nLine {lineNo}: `{entry[:50]}`: {reason[:120]}"
+    IMPORT_MORE_FAILURES = lambda count: f"\n...and {count} more."
+    STATS_HEADER = "```"
+    STATS_HISTOGRAM = lambda name, p50, p99, count: f"\n{name}: p50 {p50:.4g}, p99 {p99:.4g} (n={count})"
+    STATS_EMPTY = lambda name: f"\n{name}: no samples"
+    STATS_VALUE = lambda name, value: f"\n{name}: {value:g}"
+    STATS_FOOTER = "\n```"
 
 class ERR:
     NO_ENTRY = f"No entry was given to this command. For help, use `{bel}help {CREATE.name}`."
+    INVALID_TIME = "That time doesn't exist, or is too far away to set a reminder for."
     NO_TZ = f"You haven't set a timezone preference with {TIMEZONE.refF} yet. For help, use `{bel}help {TIMEZONE.name}`."
     INVALID_TZ = lambda tz: f"{tz} is not a valid time zone. For help, use `{bel}help {TIMEZONE.name}`."
     NO_TASKS = f"You have no tasks. To create a task, use {CREATE.refF}. Make sure you've set your time zone preference with {TIMEZONE.refF} beforehand."
-    REMOVE_OOB = lambda i, leng: f"The index specified, `{i}`, is invalid. You only have `{leng}` task{'s' if leng > 1 else ''}."
\ No newline at end of file
+    NO_ATTACHMENT = f"No file was attached to this command. For help, use `{bel}help {IMPORT.name}`."
+    IMPORT_TOO_BIG = lambda limit: f"That file is too big. Files can be at most {limit // (1024 * 1024)} MB."
+    IMPORT_TOO_MANY = lambda limit: f"That file has more than {limit} tasks in it, so nothing was imported."
+    IMPORT_BAD_START = lambda value: f"The start time `{value}` isn't one I can read."
+    IMPORT_BAD_RULE = lambda rule: f"Only events that repeat every year, month, week, day, or hour can be imported, not `{rule}`."
+    IMPORT_PAST = "The event has already happened."
+    EXPORT_FORMAT = lambda fmt: f"`{fmt}` isn't a format tasks can be exported as. For help, use `{bel}help {EXPORT.name}`."
+    EXPORT_OWNER_ONLY = "Only the bot's owner can export everyone's tasks."
+    STATS_OWNER_ONLY = "Only the bot's owner can see the bot's stats."
+    EXPORT_TOO_BIG = "You have too many tasks to fit in one file."
+    NO_SELECTION = f"No tasks were given to remove. For help, use `{bel}help {REMOVE.name}`."
+    INVALID_SELECTION = lambda arg: f"`{arg}` isn't a task ID or a range of them. For help, use `{bel}help {REMOVE.name}`."
+    REMOVE_MISSING = lambda ids: f"You have no task{'s' if len(ids) > 1 else ''} with the ID{'s' if len(ids) > 1 else ''} {', '.join(f'`{i}`' for i in ids)}, so nothing was removed. Use {TASKS.refF} to see your tasks' IDs."
+    NO_MATCHES = lambda text: f"None of your tasks mention `{text}`."
\ No newline at end of file
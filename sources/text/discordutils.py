@@ -21,4 +21,23 @@ arrows = [emojiFirst, emojiPrior, emojiNext, emojiLast]
 indices = [emoji1, emoji2, emoji3, emoji4, emoji5, emoji6, emoji7, emoji8, emoji9, emoji10]
 switches = [emojiNumbers, emojiArrows]
 
+# how many paginators are kept at once, and for how many seconds after they were last used
+paginatorCapacity = 1000
+paginatorTTL = 30 * 60
+# seconds between sweeps for idle paginators
+paginatorSweepInterval = 60
+
+# how many rendered pages each paginator keeps
+renderedPageCacheSize = 3
+
+# how many reaction requests a paginator makes at once; Discord limits reactions per channel
+reactionConcurrency = 2
+
+metricPaginators = "bronzos_live_paginators"
+metricPaginatorsDesc = "How many paginated messages can currently be flipped through."
+metricPaginatorEvictions = "bronzos_paginator_evictions_total"
+metricPaginatorEvictionsDesc = "Paginators dropped to make room for newer ones."
+metricPaginatorExpiries = "bronzos_paginator_expiries_total"
+metricPaginatorExpiriesDesc = "Paginators dropped after going unused."
+
 paginationIndex = lambda index, length: f"Page {index} of {length}."
\ No newline at end of file
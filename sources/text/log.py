@@ -0,0 +1,43 @@
+# the logger everything goes through
+loggerName = "bronzos"
+# log files go in here, one per process, named after it
+directory = "./sources/logs"
+defaultName = "bronzos"
+workerName = lambda workerID: f"worker{workerID}"
+
+# a file is rotated once it's this many bytes, keeping this many old ones
+maxBytes = 10 * 1024 * 1024
+backups = 5
+
+# records waiting for the writer; past this, new ones are dropped rather than waiting
+queueSize = 10_000
+
+# events
+command = "command"
+fire = "fire"
+delivered = "delivered"
+userNotFound = "userNotFound"
+deliveryFailed = "deliveryFailed"
+loggedIn = "loggedIn"
+workerStarted = "workerStarted"
+handoff = "handoff"
+updateFailed = "updateFailed"
+promotionFailed = "promotionFailed"
+workerError = "workerError"
+
+# the share of each event's records that are kept; events that aren't here are always kept
+sampleRates = {
+    fire: 0.1
+}
+# records per second allowed for each event, and how many can come at once
+rate = 50
+burst = 200
+
+metricDropped = "bronzos_log_records_dropped_total"
+metricDroppedDesc = "Log records dropped because the writer had fallen behind."
+metricSampled = "bronzos_log_records_sampled_out_total"
+metricSampledDesc = "Log records left out by sampling."
+metricSuppressed = "bronzos_log_records_suppressed_total"
+metricSuppressedDesc = "Log records left out by rate limiting."
+
+consoleTime = "%H:%M:%S"
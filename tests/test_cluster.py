@@ -0,0 +1,96 @@
+import asyncio
+import datetime as dt
+import queue
+from types import SimpleNamespace
+
+from benchmarks import START, engines
+from Cluster import Worker, owner
+from CogTask import CogTask
+from Storage import SQLiteStorage
+from Taskmaster import Task, Taskmaster
+
+class FakeCog:
+    def __init__(self, userIDs: set[int]):
+        self.users = set(userIDs)
+        self.suspended: set[int] = set()
+
+    async def userIDs(self):
+        return set(self.users)
+
+    async def exportUser(self, userID: int):
+        self.suspended.add(userID)
+        return [], "UTC", 0
+
+    async def dropUser(self, userID: int):
+        self.users.discard(userID)
+        self.suspended.discard(userID)
+
+def makeWorker(userIDs: set[int]) -> Worker:
+    worker = Worker(0, [0, 1], queue.Queue(), queue.Queue(), [0], 1)
+    worker.cog = FakeCog(userIDs)
+    return worker
+
+def drain(q: queue.Queue) -> list[tuple]:
+    messages = []
+    while not q.empty():
+        messages.append(q.get_nowait())
+    return messages
+
+def test_handoffHoldsEventsUntilAcked():
+    old, new = [0, 1], [0, 1, 2]
+    # a user worker 0 owns, who moves to the new worker 2
+    userID = next(u for u in range(1000) if owner(u, old) == 0 and owner(u, new) == 2)
+    staying = next(u for u in range(1000) if owner(u, old) == 0 and owner(u, new) == 0)
+    worker = makeWorker({userID, staying})
+
+    asyncio.run(worker.rebalance(new))
+    assert worker.cog.suspended == {userID}
+    assert drain(worker.outbox) == [("import", 2, 0, {userID: ([], "UTC", 0)})]
+    # still routed here, and held rather than run or sent to a worker that doesn't have the user yet
+    assert not worker.handles(userID)
+    assert worker.handles(staying)
+    asyncio.run(worker.execute({"user": userID, "message": 1}))
+    assert drain(worker.outbox) == []
+
+    asyncio.run(worker.forget([userID]))
+    assert worker.cog.users == {staying}
+    assert drain(worker.outbox) == [("command", 2, {"user": userID, "message": 1}), ("handedOff", 0)]
+    # passed on to the new owner until everyone routes to it
+    asyncio.run(worker.execute({"user": userID, "message": 2}))
+    assert drain(worker.outbox) == [("command", 2, {"user": userID, "message": 2})]
+
+    worker.switchRouting(new)
+    assert worker.ownerOf(userID) == 2
+    assert worker.handles(staying)
+
+def test_nothingToHandOff():
+    worker = makeWorker(set())
+    asyncio.run(worker.rebalance([0, 1, 2]))
+    assert drain(worker.outbox) == [("handedOff", 0)]
+
+def makeCog(taskmaster: Taskmaster):
+    cog = SimpleNamespace(taskmaster=taskmaster, tiered=False, tzprefs={}, suspended=set(), invalidatePages=lambda userID: None, wakeIfChanged=lambda due: None)
+    cog.getTasks = lambda userID: CogTask.getTasks(cog, userID)
+    return cog
+
+def test_handoffKeepsLastID(tmp_path):
+    for engine in engines():
+        old = makeCog(engine())
+        for message in ["a", "b", "c"]:
+            old.taskmaster.addTask(Task(START + dt.timedelta(hours=1), message), 1)
+        # the newest task is gone, but its ID was given out
+        old.taskmaster.removeTask(1, 3)
+        tasks, tz, lastID = asyncio.run(CogTask.exportUser(old, 1))
+
+        storage = SQLiteStorage(str(tmp_path / f"{engine.__name__}.db"), engine)
+        new = makeCog(storage.load())
+        CogTask.importUser(new, 1, tasks, tz, lastID)
+        storage.close()
+
+        storage = SQLiteStorage(str(tmp_path / f"{engine.__name__}.db"), engine)
+        tm = storage.load()
+        assert sorted(task.id for task in tm.getTasks(1)) == [1, 2]
+        task = Task(START, "d")
+        tm.addTask(task, 1)
+        assert task.id == 4
+        storage.close()
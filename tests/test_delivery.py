@@ -0,0 +1,42 @@
+import asyncio
+import datetime as dt
+
+from Delivery import Delivery
+from Taskmaster import UTC
+
+class FakeChannel:
+    def __init__(self, failOn: set[str]):
+        self.sent: list[str] = []
+        self.failOn = failOn
+
+    async def send(self, content: str):
+        if any(text in content for text in self.failOn):
+            raise RuntimeError("unexpected")
+        self.sent.append(content)
+
+class FakeResolver:
+    def __init__(self, channels: dict[int, FakeChannel]):
+        self.channels = channels
+
+    async def resolve(self, userID: int):
+        if userID not in self.channels:
+            raise ValueError("no such user")
+        return self.channels[userID]
+
+def test_failuresDontStopTheBatch():
+    async def run():
+        delivery = Delivery(None)
+        channels = {1: FakeChannel({"bad"}), 2: FakeChannel(set())}
+        delivery.resolver = FakeResolver(channels)
+        now = dt.datetime.now(UTC)
+        await delivery.deliver({
+            1: [("first", now, 0), ("bad one", now, 0), ("last", now, 0)],
+            # can't be resolved at all
+            3: [("lost", now, 0), ("lost too", now, 0)],
+            2: [("other", now, 2)]
+        })
+        return delivery, channels
+    delivery, channels = asyncio.run(run())
+    assert [len(channel.sent) for channel in channels.values()] == [2, 1]
+    assert "first" in channels[1].sent[0] and "last" in channels[1].sent[1]
+    assert delivery.queued == 0
@@ -0,0 +1,175 @@
+import asyncio
+import datetime as dt
+from typing import Optional
+
+import pytest
+
+from benchmarks import START, engines
+from Taskmaster import Interval, Recur, Task, Taskmaster
+
+@pytest.fixture(params=engines(), ids=lambda engine: engine.__name__)
+def tm(request) -> Taskmaster:
+    return request.param()
+
+def at(hours: float) -> dt.datetime:
+    return START + dt.timedelta(hours=hours)
+
+def listed(tasks: Optional[list[Task]]) -> list[tuple[int, str]]:
+    return [(task.id, task.message) for task in tasks or []]
+
+def fill(tm: Taskmaster):
+    """ Gives user 1 tasks 1 to 4, made in a different order than they're due in. """
+
+    tm.addTask(Task(at(3), "c"), 1)
+    tm.addTask(Task(at(1), "a"), 1)
+    tm.addTask(Recur(at(2), "b", Interval.HOURLY), 1)
+    tm.addTask(Task(at(4), "d"), 1)
+
+def test_listing(tm):
+    fill(tm)
+    assert listed(tm.getTasks(1)) == [(1, "c"), (2, "a"), (3, "b"), (4, "d")]
+    assert listed(tm.getSortedTasks(1)) == [(2, "a"), (3, "b"), (1, "c"), (4, "d")]
+    assert tm.getTask(1, 3).message == "b"
+    assert tm.getTask(1, 9) is None
+    assert tm.getTasks(2) is None
+    assert tm.getSortedTasks(2) is None
+
+def test_removeTask(tm):
+    fill(tm)
+    assert tm.removeTask(1, 2).message == "a"
+    assert listed(tm.getSortedTasks(1)) == [(3, "b"), (1, "c"), (4, "d")]
+    assert tm.getTask(1, 2) is None
+    assert tm.nextDue() == at(2)
+    with pytest.raises(KeyError):
+        tm.removeTask(1, 2)
+
+def test_removeTasks(tm):
+    fill(tm)
+    removed = tm.removeTasks(1, [4, 2, 1])
+    assert listed(removed) == [(4, "d"), (2, "a"), (1, "c")]
+    assert listed(tm.getSortedTasks(1)) == [(3, "b")]
+    tm.removeTasks(1, [3])
+    assert tm.getTasks(1) is None
+    assert tm.nextDue() is None
+
+def test_removedBetweenAdds(tm):
+    fill(tm)
+    tm.removeTask(1, 1)
+    tm.addTask(Task(at(0.5), "e"), 1)
+    tm.removeTask(1, 5)
+    tm.addTask(Task(at(5), "f"), 1)
+    assert listed(tm.getSortedTasks(1)) == [(2, "a"), (3, "b"), (4, "d"), (6, "f")]
+    assert tm.nextDue() == at(1)
+
+def test_removeTasksDueTogether(tm):
+    for message in ["a", "b", "c", "d"]:
+        tm.addTask(Task(at(1), message), 1)
+    tm.addTask(Recur(at(0.5), "hourly", Interval.HOURLY), 1)
+    # the recurring task moves in among the others
+    asyncio.run(tm.update(at(0.75)))
+    tm.removeTask(1, 2)
+    tm.removeTasks(1, [4, 5])
+    assert sorted(listed(tm.getSortedTasks(1))) == [(1, "a"), (3, "c")]
+    tm.removeTasks(1, [3, 1])
+    assert tm.getSortedTasks(1) is None
+
+def test_nextDueAndDueWithin(tm):
+    assert tm.nextDue() is None
+    assert tm.dueWithin(at(10)) == set()
+    fill(tm)
+    tm.addTask(Task(at(0.5), "other"), 2)
+    assert tm.nextDue() == at(0.5)
+    assert tm.dueWithin(at(0.5)) == {2}
+    assert tm.dueWithin(at(1)) == {1, 2}
+    tm.removeTask(2, 1)
+    assert tm.nextDue() == at(1)
+    assert tm.dueWithin(at(1)) == {1}
+    # added after the last read, so it's only in the pending tasks of engines that batch adds
+    tm.addTask(Task(at(0.25), "pending"), 3)
+    assert tm.nextDue() == at(0.25)
+    assert tm.dueWithin(at(0.25)) == {3}
+
+def test_update(tm):
+    fill(tm)
+    assert asyncio.run(tm.update(at(0))) == {}
+    fired = asyncio.run(tm.update(at(2.5)))
+    assert fired == {1: [("a", at(1), 0), ("b", at(2), 0)]}
+    # the recurring task moves to its next hour and keeps its ID; the other is gone
+    assert listed(tm.getSortedTasks(1)) == [(1, "c"), (3, "b"), (4, "d")]
+    assert tm.getTask(1, 3).when == at(3)
+    assert tm.nextDue() == at(3)
+
+def test_updateCatchesUp(tm):
+    tm.addTask(Recur(at(1), "hourly", Interval.HOURLY), 1)
+    tm.addTask(Recur(at(1), "once", None), 1)
+    fired = asyncio.run(tm.update(at(5.5)))
+    # a long-missed task fires once for its latest occurrence, saying how many were missed before it
+    assert sorted(fired[1]) == [("hourly", at(5), 4), ("once", at(1), 0)]
+    assert listed(tm.getTasks(1)) == [(1, "hourly")]
+    assert tm.getTask(1, 1).when == at(6)
+
+def test_changesAreRecorded(tm):
+    events = []
+    tm.onChange = lambda op, userID, fields: events.append({"op": op, "user": userID, **fields})
+    fill(tm)
+    tm.removeTask(1, 4)
+    asyncio.run(tm.update(at(2)))
+    ops = [(event["op"], event.get("id")) for event in events]
+    assert ops[:5] == [("create", None)] * 4 + [("remove", 4)]
+    assert sorted(ops[5:]) == [("fire", 2), ("reschedule", 3)]
+    reschedule = next(event for event in events if event["op"] == "reschedule")
+    assert dt.datetime.fromisoformat(reschedule["when"]) == at(3)
+
+@pytest.mark.parametrize("replayer", engines(), ids=lambda engine: engine.__name__)
+def test_applyEvent(tm, replayer):
+    """ Replaying an engine's recorded changes on any engine gets the same tasks. """
+
+    events = []
+    tm.onChange = lambda op, userID, fields: events.append({"op": op, "user": userID, **fields})
+    fill(tm)
+    tm.addTask(Task(at(6), "other"), 2)
+    tm.removeTask(1, 1)
+    asyncio.run(tm.update(at(2)))
+    tm.addTask(Task(at(0), "late"), 1)
+
+    replayed = replayer()
+    for event in events:
+        replayed.applyEvent(event)
+    replayed.reindex()
+    for userID in [1, 2]:
+        assert listed(replayed.getSortedTasks(userID)) == listed(tm.getSortedTasks(userID))
+        assert [task.when for task in replayed.getSortedTasks(userID)] == [task.when for task in tm.getSortedTasks(userID)]
+    assert replayed.nextDue() == tm.nextDue()
+
+def test_rescheduleEvent(tm):
+    """ A replayed reschedule moves the task within the user's sorted list. """
+
+    fill(tm)
+    tm.applyEvent({"op": "reschedule", "user": 1, "id": 2, "when": at(3.5).isoformat()})
+    tm.reindex()
+    assert listed(tm.getSortedTasks(1)) == [(3, "b"), (1, "c"), (2, "a"), (4, "d")]
+    assert tm.nextDue() == at(2)
+
+def test_removeAfterRescheduleEvent(tm):
+    """ A task rescheduled and then removed in the same journal is found where it moved to. """
+
+    fill(tm)
+    tm.applyEvent({"op": "reschedule", "user": 1, "id": 3, "when": at(3.5).isoformat()})
+    tm.applyEvent({"op": "remove", "user": 1, "id": 3})
+    tm.reindex()
+    assert listed(tm.getSortedTasks(1)) == [(2, "a"), (1, "c"), (4, "d")]
+
+def test_roundTrip(tm):
+    fill(tm)
+    tm.removeTask(1, 2)
+    copy = type(tm).fromjson(tm.asjson())
+    assert listed(copy.getTasks(1)) == listed(tm.getTasks(1))
+    assert tm.snapshot()() == tm.asjson()
+    assert listed(task for _, task in tm.itemsSnapshot(1)) == [(1, "c"), (3, "b"), (4, "d")]
+
+def test_snapshotBatches(tm):
+    fill(tm)
+    tm.addTask(Task(at(5), "e"), 2)
+    tm.removeTask(1, 2)
+    rows = [(userID, task.id, task.message) for batch in tm.snapshotBatches() for userID, task in batch]
+    assert sorted(rows) == [(1, 1, "c"), (1, 3, "b"), (1, 4, "d"), (2, 1, "e")]
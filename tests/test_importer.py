@@ -0,0 +1,37 @@
+import datetime as dt
+
+from pytz import timezone
+
+from Importer import readTasks
+import sources.text as T
+
+S = T.TASK
+NEW_YORK = timezone("America/New_York")
+NOW = dt.datetime(2024, 1, 1, 12)
+
+def test_csvTimesOutOfRange():
+    raw = b"in 99999999999999999999d far\nin 5m fine\nin 9999yr later\non 31st feb nope\n"
+    result = readTasks(raw, "tasks.csv", NEW_YORK, NOW)
+    assert [task.message for task in result.tasks] == ["fine", "nope"]
+    assert result.failures == [
+        (1, "in 99999999999999999999d far", S.ERR.INVALID_TIME),
+        (3, "in 9999yr later", S.ERR.INVALID_TIME)
+    ]
+
+def test_icsTimesOutOfRange():
+    raw = b"\r\n".join([
+        b"BEGIN:VCALENDAR",
+        b"BEGIN:VEVENT",
+        b"SUMMARY:far",
+        # a few hours past the last datetime there is, once it's in UTC
+        b"DTSTART;TZID=America/New_York:99991231T230000",
+        b"END:VEVENT",
+        b"BEGIN:VEVENT",
+        b"SUMMARY:fine",
+        b"DTSTART:20990101T100000Z",
+        b"END:VEVENT",
+        b"END:VCALENDAR"
+    ])
+    result = readTasks(raw, "calendar.ics", NEW_YORK, NOW)
+    assert [task.message for task in result.tasks] == ["fine"]
+    assert result.failures == [(2, "far", S.ERR.INVALID_TIME)]
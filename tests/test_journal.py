@@ -0,0 +1,163 @@
+import asyncio
+import datetime as dt
+import json
+import os
+
+from benchmarks import START
+from Journal import Journal, digest
+from Taskmaster import Interval, Recur, Task, Taskmaster
+
+def openJournal(tmp_path, threshold: int=1000) -> Journal:
+    snapshot = tmp_path / "taskmaster.json"
+    if not snapshot.exists():
+        snapshot.write_text("{}")
+    return Journal(str(snapshot), str(tmp_path / "taskmaster.journal"), Taskmaster, threshold)
+
+def add(tm: Taskmaster, *messages: str):
+    for message in messages:
+        tm.addTask(Task(START + dt.timedelta(hours=len(message)), message), 1)
+
+def messages(tm: Taskmaster) -> list[str]:
+    return [task.message for task in tm.getTasks(1) or []]
+
+def header(path) -> str:
+    with open(path) as f:
+        return json.loads(f.readline())["base"]
+
+def snapshotDigest(tmp_path) -> str:
+    return digest((tmp_path / "taskmaster.json").read_bytes())
+
+def test_replaysAfterRestart(tmp_path):
+    journal = openJournal(tmp_path)
+    tm = journal.load()
+    add(tm, "a", "bb", "ccc")
+    tm.removeTask(1, 2)
+    journal.commit()
+    # no close, as if the process died after the write
+    assert messages(openJournal(tmp_path).load()) == ["a", "ccc"]
+
+def test_replaysRemovalAfterReschedule(tmp_path):
+    """ A recurring task that fires, moves past the user's other task and is then removed, all in one journal. """
+
+    journal = openJournal(tmp_path)
+    tm = journal.load()
+    tm.addTask(Recur(START + dt.timedelta(hours=1), "daily", Interval.DAILY), 1)
+    tm.addTask(Task(START + dt.timedelta(hours=5), "plain"), 1)
+    asyncio.run(tm.update(START + dt.timedelta(hours=2)))
+    tm.removeTask(1, 1)
+    journal.close()
+
+    tm = openJournal(tmp_path).load()
+    assert messages(tm) == ["plain"]
+    assert tm.nextDue() == START + dt.timedelta(hours=5)
+
+def test_replaysAfterCompaction(tmp_path):
+    journal = openJournal(tmp_path, threshold=3)
+    tm = journal.load()
+    add(tm, "a", "bb", "ccc")
+    journal.commit()
+    # compacted into the snapshot, with a journal started on top of it
+    assert not os.path.exists(journal.oldPath)
+    assert header(journal.journalPath) == snapshotDigest(tmp_path)
+    assert json.loads((tmp_path / "taskmaster.json").read_text())["1"][2]["message"] == "ccc"
+
+    add(tm, "dddd")
+    tm.removeTask(1, 1)
+    journal.commit()
+    assert messages(openJournal(tmp_path).load()) == ["bb", "ccc", "dddd"]
+
+def test_lastIDsSurviveCompaction(tmp_path):
+    journal = openJournal(tmp_path, threshold=3)
+    tm = journal.load()
+    add(tm, "a", "bb")
+    tm.removeTask(1, 2)
+    journal.commit()
+    # compacted, so the removed task's create is gone from the journal
+    assert header(journal.journalPath) == snapshotDigest(tmp_path)
+    journal.close()
+
+    tm = openJournal(tmp_path).load()
+    task = Task(START, "ccc")
+    tm.addTask(task, 1)
+    assert task.id == 3
+
+def crashMidCompaction(tmp_path, snapshotWritten: bool):
+    """ Does a compaction's steps up to where a crash would stop it, returning the tasks it was compacting. """
+
+    journal = openJournal(tmp_path)
+    tm = journal.load()
+    add(tm, "a", "bb")
+    journal.commit()
+    raw = json.dumps(tm.snapshot()()).encode()
+    journal.file.close()
+    os.replace(journal.journalPath, journal.oldPath)
+    journal.file = journal.start(digest(raw), tm.lastIDs)
+    add(tm, "ccc")
+    tm.removeTask(1, 1)
+    journal.commit()
+    if snapshotWritten:
+        (tmp_path / "taskmaster.json").write_bytes(raw)
+    return messages(tm)
+
+def test_chainFromOldJournal(tmp_path):
+    """ A crash before the new snapshot is written replays the old journal, then the new one on top of it. """
+
+    expected = crashMidCompaction(tmp_path, snapshotWritten=False)
+    journal = openJournal(tmp_path)
+    assert header(journal.oldPath) == snapshotDigest(tmp_path) != header(journal.journalPath)
+    assert messages(journal.load()) == expected == ["bb", "ccc"]
+    # the replayed chain is folded into a fresh snapshot
+    assert not os.path.exists(journal.oldPath)
+    assert header(journal.journalPath) == snapshotDigest(tmp_path)
+    assert messages(openJournal(tmp_path).load()) == expected
+
+def test_chainSkipsCompactedJournal(tmp_path):
+    """ A crash after the new snapshot is written skips the old journal, which the snapshot already has. """
+
+    expected = crashMidCompaction(tmp_path, snapshotWritten=True)
+    journal = openJournal(tmp_path)
+    assert header(journal.journalPath) == snapshotDigest(tmp_path) != header(journal.oldPath)
+    assert messages(journal.load()) == expected
+
+def test_truncatedTail(tmp_path):
+    journal = openJournal(tmp_path)
+    tm = journal.load()
+    add(tm, "a", "bb")
+    journal.commit()
+    with open(journal.journalPath, "a") as f:
+        f.write('{"op": "create", "user": 1, "ta')
+    assert messages(openJournal(tmp_path).load()) == ["a", "bb"]
+
+def test_mismatchedJournal(tmp_path):
+    """ A journal written on top of some other snapshot isn't replayed. """
+
+    journal = openJournal(tmp_path)
+    tm = journal.load()
+    add(tm, "a", "bb")
+    journal.commit()
+    journal.file.close()
+    (tmp_path / "taskmaster.json").write_text(json.dumps({"1": [Task(START, "other").asjson()]}))
+    assert messages(openJournal(tmp_path).load()) == ["other"]
+
+def test_emptyJournal(tmp_path):
+    journal = openJournal(tmp_path)
+    journal.load()
+    journal.file.close()
+    open(journal.journalPath, "w").close()
+    assert messages(openJournal(tmp_path).load()) == []
+
+def test_migrateLeavesSourceAlone(tmp_path):
+    from Storage import JSONStorage, SQLiteStorage
+    journal = openJournal(tmp_path)
+    add(journal.load(), "a", "bb")
+    journal.commit()
+    (tmp_path / "tzprefs.json").write_text(json.dumps({"1": "UTC"}))
+    before = {path.name: path.read_bytes() for path in tmp_path.iterdir()}
+    
+    source = JSONStorage(str(tmp_path / "taskmaster.json"), str(tmp_path / "taskmaster.journal"), str(tmp_path / "tzprefs.json"))
+    target = SQLiteStorage(str(tmp_path.parent / "tasks.db"))
+    target.migrate(source)
+    assert [task.message for _, task in target.iterTasks(1)] == ["a", "bb"]
+    assert target.loadTZPrefs() == {"1": "UTC"}
+    target.close()
+    assert {path.name: path.read_bytes() for path in tmp_path.iterdir()} == before
@@ -0,0 +1,30 @@
+import json
+import logging
+
+import Log
+import sources.text as T
+
+def readEvents(monkeypatch, tmp_path, log) -> list[dict]:
+    monkeypatch.setattr(T.LOG, "directory", str(tmp_path))
+    Log.start("test")
+    try:
+        log()
+    finally:
+        Log.stop()
+    with open(tmp_path / "test.log") as f:
+        return [json.loads(line) for line in f]
+
+def test_event(monkeypatch, tmp_path):
+    events = readEvents(monkeypatch, tmp_path, lambda: Log.event("something", logging.WARNING, user=1, detail="x"))
+    assert len(events) == 1
+    assert {key: events[0][key] for key in ["level", "event", "user", "detail"]} == {"level": "WARNING", "event": "something", "user": 1, "detail": "x"}
+
+def test_exception(monkeypatch, tmp_path):
+    def fail():
+        try:
+            raise ValueError("bad")
+        except ValueError as e:
+            Log.exception("failed", e, worker=2)
+    [record] = readEvents(monkeypatch, tmp_path, fail)
+    assert (record["level"], record["event"], record["error"], record["worker"]) == ("ERROR", "failed", "ValueError('bad')", 2)
+    assert "Traceback" in record["traceback"] and "in fail" in record["traceback"]
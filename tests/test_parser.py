@@ -0,0 +1,77 @@
+import datetime as dt
+
+import pytest
+
+from benchmarks.parser import ChainParser, makeEntries
+import Taskmaster
+from Taskmaster import KEYWORDS, REFS, Parser, UTC
+
+NOW = dt.datetime(2024, 1, 31, 15, 45, 30, tzinfo=UTC)
+
+def outcome(parser: type[Parser], entry: str):
+    """ Everything a parser makes of an entry, down to the task it would create, or the error it raises. """
+
+    try:
+        p = parser(entry.split(" "))
+        task = p.getAsTask(NOW)
+    except Exception as e:
+        return type(e), str(e)
+    return p.ref, p.interval, vars(p.time), p.message, task.asjson()
+
+def assertSame(entry: str):
+    assert outcome(Parser, entry) == outcome(ChainParser, entry)
+
+@pytest.fixture(autouse=True)
+def coldCaches():
+    Taskmaster.tokenize.cache_clear()
+    Taskmaster.parseTime.cache_clear()
+
+def test_corpus():
+    entries = makeEntries(5000)
+    # twice, so the second pass comes from the caches
+    for _ in range(2):
+        for entry in entries:
+            assertSame(entry)
+
+@pytest.mark.parametrize("ref", sorted(REFS))
+def test_everyReference(ref):
+    for entry in [f"{ref} 9:00am stand up", f"{ref.upper()} 3h 20m stand up", f"{ref} week fri 5pm stand up", f"{ref} 12th dec 2030 stand up"]:
+        assertSame(entry)
+
+@pytest.mark.parametrize("keyword", sorted(KEYWORDS) + ["august", "1st", "22nd", "3rd", "2031"])
+def test_everyKeyword(keyword):
+    for entry in [f"on {keyword} 10am x", f"every {keyword.capitalize()} 8:15pm x", f"in 2h {keyword} x", f"at 9am x {keyword}"]:
+        assertSame(entry)
+
+@pytest.mark.parametrize("entry", [
+    # references that aren't one
+    "tomorrow 9am x",
+    "whenever",
+    # no time
+    "in",
+    "on x",
+    "daily",
+    "in a bit",
+    # time parts that don't parse
+    "at 9: x",
+    "at 9:am x",
+    "in 5x x",
+    "in 5 x",
+    "at :x x",
+    "in 10mm x",
+    "on 3rdd x",
+    # all time parts, which keeps the last one as the message
+    "in 5m",
+    "daily 9am",
+    # too big to be a time
+    "in 99999999999999999999d x",
+    "in 9999yr x",
+    "at 99:99 x",
+    "on 31st feb x",
+    # extra spaces and case
+    "in  5m x",
+    "IN 5M X",
+    "At 9:00PM x"
+])
+def test_edgeCases(entry):
+    assertSame(entry)
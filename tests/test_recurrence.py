@@ -0,0 +1,94 @@
+import datetime as dt
+import random
+
+import numpy as np
+import pytest
+from pytz import timezone
+
+from ColumnarTaskmaster import ColumnarTaskmaster
+from Taskmaster import STEPS, Interval, UTC, latestOccurrence, nextOccurrence, shiftedBy
+
+NEW_YORK = timezone("America/New_York")
+
+def stepByStep(when: dt.datetime, interval: Interval, now: dt.datetime) -> tuple[dt.datetime, int, dt.datetime]:
+    """ Walks a recurring task forward one occurrence at a time, the way it used to be rescheduled.
+
+    Gets the next occurrence after `now`, how many were missed, and the latest one that wasn't after `now`.
+    """
+
+    occurrences = [when]
+    i = 0
+    while occurrences[-1] <= now:
+        i += 1
+        if interval in STEPS:
+            occurrences.append(when + dt.timedelta(seconds=i * STEPS[interval]))
+        else:
+            # months and years without the day are skipped
+            shifted = shiftedBy(when, i * (12 if interval == Interval.YEARLY else 1))
+            if shifted:
+                occurrences.append(shifted)
+    return occurrences[-1], len(occurrences) - 2, occurrences[-2]
+
+def check(when: dt.datetime, interval: Interval, now: dt.datetime):
+    expected, missed, latest = stepByStep(when, interval, now)
+    assert nextOccurrence(when, interval, now) == (expected, missed)
+    assert latestOccurrence(when, interval, now) == latest
+
+def randomTime(rng: random.Random, start: dt.datetime, days: int) -> dt.datetime:
+    return start + dt.timedelta(seconds=rng.randrange(days * 24 * 60 * 60))
+
+@pytest.mark.parametrize("interval", list(Interval), ids=lambda interval: interval.name)
+def test_matchesStepByStep(interval):
+    rng = random.Random(interval.value)
+    start = dt.datetime(2019, 1, 1, tzinfo=UTC)
+    # hourly tasks are kept to shorter outages so the reference doesn't take long
+    span = 60 if interval == Interval.HOURLY else 4 * 365
+    for _ in range(300):
+        when = randomTime(rng, start, 365)
+        check(when, interval, when + dt.timedelta(seconds=rng.randrange(span * 24 * 60 * 60)))
+
+@pytest.mark.parametrize("when, interval, now, expected, missed", [
+    # due exactly now fires now, with nothing missed
+    (dt.datetime(2024, 1, 1, 9, tzinfo=UTC), Interval.DAILY, dt.datetime(2024, 1, 1, 9, tzinfo=UTC), dt.datetime(2024, 1, 2, 9, tzinfo=UTC), 0),
+    (dt.datetime(2024, 12, 15, tzinfo=UTC), Interval.MONTHLY, dt.datetime(2024, 12, 20, tzinfo=UTC), dt.datetime(2025, 1, 15, tzinfo=UTC), 0),
+    (dt.datetime(2023, 11, 30, tzinfo=UTC), Interval.MONTHLY, dt.datetime(2024, 2, 1, tzinfo=UTC), dt.datetime(2024, 3, 30, tzinfo=UTC), 2),
+    (dt.datetime(2024, 1, 31, tzinfo=UTC), Interval.MONTHLY, dt.datetime(2024, 2, 1, tzinfo=UTC), dt.datetime(2024, 3, 31, tzinfo=UTC), 0),
+    (dt.datetime(2024, 12, 31, 23, tzinfo=UTC), Interval.YEARLY, dt.datetime(2025, 1, 1, tzinfo=UTC), dt.datetime(2025, 12, 31, 23, tzinfo=UTC), 0),
+    (dt.datetime(2020, 2, 29, tzinfo=UTC), Interval.YEARLY, dt.datetime(2021, 1, 1, tzinfo=UTC), dt.datetime(2024, 2, 29, tzinfo=UTC), 0),
+    (dt.datetime(2016, 2, 29, tzinfo=UTC), Interval.YEARLY, dt.datetime(2024, 3, 1, tzinfo=UTC), dt.datetime(2028, 2, 29, tzinfo=UTC), 2)
+])
+def test_rollover(when, interval, now, expected, missed):
+    assert nextOccurrence(when, interval, now) == (expected, missed)
+    check(when, interval, now)
+
+def test_acrossDST():
+    # both of New York's changes in 2024 are crossed; occurrences are a fixed number of seconds apart
+    when = NEW_YORK.localize(dt.datetime(2024, 3, 9, 9))
+    for interval in [Interval.HOURLY, Interval.DAILY, Interval.WEEKLY]:
+        for now in [NEW_YORK.localize(dt.datetime(2024, 3, 10, 12)), NEW_YORK.localize(dt.datetime(2024, 11, 4, 12))]:
+            check(when, interval, now)
+    after, missed = nextOccurrence(when, Interval.DAILY, NEW_YORK.localize(dt.datetime(2024, 3, 10, 12)))
+    assert (after - when).total_seconds() == 2 * STEPS[Interval.DAILY]
+    assert missed == 1
+    for interval in [Interval.MONTHLY, Interval.YEARLY]:
+        check(when, interval, NEW_YORK.localize(dt.datetime(2026, 7, 1)))
+
+def test_notDueYet():
+    when = dt.datetime(2024, 1, 1, tzinfo=UTC)
+    for interval in Interval:
+        assert nextOccurrence(when, interval, when - dt.timedelta(seconds=1)) == (when, 0)
+        assert latestOccurrence(when, interval, when - dt.timedelta(seconds=1)) == when
+
+def test_columnarMatches():
+    rng = random.Random(0)
+    start = dt.datetime(2019, 1, 1, tzinfo=UTC)
+    now = dt.datetime(2024, 6, 15, 12, tzinfo=UTC)
+    kinds = np.array([rng.choice(list(Interval)).value for _ in range(500)], np.int8)
+    whens = np.array([int(randomTime(rng, start, 5 * 365).timestamp()) for _ in range(500)], np.int64)
+    after, missed = ColumnarTaskmaster.reschedule(whens, kinds, now)
+    latest = ColumnarTaskmaster.latest(whens, kinds, missed, now)
+    for i in range(len(whens)):
+        when = dt.datetime.fromtimestamp(int(whens[i]), UTC)
+        expected, expectedMissed = nextOccurrence(when, Interval(int(kinds[i])), now)
+        assert (int(after[i]), int(missed[i])) == (int(expected.timestamp()), expectedMissed)
+        assert int(latest[i]) == int(latestOccurrence(when, Interval(int(kinds[i])), now).timestamp())
@@ -0,0 +1,244 @@
+import asyncio
+import datetime as dt
+import json
+from typing import Optional
+
+import pytest
+
+from benchmarks import START, engines
+from CogTask import CogTask
+from Journal import digest
+from Storage import JSONStorage, SQLiteStorage
+from Taskmaster import Interval, Recur, Task, TaskException, Taskmaster, UTC
+import sources.text as T
+
+S = T.TASK
+HORIZON = dt.timedelta(hours=1)
+
+def tieredStorage(tmp_path) -> SQLiteStorage:
+    return SQLiteStorage(str(tmp_path / "tasks.db"), Taskmaster, HORIZON)
+
+def diskIDs(storage: SQLiteStorage, userID: int) -> list[int]:
+    storage.commit()
+    return [task.id for task in storage.userTasks(userID)]
+
+def test_tieredNearTaskKeepsOneID(tmp_path):
+    storage = tieredStorage(tmp_path)
+    tm = storage.load()
+    now = dt.datetime.now(UTC)
+    # a far task first, so the user's last ID is already taken on disk
+    tm.addTask(Task(now + 2 * HORIZON, "far"), 1)
+    near = Task(now + dt.timedelta(minutes=5), "near")
+    tm.addTask(near, 1)
+    assert near.id == 2
+    assert tm.getTask(1, 2) is near
+    assert diskIDs(storage, 1) == [2, 1]
+    storage.close()
+
+def test_tieredFiredTaskStaysGoneAfterRestart(tmp_path):
+    storage = tieredStorage(tmp_path)
+    tm = storage.load()
+    now = dt.datetime.now(UTC)
+    tm.addTask(Task(now + dt.timedelta(seconds=30), "once"), 1)
+    fired = asyncio.run(tm.update(now + dt.timedelta(minutes=1)))
+    assert [message for message, _, _ in fired[1]] == ["once"]
+    storage.close()
+
+    storage = tieredStorage(tmp_path)
+    tm = storage.load()
+    assert diskIDs(storage, 1) == []
+    assert asyncio.run(tm.update(now + dt.timedelta(minutes=1))) == {}
+    storage.close()
+
+def test_tieredRemovedTaskStaysGoneAfterRestart(tmp_path):
+    storage = tieredStorage(tmp_path)
+    tm = storage.load()
+    now = dt.datetime.now(UTC)
+    tm.addTask(Task(now + 2 * HORIZON, "far"), 1)
+    tm.addTask(Task(now + dt.timedelta(minutes=5), "near"), 1)
+    # the ID shown by `tasks`, which reads from disk
+    storage.commit()
+    listedID = [task.id for task in storage.userTasks(1) if task.message == "near"][0]
+    tm.removeTask(1, listedID)
+    assert tm.getTask(1, listedID) is None
+    storage.close()
+
+    storage = tieredStorage(tmp_path)
+    tm = storage.load()
+    assert [task.message for task in storage.userTasks(1)] == ["far"]
+    assert asyncio.run(tm.update(now + dt.timedelta(minutes=10))) == {}
+    storage.close()
+
+def test_tieredRescheduleUpdatesItsOwnRow(tmp_path):
+    storage = tieredStorage(tmp_path)
+    tm = storage.load()
+    now = dt.datetime.now(UTC).replace(microsecond=0)
+    tm.addTask(Task(now + 2 * HORIZON, "far"), 1)
+    tm.addTask(Recur(now + dt.timedelta(seconds=30), "hourly", Interval.HOURLY), 1)
+    asyncio.run(tm.update(now + dt.timedelta(minutes=1)))
+    storage.commit()
+    dues = {task.message: task.when for task in storage.userTasks(1)}
+    assert dues == {"hourly": now + dt.timedelta(hours=1, seconds=30), "far": now + 2 * HORIZON}
+    storage.close()
+
+# selecting tasks for `remove`
+
+def makeTasks(messages: list[str]) -> list[Task]:
+    tasks = []
+    for i, message in enumerate(messages, 1):
+        task = Task(START + dt.timedelta(hours=i), message)
+        task.id = i
+        tasks.append(task)
+    return tasks
+
+def selectedIDs(tasks: list[Task], args: str) -> list[int]:
+    return [task.id for task in CogTask.selectTasks(tasks, args)]
+
+def test_selectByID():
+    tasks = makeTasks(["a", "b", "c"])
+    assert selectedIDs(tasks, "2") == [2]
+    assert selectedIDs(tasks, "3 1") == [3, 1]
+    # naming a task twice only removes it once
+    assert selectedIDs(tasks, "1 1") == [1]
+
+def test_selectRange():
+    tasks = [task for task in makeTasks(["a", "b", "c", "d", "e"]) if task.id != 3]
+    # ranges cover whichever IDs in them are left
+    assert selectedIDs(tasks, "2-4") == [2, 4]
+    assert selectedIDs(tasks, "1 4-9") == [1, 4, 5]
+
+def test_selectAllAndMatching():
+    tasks = makeTasks(["Take meds", "water plants", "take out trash"])
+    assert selectedIDs(tasks, "all") == [1, 2, 3]
+    assert selectedIDs(tasks, "ALL") == [1, 2, 3]
+    assert selectedIDs(tasks, "matching TAKE") == [1, 3]
+    assert selectedIDs(tasks, "matching out trash") == [3]
+
+@pytest.mark.parametrize("args, error", [
+    ("", S.ERR.NO_SELECTION),
+    ("   ", S.ERR.NO_SELECTION),
+    ("x", S.ERR.INVALID_SELECTION("x")),
+    ("1-x", S.ERR.INVALID_SELECTION("1-x")),
+    ("-2", S.ERR.INVALID_SELECTION("-2")),
+    ("2 9", S.ERR.REMOVE_MISSING([9])),
+    ("7-9", S.ERR.REMOVE_MISSING(["7-9"])),
+    ("matching nothing", S.ERR.NO_MATCHES("nothing"))
+])
+def test_selectErrors(args, error):
+    with pytest.raises(TaskException) as e:
+        CogTask.selectTasks(makeTasks(["a", "b", "c"]), args)
+    assert e.value.message == error
+
+# IDs across engines and restarts
+
+def ids(tasks: Optional[list[Task]]) -> list[tuple[int, str]]:
+    return sorted((task.id, task.message) for task in tasks or [])
+
+@pytest.mark.parametrize("engine", engines())
+def test_idsStayAfterRemovals(engine):
+    tm = engine()
+    for message in ["a", "b", "c"]:
+        tm.addTask(Task(START + dt.timedelta(hours=1), message), 1)
+    tm.removeTask(1, 2)
+    assert ids(tm.getTasks(1)) == [(1, "a"), (3, "c")]
+    tm.addTask(Task(START, "d"), 1)
+    # removed IDs aren't given out again
+    assert ids(tm.getTasks(1)) == [(1, "a"), (3, "c"), (4, "d")]
+    # other users count on their own
+    tm.addTask(Task(START, "e"), 2)
+    assert ids(tm.getTasks(2)) == [(1, "e")]
+
+def jsonStorage(tmp_path, engine: type[Taskmaster]) -> JSONStorage:
+    snapshot = tmp_path / "taskmaster.json"
+    if not snapshot.exists():
+        snapshot.write_text("{}")
+    return JSONStorage(str(snapshot), str(tmp_path / "taskmaster.journal"), str(tmp_path / "tzprefs.json"), engine)
+
+def sqliteStorage(tmp_path, engine: type[Taskmaster]) -> SQLiteStorage:
+    return SQLiteStorage(str(tmp_path / "tasks.db"), engine)
+
+@pytest.mark.parametrize("engine", engines())
+@pytest.mark.parametrize("openStorage", [jsonStorage, sqliteStorage])
+def test_idsSurviveRestart(tmp_path, openStorage, engine):
+    storage = openStorage(tmp_path, engine)
+    tm = storage.load()
+    tm.addTasks([Task(START + dt.timedelta(hours=i), message) for i, message in enumerate(["a", "b", "c", "d"])], 1)
+    tm.removeTasks(1, [2, 3])
+    storage.close()
+
+    storage = openStorage(tmp_path, engine)
+    tm = storage.load()
+    assert ids(tm.getTasks(1)) == [(1, "a"), (4, "d")]
+    tm.addTask(Task(START, "e"), 1)
+    assert ids(tm.getTasks(1)) == [(1, "a"), (4, "d"), (5, "e")]
+    storage.close()
+
+@pytest.mark.parametrize("engine", engines())
+@pytest.mark.parametrize("openStorage", [jsonStorage, sqliteStorage, lambda tmp_path, engine: tieredStorage(tmp_path)])
+def test_removedLastIDNotReused(tmp_path, openStorage, engine):
+    storage = openStorage(tmp_path, engine)
+    tm = storage.load()
+    tm.addTasks([Task(START + dt.timedelta(hours=i), message) for i, message in enumerate(["a", "b", "c"])], 1)
+    tm.removeTask(1, 3)
+    storage.close()
+    # loading folds the journal into the snapshot, so the next load has no events to replay
+    storage = openStorage(tmp_path, engine)
+    storage.load()
+    storage.close()
+    if isinstance(storage, JSONStorage):
+        # the counters are kept out of the snapshot, whose keys are all user IDs
+        assert list(json.loads((tmp_path / "taskmaster.json").read_text())) == ["1"]
+
+    storage = openStorage(tmp_path, engine)
+    tm = storage.load()
+    task = Task(START, "d")
+    tm.addTask(task, 1)
+    assert task.id == 4
+    storage.close()
+
+def test_oldIndexEventsReplay(tmp_path):
+    """ Journals from before task IDs refer to tasks by their index in the user's list. """
+
+    (tmp_path / "taskmaster.json").write_text(json.dumps({"1": [
+        {"when": START.isoformat(), "message": "a"},
+        {"when": (START + dt.timedelta(hours=1)).isoformat(), "message": "b"},
+        {"when": (START + dt.timedelta(hours=2)).isoformat(), "message": "c", "interval": "daily"}
+    ]}))
+    raw = (tmp_path / "taskmaster.json").read_bytes()
+    (tmp_path / "taskmaster.journal").write_text("\n".join(json.dumps(line) for line in [
+        {"base": digest(raw)},
+        {"op": "remove", "user": 1, "index": 0},
+        {"op": "reschedule", "user": 1, "index": 1, "when": (START + dt.timedelta(days=1, hours=2)).isoformat()}
+    ]) + "\n")
+    for engine in engines():
+        tm = jsonStorage(tmp_path, engine).load()
+        assert ids(tm.getTasks(1)) == [(2, "b"), (3, "c")]
+        assert tm.getTask(1, 3).when == START + dt.timedelta(days=1, hours=2)
+
+def operate(tm: Taskmaster):
+    """ The same adds, removals and fires, for checking that every engine hands out the same IDs. """
+
+    tm.addTask(Task(START + dt.timedelta(minutes=30), "soon"), 1)
+    tm.addTasks([Task(START + dt.timedelta(days=i), f"day {i}") for i in range(1, 4)], 1)
+    tm.addTask(Recur(START + dt.timedelta(minutes=10), "hourly", Interval.HOURLY), 2)
+    tm.addTask(Task(START + dt.timedelta(days=30), "far"), 2)
+    tm.removeTask(1, 3)
+    asyncio.run(tm.update(START + dt.timedelta(hours=1)))
+    tm.addTask(Task(START + dt.timedelta(days=40), "later"), 1)
+    tm.addTask(Task(START + dt.timedelta(days=40), "later"), 2)
+
+def test_idParityBetweenEngines(tmp_path):
+    expected = {1: [(2, "day 1"), (4, "day 3"), (5, "later")], 2: [(1, "hourly"), (2, "far"), (3, "later")]}
+    for engine in engines():
+        tm = engine()
+        operate(tm)
+        assert {userID: ids(tm.getTasks(userID)) for userID in [1, 2]} == expected
+
+    # the tiered engine keeps far tasks on disk, so its IDs are checked there
+    storage = SQLiteStorage(str(tmp_path / "tiered.db"), Taskmaster, dt.timedelta(days=2))
+    tm = storage.load()
+    tm.startPromotion(START + dt.timedelta(days=2))
+    operate(tm)
+    storage.commit()
+    assert {userID: ids(storage.userTasks(userID)) for userID in [1, 2]} == expected
+    storage.close()
@@ -0,0 +1,32 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from CogTask import CogTask
+import sources.text as T
+
+def makeCog(tzprefs: dict[str, str]):
+    cog = SimpleNamespace(tzprefs=tzprefs, tzCache=OrderedDict(), storage=SimpleNamespace(setTZPref=lambda userID, tz: None), invalidatePages=lambda userID: None)
+    cog.getTZForUser = lambda userID: CogTask.getTZForUser(cog, userID)
+    cog.setTZPref = lambda userID, tz: CogTask.setTZPref(cog, userID, tz)
+    return cog
+
+def test_boundedLeastRecentlyUsed(monkeypatch):
+    monkeypatch.setattr(T.TASK.TIMEZONES, "CACHE_SIZE", 2)
+    cog = makeCog({"1": "UTC", "2": "Europe/Paris", "3": "Asia/Tokyo"})
+    cog.getTZForUser(1)
+    cog.getTZForUser(2)
+    cog.getTZForUser(1)
+    assert cog.getTZForUser(3).zone == "Asia/Tokyo"
+    # 2 was used least recently
+    assert list(cog.tzCache) == [1, 3]
+
+def test_invalidAndMissing():
+    cog = makeCog({"1": "Not/AZone"})
+    assert cog.getTZForUser(1) is None
+    assert cog.getTZForUser(2) is None
+
+def test_setTZPrefReplacesCachedZone():
+    cog = makeCog({"1": "UTC"})
+    assert cog.getTZForUser(1).zone == "UTC"
+    cog.setTZPref(1, "America/New_York")
+    assert cog.getTZForUser(1).zone == "America/New_York"
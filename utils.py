@@ -1,8 +1,13 @@
 
+import asyncio
+from collections import OrderedDict
 import discord
 from discord.ext import commands
-from typing import Optional, Union
+import itertools
+import time
+from typing import Callable, Iterable, Optional, Sequence, Union
 
+import Metrics
 from sources.general import EMPTY, BRONZOS_GRAPHIC_URL, stripLines
 import sources.text as T
 
@@ -46,28 +51,62 @@ class Page:
             "embed": self.embed
         }
 
+PageContents = dict[str, Union[str, discord.Embed]]
+
+class LazyPages:
+    """ A known number of pages, each made by `render` from its index only when it's asked for. """
+    
+    def __init__(self, render: Callable[[int], PageContents], length: int):
+        self.render = render
+        self.length = length
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, index: int) -> PageContents:
+        return self.render(index)
+    
+    @classmethod
+    def fromIterable(cls, contents: Iterable[PageContents], length: int):
+        """ Pages from a generator, which is only advanced as far as anyone has looked. """
+        
+        contents = iter(contents)
+        pulled: list[PageContents] = []
+        def render(index: int):
+            pulled.extend(itertools.islice(contents, max(index + 1 - len(pulled), 0)))
+            return pulled[index]
+        return cls(render, length)
+
 class Paginator:
-    def __init__(self, pages: list[Page], issuerID: int, ignoreIndex: bool):
+    def __init__(self, pages: Sequence[PageContents], issuerID: int, ignoreIndex: bool):
         self.pages = pages
         self.issuerID = issuerID
         self.ignoreIndex = ignoreIndex
+        # pages rendered so far, least recently looked at first
+        self.rendered: OrderedDict[int, Page] = OrderedDict()
         
         self.length = len(self.pages)
         self.focused = 0
         self.locked = False
         self.numbers = False
-        
+        # the reactions the bot has on the message, in order
+        self.shown: list[str] = []
+        # who to remove the bot's own reactions as
+        self.me: Optional[discord.abc.Snowflake] = None
+    
+    def render(self, i: int) -> Page:
+        page = Page(**self.pages[i])
         if not self.ignoreIndex:
-            for i, page in enumerate(pages):
-                if not page.embed:
-                    page.embed = discord.Embed(
-                        title=EMPTY,
-                        description=T.UTIL.paginationIndex(i + 1, self.length)
-                    )
-                else:
-                    page.embed.set_footer(
-                        text=T.UTIL.paginationIndex(i + 1, self.length)
-                    )
+            if not page.embed:
+                page.embed = discord.Embed(
+                    title=EMPTY,
+                    description=T.UTIL.paginationIndex(i + 1, self.length)
+                )
+            else:
+                page.embed.set_footer(
+                    text=T.UTIL.paginationIndex(i + 1, self.length)
+                )
+        return page
     
     def lock(self):
         self.locked = True
@@ -82,7 +121,7 @@ class Paginator:
         if self.numbers and not amLarg:
             reactions = T.UTIL.indices[:self.length]
         else:
-            reactions = T.UTIL.arrows
+            reactions = list(T.UTIL.arrows)
         
         if not isDM and not amLarg:
             reactions.append(T.UTIL.switches[int(self.numbers)])
@@ -107,49 +146,170 @@ class Paginator:
         
         return self.getFocused()
     
-    def getFocused(self):
-        return self.pages[self.focused]
+    def getFocused(self) -> Page:
+        if self.focused in self.rendered:
+            self.rendered.move_to_end(self.focused)
+        else:
+            self.rendered[self.focused] = self.render(self.focused)
+            if len(self.rendered) > T.UTIL.renderedPageCacheSize:
+                self.rendered.popitem(last=False)
+        return self.rendered[self.focused]
 
-toListen: dict[int, Paginator] = {}
+class PaginatorRegistry:
+    """ The paginators of sent messages by message ID, least recently used first.
+    
+    Past `capacity`, the least recently used paginator is dropped, and any left unused for `ttl`
+    seconds is dropped by `sweep`. Each keeps a partial message rather than the full one, since
+    editing and reacting only need its ID and channel.
+    """
+    
+    def __init__(self, capacity: int=T.UTIL.paginatorCapacity, ttl: float=T.UTIL.paginatorTTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.paginators: OrderedDict[int, tuple[Paginator, discord.PartialMessage, float]] = OrderedDict()
+        self.evictions = Metrics.counter(T.UTIL.metricPaginatorEvictions, T.UTIL.metricPaginatorEvictionsDesc)
+        self.expiries = Metrics.counter(T.UTIL.metricPaginatorExpiries, T.UTIL.metricPaginatorExpiriesDesc)
+        Metrics.gauge(T.UTIL.metricPaginators, T.UTIL.metricPaginatorsDesc, lambda: len(self.paginators))
+    
+    def __len__(self):
+        return len(self.paginators)
+    
+    def add(self, message: discord.Message, paginator: Paginator):
+        # the local gateway's messages aren't real ones, and are already as small as a partial message
+        partial = message.channel.get_partial_message(message.id) if isinstance(message, discord.Message) else message
+        self.paginators[message.id] = (paginator, partial, time.monotonic())
+        if len(self.paginators) > self.capacity:
+            self.paginators.popitem(last=False)
+            self.evictions.inc()
+    
+    def get(self, messageID: int) -> Optional[tuple[Paginator, discord.PartialMessage]]:
+        entry = self.paginators.get(messageID)
+        if not entry:
+            return None
+        paginator, partial, lastUsed = entry
+        if time.monotonic() - lastUsed > self.ttl:
+            del self.paginators[messageID]
+            self.expiries.inc()
+            return None
+        self.paginators[messageID] = (paginator, partial, time.monotonic())
+        self.paginators.move_to_end(messageID)
+        return paginator, partial
+    
+    def sweep(self):
+        """ Drops every paginator left unused for longer than the TTL, which are all at the front. """
         
-async def updatePaginatedMessage(message: discord.Message, user: discord.User, paginator: Paginator, emoji: Optional[str]=None):
-    if not user.id == paginator.issuerID: return
-    oldFocused = paginator.getFocused()
+        cutoff = time.monotonic() - self.ttl
+        while self.paginators and next(iter(self.paginators.values()))[2] < cutoff:
+            self.paginators.popitem(last=False)
+            self.expiries.inc()
+    
+    async def sweepForever(self, interval: float=T.UTIL.paginatorSweepInterval):
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+toListen = PaginatorRegistry()
+        
+async def gatherBounded(coros, limit: int=T.UTIL.reactionConcurrency):
+    """ Awaits coroutines together, at most `limit` at a time. """
+    
+    semaphore = asyncio.Semaphore(limit)
+    async def run(coro):
+        async with semaphore:
+            return await coro
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+def diffReactions(current: list[str], desired: list[str]) -> tuple[list[str], list[str]]:
+    """ Gets the reactions to remove and the ones to add to get from `current` to `desired`.
+    
+    Discord shows reactions in the order they were added, so only a shared prefix can stay.
+    """
+    
+    keep = 0
+    while keep < min(len(current), len(desired)) and current[keep] == desired[keep]:
+        keep += 1
+    return current[keep:], desired[keep:]
+
+async def syncReactions(message: Union[discord.Message, discord.PartialMessage], paginator: Paginator, desired: list[str]):
+    toRemove, toAdd = diffReactions(paginator.shown, desired)
+    if toRemove and len(toRemove) == len(paginator.shown) and len(toRemove) > 1:
+        # one call instead of one per reaction
+        await message.clear_reactions()
+    elif toRemove:
+        await gatherBounded(message.remove_reaction(emoji, paginator.me) for emoji in toRemove)
+    # one at a time, to keep them in order; a channel's reactions are rate limited to about that pace anyway
+    for emoji in toAdd:
+        await message.add_reaction(emoji)
+    paginator.shown = list(desired)
+
+async def updatePaginatedMessage(message: Union[discord.Message, discord.PartialMessage], userID: int, paginator: Paginator, emoji: Optional[str]=None):
+    if not userID == paginator.issuerID: return
+    isDM = isinstance(message.channel, discord.DMChannel)
+    # DMs don't get the mode switch, since the bot can't clean up reactions there; pages just flip by editing
+    if emoji in T.UTIL.switches and (isDM or paginator.locked): return
+    
+    oldFocused = paginator.focused
     focused = paginator.refocus(emoji)
-    if not oldFocused is focused:
+    if not oldFocused == paginator.focused:
         await message.edit(content=focused.content, embed=focused.embed)
-    isDM = isinstance(message.channel, discord.DMChannel)
-    if emoji in T.UTIL.switches and not isDM:
-        newReactions = paginator.getReactions(isDM)
-        await message.clear_reactions()
-        for reaction in newReactions:
-            await message.add_reaction(reaction)
-    elif emoji == None:
-        newReactions = paginator.getReactions(isDM)
-        for reaction in newReactions:
-            await message.add_reaction(reaction)
-        
+    if emoji == None or emoji in T.UTIL.switches:
+        # a click during a switch would be working from reactions that are about to change
+        paginator.lock()
+        try:
+            await syncReactions(message, paginator, paginator.getReactions(isDM))
+        finally:
+            paginator.unlock()
 
-async def paginate(ctx: commands.Context, contents: list[dict[str, Union[str, discord.Embed]]], ignoreIndex: bool=False):
-    pages = []
-    for page in contents:
-        pages.append(Page(**page))
-    if not pages:
+async def paginate(
+    ctx: commands.Context,
+    contents: Union[Sequence[PageContents], Iterable[PageContents], Callable[[int], PageContents]],
+    ignoreIndex: bool=False,
+    length: Optional[int]=None
+):
+    """ Sends pages that the issuer can flip through with reactions.
+    
+    `contents` can be a list of pages, a sequence like LazyPages that makes them as they're asked
+    for, a function from an index to a page along with `length`, or a generator, which is only
+    advanced as far as the issuer flips when `length` is given. Pages are only rendered when
+    they're shown.
+    """
+    
+    if callable(contents):
+        pages = LazyPages(contents, length)
+    elif isinstance(contents, (list, tuple, LazyPages)):
+        pages = contents
+    elif length is not None:
+        pages = LazyPages.fromIterable(contents, length)
+    else:
+        pages = list(contents)
+    if not len(pages):
         raise IndexError("No messages were given to the pagination function")
     
     paginator = Paginator(pages, ctx.author.id, ignoreIndex)
+    paginator.me = ctx.me
     focused = paginator.getFocused()
     message: discord.Message = await ctx.send(content=focused.content, embed=focused.embed)
     if len(pages) == 1: return
-    toListen[message.id] = paginator
-    await updatePaginatedMessage(message, ctx.author, paginator)
+    toListen.add(message, paginator)
+    await updatePaginatedMessage(message, ctx.author.id, paginator)
 
-async def handlePaginationReaction(reaction: discord.Reaction, user: Union[discord.Member, discord.User]):
-    if not reaction.message.id in toListen:
+async def takeBackReaction(message: Union[discord.Message, discord.PartialMessage], emoji: str, userID: int):
+    try:
+        await message.remove_reaction(emoji, discord.Object(userID))
+    except discord.NotFound:
+        # a mode switch cleared it first
+        pass
+
+async def handlePaginationReaction(messageID: int, userID: int, emoji: str):
+    """ Flips a paginated message in response to a raw reaction event, which arrives whether or not the message is cached. """
+    
+    entry = toListen.get(messageID)
+    if not entry:
         return
-    paginator = toListen[reaction.message.id]
+    paginator, message = entry
     
-    emoji = str(reaction.emoji)
-    await updatePaginatedMessage(reaction.message, user, paginator, emoji)
-    if not isinstance(reaction.message.channel, discord.DMChannel):
-        await reaction.remove(user)
+    flips = [updatePaginatedMessage(message, userID, paginator, emoji)]
+    if not isinstance(message.channel, discord.DMChannel):
+        flips.append(takeBackReaction(message, emoji, userID))
+    # the edit and taking the user's reaction back don't depend on each other, so a flip is one round trip
+    await asyncio.gather(*flips)